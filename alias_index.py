@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+TNS Alias Index
+Maps TNS names, survey internal names (ZTF, ATLAS, Pan-STARRS, ...) and
+positions to each other, built from the internal_names column of the TNS
+catalogue cached by the Node server (tns_cache.json).
+
+The index is a small SQLite file so a spawned broker process can resolve a
+name with one indexed lookup instead of loading the whole catalogue. It is
+rebuilt by whatever rewrites tns_cache.json (tns_ingest.refresh_derived,
+also spawned by server.js after its own download), never inside a lookup:
+a lookup uses the existing index even if it is behind, and only builds one
+when there is none at all.
+"""
+import os
+import re
+import sys
+import json
+import math
+import fcntl
+import sqlite3
+from datetime import datetime
+
+TNS_CACHE_FILE = "tns_cache.json"
+ALIAS_INDEX_FILE = os.environ.get("TNS_ALIAS_INDEX", "tns_alias_index.db")
+POSITION_MATCH_RADIUS = 2.0  # Arcsec; TNS positions are usually the discovery survey's own
+ZTF_NAME_PATTERN = re.compile(r'^ZTF\d{2}[a-z]{7}$', re.IGNORECASE)
+TNS_PREFIX_PATTERN = re.compile(r'^(SN|AT|TDE|FRB|KN|LRN|NOVA)\s*(?=\d{4})', re.IGNORECASE)
+
+SCHEMA = """
+CREATE TABLE objects (
+    tns_name TEXT PRIMARY KEY,
+    ztf_id TEXT,
+    ra REAL,
+    dec REAL,
+    internal_names TEXT
+);
+CREATE TABLE aliases (
+    alias TEXT PRIMARY KEY,
+    tns_name TEXT NOT NULL
+);
+CREATE TABLE meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE INDEX objects_dec ON objects (dec);
+CREATE INDEX objects_ztf_id ON objects (ztf_id);
+"""
+
+def normalize_name(name):
+    """Canonical form of an object name: no SN/AT prefix, no spaces, lower case.
+
+    "SN 2024abc", "AT2024abc" and "2024abc" all map to "2024abc", so TNS
+    names match whichever form the caller used.
+    """
+    name = TNS_PREFIX_PATTERN.sub('', str(name).strip())
+    return re.sub(r'\s+', '', name).lower()
+
+def parse_coordinate(value, is_ra):
+    """Decimal degrees from a TNS coordinate (decimal or sexagesimal), or None"""
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    parts = re.split(r'[:\s]+', str(value).strip())
+    try:
+        sign = -1.0 if parts[0].startswith('-') else 1.0
+        degrees = abs(float(parts[0])) + float(parts[1]) / 60 + float(parts[2]) / 3600
+    except (IndexError, ValueError):
+        return None
+    return sign * degrees * (15.0 if is_ra else 1.0)
+
+def split_internal_names(internal_names):
+    """Individual names from a TNS internal_names field"""
+    if not internal_names:
+        return []
+    return [name.strip() for name in re.split(r'[,;]', internal_names) if name.strip()]
+
+def load_tns_cache(tns_file=TNS_CACHE_FILE):
+    """(header, records) from the TNS cache. The header holds the fields besides
+    ``data`` (download date, object count); it is None for the legacy bare-list format."""
+    with open(tns_file, 'r') as f:
+        cache_data = json.load(f)
+    if isinstance(cache_data, dict):
+        return {key: value for key, value in cache_data.items() if key != "data"}, cache_data.get("data") or []
+    return None, cache_data
+
+def load_tns_records(tns_file=TNS_CACHE_FILE):
+    """Records from the TNS cache, in either the current or the legacy format"""
+    return load_tns_cache(tns_file)[1]
+
+def build_alias_index(tns_file=TNS_CACHE_FILE, index_file=ALIAS_INDEX_FILE, records=None, force=False):
+    """(Re)build the alias index from the TNS cache.
+
+    Builders are serialized by an flock and the index is re-checked once the
+    lock is held, so concurrent callers build it once; unless ``force`` is
+    set, an index that is already current is left alone. Each build writes
+    its own temporary file and moves it into place, so readers never see a
+    half-built index. ``records`` may be passed by a caller that already
+    holds the catalog. Returns the number of indexed objects.
+    """
+    with open(f"{index_file}.lock", 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if not force and index_is_current(tns_file, index_file):
+            return None
+        return _build_alias_index(tns_file, index_file, records)
+
+def _build_alias_index(tns_file, index_file, records):
+    # Imported here: tns_catalog itself imports this module
+    from tns_catalog import load_catalog_records
+
+    source_mtime = os.path.getmtime(tns_file)
+    if records is None:
+        records = load_catalog_records(tns_file)
+    tmp_file = f"{index_file}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+    connection = sqlite3.connect(tmp_file)
+    try:
+        connection.executescript(SCHEMA)
+        objects = []
+        aliases = {}
+        for record in records:
+            name = record.get("name")
+            if not name:
+                continue
+            prefix = record.get("name_prefix") or ""
+            tns_name = f"{prefix} {name}".strip() if prefix else name
+            internal_names = split_internal_names(record.get("internal_names"))
+            ztf_id = next((alias for alias in internal_names if ZTF_NAME_PATTERN.match(alias)), None)
+            objects.append((
+                tns_name, ztf_id,
+                parse_coordinate(record.get("ra"), True),
+                parse_coordinate(record.get("declination", record.get("dec")), False),
+                ",".join(internal_names)
+            ))
+            for alias in [name, tns_name] + internal_names:
+                aliases.setdefault(normalize_name(alias), tns_name)
+        connection.executemany("INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?)", objects)
+        connection.executemany("INSERT OR REPLACE INTO aliases VALUES (?, ?)", aliases.items())
+        connection.executemany("INSERT INTO meta VALUES (?, ?)", [
+            ("source_mtime", str(source_mtime)),
+            ("built_at", datetime.now().isoformat()),
+            ("total_objects", str(len(objects)))
+        ])
+        connection.commit()
+    except Exception:
+        connection.close()
+        os.remove(tmp_file)
+        raise
+    connection.close()
+    os.replace(tmp_file, index_file)
+    print(f"Alias index: Indexed {len(objects)} TNS objects, {len(aliases)} aliases", file=sys.stderr)
+    return len(objects)
+
+def index_is_current(tns_file=TNS_CACHE_FILE, index_file=ALIAS_INDEX_FILE):
+    """True when the index exists and was built from the current TNS cache"""
+    if not os.path.exists(index_file):
+        return False
+    if not os.path.exists(tns_file):
+        return True
+    try:
+        connection = sqlite3.connect(f"file:{index_file}?mode=ro", uri=True)
+        try:
+            row = connection.execute("SELECT value FROM meta WHERE key = 'source_mtime'").fetchone()
+        finally:
+            connection.close()
+    except sqlite3.Error:
+        return False
+    return row is not None and float(row[0]) >= os.path.getmtime(tns_file)
+
+def open_alias_index(tns_file=TNS_CACHE_FILE, index_file=ALIAS_INDEX_FILE):
+    """Read-only connection to the index, or None if there is no TNS data.
+
+    An index that is behind tns_cache.json is still used (the refresh path
+    rebuilds it); one is only built here when none exists yet.
+    """
+    if not os.path.exists(index_file):
+        if not os.path.exists(tns_file):
+            return None
+        build_alias_index(tns_file, index_file)
+    return sqlite3.connect(f"file:{index_file}?mode=ro", uri=True)
+
+def row_to_object(row):
+    tns_name, ztf_id, ra, dec, internal_names = row
+    return {
+        "tns_name": tns_name,
+        "ztf_id": ztf_id,
+        "ra": ra,
+        "dec": dec,
+        "internal_names": split_internal_names(internal_names)
+    }
+
+def lookup_name(connection, name):
+    """Object record for any known alias of an object, or None"""
+    row = connection.execute(
+        "SELECT o.tns_name, o.ztf_id, o.ra, o.dec, o.internal_names "
+        "FROM aliases a JOIN objects o ON o.tns_name = a.tns_name WHERE a.alias = ?",
+        (normalize_name(name),)
+    ).fetchone()
+    return row_to_object(row) if row else None
+
+def lookup_position(connection, ra, dec, radius_arcsec=POSITION_MATCH_RADIUS):
+    """Closest indexed object within ``radius_arcsec`` of a position, or None"""
+    ra, dec = float(ra), float(dec)
+    radius_deg = radius_arcsec / 3600.0
+    ra_window = min(180.0, radius_deg / max(math.cos(math.radians(dec)), 1e-6))
+    rows = connection.execute(
+        "SELECT tns_name, ztf_id, ra, dec, internal_names FROM objects WHERE dec BETWEEN ? AND ?",
+        (dec - radius_deg, dec + radius_deg)
+    ).fetchall()
+    best = None
+    for row in rows:
+        if row[2] is None:
+            continue
+        delta_ra = (row[2] - ra + 180.0) % 360.0 - 180.0
+        if abs(delta_ra) > ra_window:
+            continue
+        separation = math.degrees(math.acos(min(1.0,
+            math.sin(math.radians(dec)) * math.sin(math.radians(row[3])) +
+            math.cos(math.radians(dec)) * math.cos(math.radians(row[3])) * math.cos(math.radians(delta_ra))
+        ))) * 3600
+        if separation <= radius_arcsec and (best is None or separation < best[0]):
+            best = (separation, row)
+    if best is None:
+        return None
+    return dict(row_to_object(best[1]), separation_arcsec=round(best[0], 3))
+
+def resolve_object(name=None, ra=None, dec=None, radius_arcsec=POSITION_MATCH_RADIUS):
+    """Find the TNS object for a name (any alias) or, failing that, a position.
+
+    Returns the object record (TNS name, ZTF ID, position and internal names)
+    or None when there is no match or no TNS data to index.
+    """
+    try:
+        connection = open_alias_index()
+        if connection is None:
+            return None
+        try:
+            if name:
+                record = lookup_name(connection, name)
+                if record:
+                    return record
+            if ra is not None and dec is not None and ra != '' and dec != '':
+                return lookup_position(connection, ra, dec, radius_arcsec)
+            return None
+        finally:
+            connection.close()
+    except Exception as e:
+        print(f"Alias index: Lookup failed: {str(e)}", file=sys.stderr)
+        return None
+
+def resolve_ztf_id(name=None, ra=None, dec=None):
+    """ZTF ID for a name or position, or None.
+
+    ZTF IDs are returned as given without touching the index.
+    """
+    if name and ZTF_NAME_PATTERN.match(str(name).strip()):
+        return str(name).strip()
+    record = resolve_object(name, ra, dec)
+    return record["ztf_id"] if record else None
+
+if __name__ == "__main__":
+    # Command line interface: '{"action": "build"}' or '{"action": "resolve", "name": "2024abc"}'
+    if len(sys.argv) != 2:
+        print("Usage: python alias_index.py '<json_args>'")
+        sys.exit(1)
+
+    try:
+        args = json.loads(sys.argv[1])
+        action = args.get('action', 'resolve')
+        if action == 'build':
+            total = build_alias_index(args.get('tns_file', TNS_CACHE_FILE), force=True)
+            result = {"success": True, "data": {"total_objects": total}}
+        elif action == 'resolve':
+            record = resolve_object(args.get('name'), args.get('ra'), args.get('dec'))
+            if record:
+                result = {"success": True, "data": record}
+            else:
+                result = {"success": False, "error": "No matching TNS object"}
+        else:
+            result = {"success": False, "error": f"Unknown action: {action}"}
+        print(json.dumps(result))
+
+    except Exception as e:
+        error_result = {"success": False, "error": f"Script error: {str(e)}"}
+        print(json.dumps(error_result))
@@ -1,19 +1,91 @@
-import json
-import requests
+import os
 import sys
-from urllib.parse import urlencode
+import json
+import time
+import threading
+from collections import OrderedDict
+
+# broker_client.py lives in the project root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from broker_client import get_credential_key, get_request_kind, handle_request
+from serialization import dumps_json
+
+# Seconds a response stays in the in-process cache, per mode/broker
+RESPONSE_CACHE_TTLS = {
+    'alerce': 600,
+    'antares': 600,
+    'fink': 600,
+    'lasair': 600,
+    'lightcurve': 600,
+    'crossmatch': 86400
+}
+RESPONSE_CACHE_MAX_ENTRIES = 512
+
+_response_cache = OrderedDict()
+_response_cache_lock = threading.Lock()
+
+def build_broker_args(params):
+    """Translate the handler's query parameters into broker_client arguments"""
+    args = {
+        'broker': params.get('broker', ''),
+        'ra': params.get('ra') or None,
+        'dec': params.get('dec') or None,
+        'ztf_id': params.get('ztf_id') or params.get('name') or None,
+        'radius': params.get('radius', '2')
+    }
+    mode = params.get('mode', '')
+    if mode in ('crossmatch', 'lightcurve'):
+        args['mode'] = mode
+    if params.get('token'):
+        args['api_token'] = params.get('token')
+    if params.get('max_points'):
+        args['max_points'] = int(params.get('max_points'))
+    return args
+
+def get_response_cache_key(args):
+    """Cache key for a request; token-gated brokers key on a hash of the token, never the token itself"""
+    key = {name: value for name, value in args.items() if name != 'api_token'}
+    credential = get_credential_key(args)
+    if credential:
+        key['credential'] = credential
+    return json.dumps(key, sort_keys=True)
+
+def get_cached_response(key):
+    """Cached (status, body, stored_at, ttl) for a key, or None if missing or expired"""
+    with _response_cache_lock:
+        entry = _response_cache.get(key)
+        if entry is None:
+            return None
+        status, body, stored_at, ttl = entry
+        if time.time() - stored_at > ttl:
+            del _response_cache[key]
+            return None
+        _response_cache.move_to_end(key)
+        return entry
+
+def save_cached_response(key, status, body, ttl):
+    """Store a response, evicting the least recently used entries beyond the size limit"""
+    with _response_cache_lock:
+        _response_cache[key] = (status, body, time.time(), ttl)
+        _response_cache.move_to_end(key)
+        while len(_response_cache) > RESPONSE_CACHE_MAX_ENTRIES:
+            _response_cache.popitem(last=False)
 
 def handler(request):
     """
     Broker API handler for the Transient Meta-Broker.
 
     Handles requests to various astronomical broker services:
-    - ALeRCE
-    - Antares  
+    - ALeRCE (including mode=crossmatch and mode=lightcurve)
+    - Antares
     - Fink
     - Lasair
 
-    Docker deployment handler for broker API requests.
+    Requests are dispatched in-process to broker_client.py. Successful
+    responses are cached in memory for a per-mode TTL (on top of
+    broker_client's on-disk result cache); X-Cache reports HIT, MISS or
+    BYPASS, and a "Cache-Control: no-cache" request skips the cache.
     """
     # Set CORS headers
     headers = {
@@ -22,112 +94,52 @@ def handler(request):
         'Access-Control-Allow-Headers': 'Content-Type',
         'Content-Type': 'application/json'
     }
-    
+
     if request.method == 'OPTIONS':
         return {
             'statusCode': 200,
             'headers': headers,
             'body': ''
         }
-    
+
     try:
-        # Parse broker and parameters from query string
-        broker = request.args.get('broker', '')
-        ra = request.args.get('ra', '')
-        dec = request.args.get('dec', '')
-        name = request.args.get('name', '')
-        ztf_id = request.args.get('ztf_id', '')
-        mode = request.args.get('mode', '')
-        radius = request.args.get('radius', '2')
-        
-        # For now, return mock data structure that matches expected format
-        if broker == 'alerce':
-            if mode == 'crossmatch':
-                mock_data = {
-                    "success": True,
-                    "data": {
-                        "matches": [
-                            {
-                                "catalog": "GAIA/DR2",
-                                "distance_arcsec": 0.5,
-                                "ra": float(ra) if ra else 0,
-                                "dec": float(dec) if dec else 0,
-                                "g_mean_mag": 19.2
-                            }
-                        ]
-                    }
-                }
-            elif mode == 'lightcurve':
-                mock_data = {
-                    "success": True,
-                    "data": {
-                        "detections": [
-                            {"mjd": 59000.5, "mag": 19.5, "magerr": 0.1, "fid": 1},
-                            {"mjd": 59001.5, "mag": 19.3, "magerr": 0.1, "fid": 2}
-                        ]
-                    }
-                }
-            else:
-                mock_data = {
-                    "success": True,
-                    "data": {
-                        "oid": ztf_id or name,
-                        "ra": float(ra) if ra else 0,
-                        "dec": float(dec) if dec else 0,
-                        "class": "SN Ia",
-                        "probability": 0.85
-                    }
-                }
-        elif broker == 'antares':
-            mock_data = {
-                "success": True,
-                "data": {
-                    "objectId": name,
-                    "ra": float(ra) if ra else 0,
-                    "dec": float(dec) if dec else 0,
-                    "tags": ["SN", "variable"],
-                    "alerts": 15
-                }
-            }
-        elif broker == 'fink':
-            mock_data = {
-                "success": True,
-                "data": {
-                    "objectId": ztf_id or name,
-                    "alerts": [
-                        {"jd": 2459000.5, "magpsf": 19.2, "sigmapsf": 0.1, "fid": 1}
-                    ],
-                    "class": "SN Ia"
-                }
-            }
-        elif broker == 'lasair':
-            mock_data = {
-                "success": True,
-                "data": {
-                    "objectId": ztf_id or name,
-                    "ra": float(ra) if ra else 0,
-                    "dec": float(dec) if dec else 0,
-                    "sherlock_classifications": [
-                        {
-                            "classification": "SN",
-                            "context_description": "Stellar source detected in host galaxy",
-                            "distance": 0.8
-                        }
-                    ]
-                }
-            }
+        args = build_broker_args(request.args)
+        kind = get_request_kind(args)
+        ttl = RESPONSE_CACHE_TTLS.get(kind)
+        request_headers = getattr(request, 'headers', None) or {}
+        bypass = 'no-cache' in (request_headers.get('Cache-Control') or '')
+
+        key = get_response_cache_key(args)
+        if ttl and not bypass:
+            cached = get_cached_response(key)
+            if cached is not None:
+                status, body, stored_at, _ = cached
+                age = int(time.time() - stored_at)
+                headers.update({
+                    'X-Cache': 'HIT',
+                    'Age': str(age),
+                    'Cache-Control': f'public, max-age={max(0, ttl - age)}'
+                })
+                return {'statusCode': status, 'headers': headers, 'body': body}
+
+        result = handle_request(dict(args, use_cache=not bypass))
+        status = 200 if result.get('success') else result.get('status_code', 404)
+        body = dumps_json(result)
+
+        # Stale results are being refreshed in the background and must not be pinned in memory
+        stale = (result.get('cache') or {}).get('status') == 'stale'
+        if ttl and result.get('success') and not result.get('partial') and not stale:
+            save_cached_response(key, status, body, ttl)
+            headers.update({'X-Cache': 'BYPASS' if bypass else 'MISS', 'Cache-Control': f'public, max-age={ttl}'})
         else:
-            mock_data = {
-                "success": False,
-                "error": f"Unknown broker: {broker}"
-            }
-        
+            headers.update({'X-Cache': 'BYPASS' if bypass or not ttl else 'MISS', 'Cache-Control': 'no-store'})
+
         return {
-            'statusCode': 200 if mock_data.get('success') else 404,
+            'statusCode': status,
             'headers': headers,
-            'body': json.dumps(mock_data)
+            'body': body
         }
-        
+
     except Exception as e:
         return {
             'statusCode': 500,
@@ -136,4 +148,4 @@ def handler(request):
                 'success': False,
                 'error': str(e)
             })
-        } 
\ No newline at end of file
+        }
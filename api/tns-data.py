@@ -2,22 +2,196 @@
 TNS Data API handler for the Transient Meta-Broker.
 
 Docker deployment handler to get TNS data with persistent file caching.
+
+The catalog is serialized once per refresh into a snapshot directory with
+gzip and brotli variants compressed at write time; requests are answered
+from those files with ETag/Last-Modified validators, so a repeat visit is
+a 304 and a first visit downloads the smallest encoding the client accepts.
 """
 
+import io
+import sys
 import json
 import csv
 import os
+import gzip
+import base64
+import hashlib
+import fcntl
+from email.utils import formatdate, parsedate_to_datetime
 from urllib.parse import parse_qs
 
+try:
+    import brotli
+except ImportError:  # Optional: without it only gzip and identity are served
+    brotli = None
+
+# tns_catalog.py lives in the project root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tns_catalog import get_catalog, snapshot_is_stale
+
 # Define paths relative to project root
 CACHE_FILE = 'tns_cache.json'
+SNAPSHOT_DIR = 'tns_snapshot'
+SNAPSHOT_META_FILE = os.path.join(SNAPSHOT_DIR, 'meta.json')
+SNAPSHOT_LOCK_FILE = os.path.join(SNAPSHOT_DIR, '.lock')
+KEEP_GENERATIONS = 2  # The current generation and the one before it
+# Content-Encoding -> file suffix, in order of preference
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+def write_atomic(path, data):
+    """Write bytes to path via a temporary file so readers never see a partial file"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def read_snapshot_meta():
+    """Metadata of the current snapshot generation, or None"""
+    try:
+        with open(SNAPSHOT_META_FILE, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def snapshot_is_current(meta, cache_file=CACHE_FILE):
+    """True if meta points at a complete snapshot taken after the last change to the cache file"""
+    return bool(meta) and 'file' in meta and \
+        os.path.exists(os.path.join(SNAPSHOT_DIR, meta['file'])) and \
+        meta.get('source_mtime', 0) >= os.path.getmtime(cache_file)
+
+def catalog_body(catalog):
+    """The TNS cache document serialized from the mapped catalog, one record at a time"""
+    out = io.BytesIO()
+    # The header fields, then the records as the value of a final "data" key
+    out.write(json.dumps(dict(catalog.header, data=[]), separators=(',', ':'))[:-2].encode('utf-8'))
+    for i, record in enumerate(catalog):
+        if i:
+            out.write(b',')
+        out.write(json.dumps(record, separators=(',', ':')).encode('utf-8'))
+    out.write(b']}')
+    return out.getvalue()
+
+def build_snapshot(cache_file=CACHE_FILE, force=False):
+    """Serialize the TNS cache once and precompress it.
+
+    The body is serialized from tns_catalog's mapped snapshot when that is
+    current, so the catalog is not parsed from JSON again. Each build writes
+    a new generation (gen-<n>.json plus its .gz/.br variants) and then
+    atomically replaces meta.json, the pointer to the current generation,
+    so a reader always gets a body and variants from the same generation.
+    Builds are serialized with a lock; a build that
+    finds the snapshot already current once it holds the lock returns the
+    existing metadata unless ``force`` is set. Returns the snapshot metadata
+    (ETag, Last-Modified, available encodings, generation file).
+    """
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    with open(SNAPSHOT_LOCK_FILE, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        previous = read_snapshot_meta()
+        if not force and snapshot_is_current(previous, cache_file):
+            return previous
+        source_mtime = os.path.getmtime(cache_file)
+        catalog = None if snapshot_is_stale(tns_file=cache_file) else get_catalog(tns_file=cache_file, rebuild=False)
+        if catalog is not None and catalog.header is not None:
+            body = catalog_body(catalog)
+        else:
+            # No current mapped catalog yet (or a legacy cache without a header): parse the JSON
+            with open(cache_file, 'r') as f:
+                tns_data = json.load(f)
+            body = json.dumps(tns_data, separators=(',', ':')).encode('utf-8')
+        generation = previous.get('generation', 0) + 1 if previous else 1
+        file_name = f'gen-{generation:06d}.json'
+        path = os.path.join(SNAPSHOT_DIR, file_name)
+        encodings = []
+        write_atomic(path + '.gz', gzip.compress(body, compresslevel=9))
+        encodings.append('gzip')
+        if brotli is not None:
+            write_atomic(path + '.br', brotli.compress(body, quality=11))
+            encodings.append('br')
+        write_atomic(path, body)
+        meta = {
+            'etag': hashlib.md5(body).hexdigest(),
+            'last_modified': formatdate(source_mtime, usegmt=True),
+            'source_mtime': source_mtime,
+            'encodings': encodings,
+            'size': len(body),
+            'generation': generation,
+            'file': file_name
+        }
+        write_atomic(SNAPSHOT_META_FILE, json.dumps(meta).encode('utf-8'))
+
+        # A request that read the previous meta may still be opening its files
+        for name in os.listdir(SNAPSHOT_DIR):
+            if name.startswith('gen-') and name[4:10].isdigit() and \
+                    int(name[4:10]) <= generation - KEEP_GENERATIONS:
+                os.remove(os.path.join(SNAPSHOT_DIR, name))
+        return meta
+
+def get_snapshot(cache_file=CACHE_FILE):
+    """Metadata of an up-to-date snapshot.
+
+    tns_ingest.refresh_derived rebuilds it after every refresh; it is only
+    built here if the TNS cache changed without one.
+    """
+    meta = read_snapshot_meta()
+    if snapshot_is_current(meta, cache_file):
+        return meta
+    return build_snapshot(cache_file)
+
+def get_request_header(event, name):
+    """Case-insensitive request header lookup (empty string if absent)"""
+    request_headers = getattr(event, 'headers', None) or {}
+    for key, value in request_headers.items():
+        if key.lower() == name.lower():
+            return value or ''
+    return ''
+
+def choose_encoding(accept_encoding, available):
+    """Best available Content-Encoding allowed by an Accept-Encoding header, or None for identity"""
+    accepted = {}
+    for part in accept_encoding.split(','):
+        pieces = part.strip().split(';')
+        coding = pieces[0].strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in pieces[1:]:
+            if param.strip().startswith('q='):
+                try:
+                    quality = float(param.strip()[2:])
+                except ValueError:
+                    quality = 0.0
+        accepted[coding] = quality
+    for encoding, _ in ENCODINGS:
+        if encoding in available and accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+def is_not_modified(event, etag, last_modified, source_mtime):
+    """True when the client's validators show it already has this snapshot"""
+    if_none_match = get_request_header(event, 'If-None-Match')
+    if if_none_match:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        # Encoded variants carry suffixed ETags ("<hash>-gzip"); any of them matches
+        return '*' in tags or any(tag.replace('W/', '').strip('"').split('-')[0] == etag for tag in tags)
+    if_modified_since = get_request_header(event, 'If-Modified-Since')
+    if if_modified_since:
+        try:
+            return int(source_mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
 
 def handler(event, context=None):
     """
     Handler function to get TNS data from cache or demo data.
     Returns cached TNS data if available, otherwise returns demo dataset.
     """
-    
+
     # CORS headers for browser compatibility
     headers = {
         'Access-Control-Allow-Origin': '*',
@@ -25,26 +199,57 @@ def handler(event, context=None):
         'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
         'Content-Type': 'application/json'
     }
-    
+
     if event.method == 'OPTIONS':
         return {
             'statusCode': 200,
             'headers': headers,
             'body': ''
         }
-    
+
     try:
-        # Try to read from cache file
+        # Serve the precompressed snapshot of the cache file
         if os.path.exists(CACHE_FILE):
-            with open(CACHE_FILE, 'r') as f:
-                tns_data = json.load(f)
-            
+            meta = get_snapshot()
+            encoding = choose_encoding(get_request_header(event, 'Accept-Encoding'), meta['encodings'])
+            etag = f'"{meta["etag"]}-{encoding}"' if encoding else f'"{meta["etag"]}"'
+            headers.update({
+                'ETag': etag,
+                'Last-Modified': meta['last_modified'],
+                'Cache-Control': 'no-cache',  # Always revalidate; unchanged data costs a 304
+                'Vary': 'Accept-Encoding'
+            })
+
+            if is_not_modified(event, meta['etag'], meta['last_modified'], meta['source_mtime']):
+                return {
+                    'statusCode': 304,
+                    'headers': headers,
+                    'body': ''
+                }
+
+            snapshot_file = os.path.join(SNAPSHOT_DIR, meta['file'])
+            if encoding:
+                suffix = dict(ENCODINGS)[encoding]
+                with open(snapshot_file + suffix, 'rb') as f:
+                    body = f.read()
+                headers['Content-Encoding'] = encoding
+                headers['Content-Length'] = str(len(body))
+                return {
+                    'statusCode': 200,
+                    'headers': headers,
+                    'body': base64.b64encode(body).decode('ascii'),
+                    'isBase64Encoded': True
+                }
+
+            with open(snapshot_file, 'rb') as f:
+                body = f.read()
+            headers['Content-Length'] = str(len(body))
             return {
                 'statusCode': 200,
                 'headers': headers,
-                'body': json.dumps(tns_data)
+                'body': body.decode('utf-8')
             }
-        
+
         # If no cache, return demo data (fallback)
         demo_data = [
             {
@@ -60,16 +265,20 @@ def handler(event, context=None):
                 "source_group": "Public ESO Survey"
             }
         ]
-        
+
         return {
             'statusCode': 200,
             'headers': headers,
             'body': json.dumps(demo_data)
         }
-        
+
     except Exception as e:
         return {
             'statusCode': 500,
             'headers': headers,
             'body': json.dumps({'error': str(e)})
-        } 
\ No newline at end of file
+        }
+
+if __name__ == '__main__':
+    # Rebuild the snapshot after a TNS download: python api/tns-data.py
+    print(json.dumps(build_snapshot(force=True)))
@@ -6,19 +6,41 @@ Handles authentication, queuing, and data retrieval from ATLAS forced photometry
 import os
 import re
 import sys
+import glob
 import time
 from io import StringIO
 import json
 import hashlib
 from datetime import datetime, timedelta
 
-import pandas as pd
 import requests
-import numpy as np
+
+# pandas and numpy are imported in download_atlas_results(), the only code
+# that parses photometry, so cache hits and errors start up without them
+from atlas_jobs import (QUEUING_TIMEOUT, claim_job, claim_jobs, jobs_for_task, record_done, record_failed,
+                        record_finished, record_packed_queued, record_queued, update_task)
+from resilience import Deadline, create_session
+from revalidate import cache_info, spawn_refresh
+from serialization import records_from_columns, write_output
 
 BASEURL = "https://fallingstar-data.com/forcedphot"
 CACHE_DIR = "atlas_cache"
 CACHE_DURATION = 7  # Cache data for 7 days
+CACHE_STALE_GRACE = 30  # Days past CACHE_DURATION during which cached data is served stale while it is refreshed
+PACKED_COORDINATES_FIELD = "radeclist"  # Queue field taking a multi-target coordinate list
+MAX_PACKED_TARGETS = 100  # Targets per packed job
+MAX_WINDOW_PADDING = 30  # Days of photometry outside a target's own window a packed job may fetch for it
+PACK_MATCH_RADIUS = 1.0  # Arcsec between a packed result row and the target it is assigned to
+SPLIT_CHUNK_ROWS = 20000  # Rows matched against the targets at a time when splitting a packed result
+
+_session = None
+
+def get_session():
+    """Return a process-wide session; ATLAS calls go through the resilience layer"""
+    global _session
+    if _session is None:
+        _session = create_session()
+    return _session
 
 def ensure_cache_dir():
     """Ensure the cache directory exists"""
@@ -53,11 +75,13 @@ def load_from_cache(cache_file):
         return None
 
 def save_to_cache(cache_file, data):
-    """Save ATLAS data to cache"""
+    """Save ATLAS data to cache (atomically: background refreshes write while others read)"""
     ensure_cache_dir()
     try:
-        with open(cache_file, 'w') as f:
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w') as f:
             json.dump(data, f)
+        os.replace(tmp_file, cache_file)
     except Exception as e:
         print(f"Error saving to cache: {e}", file=sys.stderr)
 
@@ -71,20 +95,45 @@ def get_cached_result(cache_key):
             return cached_data
     return None
 
+def find_cached_result(cache_key, ra, dec, allow_stale=True):
+    """(cached data, age in seconds, exact) for a request, or None.
+
+    The entry for the exact key is preferred. Because the MJD window of a
+    recent object moves with the current date, an entry for the same
+    position with an older window may exist instead; it is returned with
+    ``exact`` False, to be served as stale. Entries older than
+    CACHE_DURATION (plus CACHE_STALE_GRACE if ``allow_stale``) are ignored.
+    """
+    max_age = (CACHE_DURATION + (CACHE_STALE_GRACE if allow_stale else 0)) * 86400
+    exact_file = os.path.join(CACHE_DIR, f"atlas_{cache_key}.json")
+    candidates = [exact_file] if os.path.exists(exact_file) else []
+    if allow_stale and not candidates:
+        candidates = sorted(glob.glob(os.path.join(CACHE_DIR, f"atlas_atlas_{ra:.6f}_{dec:.6f}_*.json")),
+                            key=os.path.getmtime, reverse=True)[:1]
+    for cache_file in candidates:
+        age = time.time() - os.path.getmtime(cache_file)
+        if age > max_age:
+            continue
+        cached_data = load_from_cache(cache_file)
+        if cached_data:
+            return cached_data, age, cache_file == exact_file
+    return None
+
 def save_to_cache_with_key(cache_key, data):
     """Save data to cache using cache key"""
     cache_file = os.path.join(CACHE_DIR, f"atlas_{cache_key}.json")
     save_to_cache(cache_file, data)
 
-def get_atlas_token(username, password):
+def get_atlas_token(username, password, deadline=None):
     """Get authentication token from ATLAS API"""
+    deadline = Deadline.from_value(deadline)
     if not username or not password:
         return {"success": False, "error": "ATLAS credentials not provided"}
     
     data = {"username": username, "password": password}
     
     try:
-        resp = requests.post(url=f"{BASEURL}/api-token-auth/", data=data, timeout=30)
+        resp = get_session().post(url=f"{BASEURL}/api-token-auth/", data=data, timeout=deadline.timeout(30))
         
         if resp.status_code == 200:
             token = resp.json()["token"]
@@ -105,8 +154,13 @@ def get_atlas_token(username, password):
     except Exception as e:
         return {"success": False, "error": f"Authentication error: {str(e)}"}
 
-def queue_atlas_job(token, ra, dec, mjd_min, mjd_max=None):
-    """Queue a forced photometry job with ATLAS"""
+def queue_atlas_job(token, ra, dec, mjd_min, mjd_max=None, deadline=None, coordinates=None):
+    """Queue a forced photometry job with ATLAS.
+
+    ``coordinates`` (a list of (ra, dec) pairs) queues one packed job for all
+    of them instead of a single position; ra and dec are then ignored.
+    """
+    deadline = Deadline.from_value(deadline)
     url = "https://fallingstar-data.com/forcedphot/queue/"
     
     data = {
@@ -122,31 +176,40 @@ def queue_atlas_job(token, ra, dec, mjd_min, mjd_max=None):
     if mjd_max is not None:
         data["mjd_max"] = mjd_max
     
+    if coordinates:
+        # Multi-target list: one "ra dec" pair per line
+        del data["ra"], data["dec"]
+        data[PACKED_COORDINATES_FIELD] = "\n".join(f"{t_ra} {t_dec}" for t_ra, t_dec in coordinates)
+    
     headers = {
         "Authorization": f"Token {token}",
         "Accept": "application/json"
     }
     
     try:
-        with requests.Session() as s:
-            resp = s.post(url, json=data, headers=headers, timeout=30)
+        s = get_session()
+        resp = s.post(url, json=data, headers=headers, timeout=deadline.timeout(30))
+        
+        if resp.status_code == 201:
+            job_data = resp.json()
+            task_url = job_data["url"]
+            print(f"Job queued at {job_data['timestamp']}", file=sys.stderr)
+            return {"success": True, "task_url": task_url}
+        else:
+            error_msg = f"Queue job failed with status {resp.status_code}"
+            if resp.text:
+                error_msg += f": {resp.text}"
+            return {"success": False, "error": error_msg}
             
-            if resp.status_code == 201:
-                job_data = resp.json()
-                task_url = job_data["url"]
-                print(f"Job queued at {job_data['timestamp']}", file=sys.stderr)
-                return {"success": True, "task_url": task_url}
-            else:
-                error_msg = f"Queue job failed with status {resp.status_code}"
-                if resp.text:
-                    error_msg += f": {resp.text}"
-                return {"success": False, "error": error_msg}
-                
     except Exception as e:
         return {"success": False, "error": f"Queue job error: {str(e)}"}
 
-def wait_for_results(token, task_url, max_wait_time=600):
+def wait_for_results(token, task_url, max_wait_time=600, deadline=None):
     """Wait for ATLAS job to complete and return results URL"""
+    deadline = Deadline.from_value(deadline)
+    if deadline.remaining() is not None:
+        # Never poll past the request deadline
+        max_wait_time = min(max_wait_time, deadline.remaining())
     headers = {"Authorization": f"Token {token}", "Accept": "application/json"}
     
     result_url = None
@@ -159,64 +222,64 @@ def wait_for_results(token, task_url, max_wait_time=600):
         elapsed_time = time.time() - start_time
         
         if elapsed_time > max_wait_time:
-            return {"success": False, "error": f"Job timed out after {max_wait_time} seconds ({poll_count} polls)"}
+            return {"success": False, "error": f"Job timed out after {max_wait_time:.0f} seconds ({poll_count} polls)", "task_url": task_url}
         
         try:
-            with requests.Session() as s:
-                resp = s.get(task_url, headers=headers, timeout=30)
+            s = get_session()
+            resp = s.get(task_url, headers=headers, timeout=min(30, max(1, max_wait_time - elapsed_time)))
+            
+            if resp.status_code == 200:
+                job_data = resp.json()
+                
+                # Debug: Print job status on every poll after job starts
+                if job_data.get("starttimestamp") and poll_count % 5 == 0:  # Every 5th poll after start
+                    print(f"Poll #{poll_count}: Job status check at {elapsed_time:.1f}s - finished: {job_data.get('finished', False)}", file=sys.stderr)
                 
-                if resp.status_code == 200:
-                    job_data = resp.json()
+                if job_data.get("finishtimestamp"):
+                    # Debug: Print the full job_data structure to see what fields are available
+                    print(f"Job finished. Full job_data: {json.dumps(job_data, indent=2)}", file=sys.stderr)
                     
-                    # Debug: Print job status on every poll after job starts
-                    if job_data.get("starttimestamp") and poll_count % 5 == 0:  # Every 5th poll after start
-                        print(f"Poll #{poll_count}: Job status check at {elapsed_time:.1f}s - finished: {job_data.get('finished', False)}", file=sys.stderr)
+                    # Check if there's an error message that indicates no data
+                    error_msg = job_data.get("error_msg", "")
+                    if error_msg and "No data returned" in error_msg:
+                        return {"success": True, "result_url": None, "no_data": True}
                     
-                    if job_data.get("finishtimestamp"):
-                        # Debug: Print the full job_data structure to see what fields are available
-                        print(f"Job finished. Full job_data: {json.dumps(job_data, indent=2)}", file=sys.stderr)
-                        
-                        # Check if there's an error message that indicates no data
-                        error_msg = job_data.get("error_msg", "")
-                        if error_msg and "No data returned" in error_msg:
-                            return {"success": True, "result_url": None, "no_data": True}
-                        
-                        # Try different possible field names for the result URL
-                        result_url = (job_data.get("result_url") or 
-                                    job_data.get("resulturl") or 
-                                    job_data.get("result") or 
-                                    job_data.get("download_url") or
-                                    job_data.get("url"))
-                        
-                        # If we still don't have a result_url, try constructing one from the job data
-                        if not result_url and job_data.get("id"):
-                            # Sometimes the download URL needs to be constructed
-                            job_id = job_data.get("id")
-                            constructed_url = f"https://fallingstar-data.com/forcedphot/queue/{job_id}/results/"
-                            print(f"No result_url found, trying constructed URL: {constructed_url}", file=sys.stderr)
-                            result_url = constructed_url
-                        
-                        if result_url:
-                            return {"success": True, "result_url": result_url}
-                        else:
-                            return {"success": False, "error": f"Job completed but no result URL found. Available fields: {list(job_data.keys())}, Error message: {error_msg}"}
-                        
-                    elif job_data.get("starttimestamp"):
-                        if not taskstarted_printed:
-                            print(f"Job started at {job_data['starttimestamp']}", file=sys.stderr)
-                            taskstarted_printed = True
-                        time.sleep(3)  # Increased from 2 to 3 seconds between polls
-                        
+                    # Try different possible field names for the result URL
+                    result_url = (job_data.get("result_url") or 
+                                job_data.get("resulturl") or 
+                                job_data.get("result") or 
+                                job_data.get("download_url") or
+                                job_data.get("url"))
+                    
+                    # If we still don't have a result_url, try constructing one from the job data
+                    if not result_url and job_data.get("id"):
+                        # Sometimes the download URL needs to be constructed
+                        job_id = job_data.get("id")
+                        constructed_url = f"https://fallingstar-data.com/forcedphot/queue/{job_id}/results/"
+                        print(f"No result_url found, trying constructed URL: {constructed_url}", file=sys.stderr)
+                        result_url = constructed_url
+                    
+                    if result_url:
+                        return {"success": True, "result_url": result_url}
                     else:
-                        print(f"Job queued at {job_data.get('timestamp', 'unknown time')}", file=sys.stderr)
-                        time.sleep(5)  # Increased from 4 to 5 seconds for queued jobs
-                        
+                        return {"success": False, "error": f"Job completed but no result URL found. Available fields: {list(job_data.keys())}, Error message: {error_msg}"}
+                    
+                elif job_data.get("starttimestamp"):
+                    if not taskstarted_printed:
+                        print(f"Job started at {job_data['starttimestamp']}", file=sys.stderr)
+                        taskstarted_printed = True
+                    time.sleep(3)  # Increased from 2 to 3 seconds between polls
+                    
                 else:
-                    error_msg = f"Status check failed: HTTP {resp.status_code}"
-                    if resp.text:
-                        error_msg += f" - {resp.text}"
-                    return {"success": False, "error": error_msg}
+                    print(f"Job queued at {job_data.get('timestamp', 'unknown time')}", file=sys.stderr)
+                    time.sleep(5)  # Increased from 4 to 5 seconds for queued jobs
                     
+            else:
+                error_msg = f"Status check failed: HTTP {resp.status_code}"
+                if resp.text:
+                    error_msg += f" - {resp.text}"
+                return {"success": False, "error": error_msg}
+                
         except requests.exceptions.Timeout:
             print(f"Poll #{poll_count}: Timeout during status check at {elapsed_time:.1f}s", file=sys.stderr)
             time.sleep(5)  # Wait before retrying after timeout
@@ -226,120 +289,202 @@ def wait_for_results(token, task_url, max_wait_time=600):
             time.sleep(5)  # Wait before retrying after error
             continue
 
-def download_atlas_results(token, result_url):
-    """Download and parse ATLAS photometry results"""
+def split_packed_photometry(columns, row_ra, row_dec, targets):
+    """Per-target column sets of a packed job's combined table.
+
+    A row belongs to the nearest target position within PACK_MATCH_RADIUS,
+    and goes to every target at that position whose own MJD window contains
+    it (the packed job ran over the union of the windows, and targets at
+    the same position may have different windows). Rows are matched in
+    chunks to bound the distance matrix, then grouped with one stable sort.
+    """
+    import numpy as np
+
+    target_ra = np.array([t["ra"] for t in targets], dtype=float)
+    target_dec = np.array([t["dec"] for t in targets], dtype=float)
+    target_min = np.array([t["mjd_min"] for t in targets], dtype=float)
+    target_max = np.array([t["mjd_max"] for t in targets], dtype=float)
+    cos_dec = np.cos(np.radians(target_dec))
+    radius_sq = (PACK_MATCH_RADIUS / 3600.0) ** 2
+    mjd = columns["mjd"]
+    n_rows = row_ra.size
+    row_parts, target_parts = [], []
+    unmatched = 0
+    for start in range(0, n_rows, SPLIT_CHUNK_ROWS):
+        rows = slice(start, start + SPLIT_CHUNK_ROWS)
+        # Flat-sky offsets are plenty at arcsecond scale; wrap RA across 0/360
+        dra = ((row_ra[rows, None] - target_ra[None, :] + 180.0) % 360.0 - 180.0) * cos_dec[None, :]
+        ddec = row_dec[rows, None] - target_dec[None, :]
+        distance_sq = np.nan_to_num(dra ** 2 + ddec ** 2, nan=np.inf)
+        nearest_sq = distance_sq.min(axis=1)
+        matched = nearest_sq <= radius_sq
+        unmatched += int(np.count_nonzero(~matched))
+        # Targets at the nearest position tie exactly; each keeps the rows inside its own window
+        chunk_mjd = mjd[rows, None]
+        member = (distance_sq == nearest_sq[:, None]) & matched[:, None] & \
+            (chunk_mjd >= target_min[None, :]) & (chunk_mjd <= target_max[None, :])
+        row_index, target_index = np.nonzero(member)
+        row_parts.append(row_index + start)
+        target_parts.append(target_index)
+    if unmatched:
+        print(f"Packed job: {unmatched} rows matched no target within {PACK_MATCH_RADIUS} arcsec", file=sys.stderr)
+
+    row_index = np.concatenate(row_parts) if row_parts else np.zeros(0, dtype=int)
+    target_index = np.concatenate(target_parts) if target_parts else np.zeros(0, dtype=int)
+    order = np.argsort(target_index, kind="stable")
+    selected = row_index[order]
+    bounds = np.concatenate(([0], np.cumsum(np.bincount(target_index, minlength=len(targets)))))
+    grouped = {name: values[selected] for name, values in columns.items()}
+    return [{name: values[bounds[i]:bounds[i + 1]] for name, values in grouped.items()}
+            for i in range(len(targets))]
+
+def download_atlas_results(token, result_url, deadline=None, targets=None):
+    """Download and parse ATLAS photometry results.
+
+    For a packed job pass its ``targets`` (dicts with ra, dec, mjd_min and
+    mjd_max): ``data`` is then a list of per-target photometry lists in the
+    same order.
+    """
+    import numpy as np
+    import pandas as pd
+
+    deadline = Deadline.from_value(deadline)
     headers = {"Authorization": f"Token {token}", "Accept": "application/json"}
     
     print(f"Attempting to download ATLAS results from: {result_url}", file=sys.stderr)
     
     try:
-        with requests.Session() as s:
-            resp = s.get(result_url, headers=headers, timeout=60)
-            
-            print(f"Download response status: {resp.status_code}", file=sys.stderr)
+        s = get_session()
+        resp = s.get(result_url, headers=headers, timeout=deadline.timeout(60))
+        
+        print(f"Download response status: {resp.status_code}", file=sys.stderr)
+        
+        if resp.status_code == 200:
+            textdata = resp.text
+            print(f"Downloaded {len(textdata)} characters of data", file=sys.stderr)
             
-            if resp.status_code == 200:
-                textdata = resp.text
-                print(f"Downloaded {len(textdata)} characters of data", file=sys.stderr)
+            # Parse the CSV data
+            try:
+                df = pd.read_csv(StringIO(textdata), sep='\s+')
+                print(f"Parsed CSV with {len(df)} rows and columns: {list(df.columns)}", file=sys.stderr)
                 
-                # Parse the CSV data
-                try:
-                    df = pd.read_csv(StringIO(textdata), sep='\s+')
-                    print(f"Parsed CSV with {len(df)} rows and columns: {list(df.columns)}", file=sys.stderr)
-                    
-                    # Check for different possible MJD column names
-                    mjd_column = None
-                    possible_mjd_columns = ['MJD', 'mjd', 'MJD_OBS', 'mjd_obs', '###MJD', 'JD', 'jd']
-                    for col in possible_mjd_columns:
-                        if col in df.columns:
-                            mjd_column = col
-                            print(f"Found MJD column: {mjd_column}", file=sys.stderr)
-                            break
-                    
-                    if not mjd_column:
-                        print(f"Warning: No MJD column found in {list(df.columns)}", file=sys.stderr)
-                        return {"success": False, "error": f"No MJD column found in ATLAS data. Available columns: {list(df.columns)}"}
-                    
-                    # Filter out low SNR detections (SNR < 3)
-                    if 'uJy' in df.columns and 'duJy' in df.columns:
-                        df['snr'] = df['uJy'] / df['duJy']
-                        initial_count = len(df)
-                        df = df[df['snr'] >= 3.0]  # Keep only SNR >= 3
-                        print(f"Filtered {initial_count - len(df)} low SNR detections (< 3), keeping {len(df)} detections", file=sys.stderr)
-                    else:
-                        print("Warning: SNR filtering not applied - missing flux columns", file=sys.stderr)
-                    
-                    if len(df) == 0:
-                        print("No detections remain after SNR filtering", file=sys.stderr)
-                        return {"success": True, "data": []}
-                    
-                    # Convert to standardized format
-                    photometry_data = []
-                    for _, row in df.iterrows():
-                        # Use apparent magnitudes directly from 'm' column if available
-                        # (ATLAS provides both flux and already-converted apparent magnitudes)
-                        if 'm' in df.columns and pd.notna(row['m']):
-                            mag = row['m']  # Use apparent magnitude directly
-                            mag_err = row.get('dm', 0.1) if 'dm' in df.columns and pd.notna(row.get('dm')) else 0.1
-                        elif 'uJy' in df.columns and pd.notna(row['uJy']) and row['uJy'] > 0:
-                            # Fallback: convert flux to magnitude if no apparent magnitude available
-                            mag = -2.5 * np.log10(row['uJy']) + 23.9  # Convert µJy to AB mag (µJy already in microjanskys)
-                            mag_err = 2.5 * np.log10(np.e) * row['duJy'] / row['uJy'] if 'duJy' in df.columns and pd.notna(row['duJy']) else 0.1
-                        else:
-                            mag = np.nan
-                            mag_err = 0.1
-                        
-                        if pd.notna(mag):
-                            mjd_value = row[mjd_column] if pd.notna(row[mjd_column]) else 0
-                            # Convert JD to MJD if necessary (JD = MJD + 2400000.5)
-                            if mjd_column in ['JD', 'jd'] and mjd_value > 2400000:
-                                mjd_value = mjd_value - 2400000.5
-                            
-                            photometry_data.append({
-                                'mjd': round(mjd_value, 4),
-                                'mag': round(mag, 3),
-                                'e_mag': round(mag_err, 3),
-                                'filter': row['F'] if 'F' in df.columns else row.get('filter', 'unknown'),
-                                'flux_ujy': row['uJy'] if 'uJy' in df.columns else None,
-                                'flux_err_ujy': row['duJy'] if 'duJy' in df.columns else None,
-                                'snr': round(row['uJy'] / row['duJy'], 2) if 'uJy' in df.columns and 'duJy' in df.columns else None
-                            })
-                    
-                    print(f"Found {len(photometry_data)} valid detections", file=sys.stderr)
-                    return {"success": True, "data": photometry_data, "raw_csv": textdata}
-                    
-                except Exception as parse_error:
-                    print(f"Error parsing CSV data: {str(parse_error)}", file=sys.stderr)
-                    print(f"First 500 chars of data: {textdata[:500]}", file=sys.stderr)
-                    return {"success": False, "error": f"Error parsing CSV data: {str(parse_error)}"}
-                    
-            else:
-                error_msg = f"Download failed: HTTP {resp.status_code}"
-                if resp.text:
-                    error_msg += f" - {resp.text}"
-                    print(f"Download error response: {resp.text[:500]}", file=sys.stderr)
-                return {"success": False, "error": error_msg}
+                # Check for different possible MJD column names
+                mjd_column = None
+                possible_mjd_columns = ['MJD', 'mjd', 'MJD_OBS', 'mjd_obs', '###MJD', 'JD', 'jd']
+                for col in possible_mjd_columns:
+                    if col in df.columns:
+                        mjd_column = col
+                        print(f"Found MJD column: {mjd_column}", file=sys.stderr)
+                        break
+                
+                if not mjd_column:
+                    print(f"Warning: No MJD column found in {list(df.columns)}", file=sys.stderr)
+                    return {"success": False, "error": f"No MJD column found in ATLAS data. Available columns: {list(df.columns)}"}
                 
+                # Filter out low SNR detections (SNR < 3)
+                if 'uJy' in df.columns and 'duJy' in df.columns:
+                    df['snr'] = df['uJy'] / df['duJy']
+                    initial_count = len(df)
+                    df = df[df['snr'] >= 3.0]  # Keep only SNR >= 3
+                    print(f"Filtered {initial_count - len(df)} low SNR detections (< 3), keeping {len(df)} detections", file=sys.stderr)
+                else:
+                    print("Warning: SNR filtering not applied - missing flux columns", file=sys.stderr)
+                
+                if len(df) == 0:
+                    print("No detections remain after SNR filtering", file=sys.stderr)
+                    return {"success": True, "data": [] if targets is None else [[] for _ in targets]}
+                
+                # Convert to standardized format, one column at a time
+                n_rows = len(df)
+                def numeric_column(name):
+                    if name not in df.columns:
+                        return np.full(n_rows, np.nan)
+                    return pd.to_numeric(df[name], errors='coerce').to_numpy(dtype=float)
+
+                m, dm = numeric_column('m'), numeric_column('dm')
+                ujy, dujy = numeric_column('uJy'), numeric_column('duJy')
+                # Use apparent magnitudes directly from the 'm' column where available
+                # (ATLAS provides both flux and already-converted apparent magnitudes)
+                use_m = ~np.isnan(m)
+                # Fallback: convert flux to magnitude if no apparent magnitude available
+                use_flux = ~use_m & ~np.isnan(ujy) & (ujy > 0)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    flux_mag = -2.5 * np.log10(ujy) + 23.9  # Convert µJy to AB mag (µJy already in microjanskys)
+                    flux_mag_err = 2.5 * np.log10(np.e) * dujy / ujy
+                    snr = ujy / dujy
+                mag = np.where(use_m, m, np.where(use_flux, flux_mag, np.nan))
+                mag_err = np.where(use_m, np.where(np.isnan(dm), 0.1, dm),
+                                   np.where(use_flux & ~np.isnan(dujy), flux_mag_err, 0.1))
+
+                mjd_values = numeric_column(mjd_column)
+                mjd_values = np.where(np.isnan(mjd_values), 0, mjd_values)
+                # Convert JD to MJD if necessary (JD = MJD + 2400000.5)
+                if mjd_column in ['JD', 'jd']:
+                    mjd_values = np.where(mjd_values > 2400000, mjd_values - 2400000.5, mjd_values)
+
+                if 'F' in df.columns:
+                    filters = df['F'].to_numpy()
+                elif 'filter' in df.columns:
+                    filters = df['filter'].to_numpy()
+                else:
+                    filters = np.full(n_rows, 'unknown', dtype=object)
+                no_value = np.full(n_rows, None, dtype=object)
+                has_flux = 'uJy' in df.columns and 'duJy' in df.columns
+
+                valid = ~np.isnan(mag)
+                columns = {
+                    'mjd': np.round(mjd_values[valid], 4),
+                    'mag': np.round(mag[valid], 3),
+                    'e_mag': np.round(mag_err[valid], 3),
+                    'filter': filters[valid],
+                    'flux_ujy': (df['uJy'].to_numpy() if 'uJy' in df.columns else no_value)[valid],
+                    'flux_err_ujy': (df['duJy'].to_numpy() if 'duJy' in df.columns else no_value)[valid],
+                    'snr': (np.round(snr, 2) if has_flux else no_value)[valid]
+                }
+                
+                if targets is not None:
+                    if 'RA' not in df.columns or 'Dec' not in df.columns:
+                        return {"success": False, "error": "Packed ATLAS result has no RA/Dec columns to split by"}
+                    per_target = split_packed_photometry(columns, numeric_column('RA')[valid],
+                                                         numeric_column('Dec')[valid], targets)
+                    photometry_data = [records_from_columns(target_columns) for target_columns in per_target]
+                    print(f"Split {int(valid.sum())} valid detections across {len(targets)} targets", file=sys.stderr)
+                    return {"success": True, "data": photometry_data}
+                
+                photometry_data = records_from_columns(columns)
+                print(f"Found {len(photometry_data)} valid detections", file=sys.stderr)
+                return {"success": True, "data": photometry_data, "raw_csv": textdata}
+                
+            except Exception as parse_error:
+                print(f"Error parsing CSV data: {str(parse_error)}", file=sys.stderr)
+                print(f"First 500 chars of data: {textdata[:500]}", file=sys.stderr)
+                return {"success": False, "error": f"Error parsing CSV data: {str(parse_error)}"}
+                
+        else:
+            error_msg = f"Download failed: HTTP {resp.status_code}"
+            if resp.text:
+                error_msg += f" - {resp.text}"
+                print(f"Download error response: {resp.text[:500]}", file=sys.stderr)
+            return {"success": False, "error": error_msg}
+            
     except requests.exceptions.Timeout:
         return {"success": False, "error": "Download timed out"}
     except Exception as e:
         print(f"Download exception: {str(e)}", file=sys.stderr)
         return {"success": False, "error": f"Download error: {str(e)}"}
 
-def get_atlas_photometry(username, password, ra, dec, discovery_date=None):
-    """
-    Main function to get ATLAS forced photometry with caching
-    
-    Args:
-        username: ATLAS username
-        password: ATLAS password
-        ra: Right ascension in decimal degrees
-        dec: Declination in decimal degrees
-        discovery_date: Discovery date as string (YYYY-MM-DD) or datetime object
-    
-    Returns:
-        Dict with success status and data or error message
-    """
+def decimate_atlas_result(result, max_points):
+    """Copy of an ATLAS result with each filter decimated to ~max_points for plotting"""
+    if not max_points or not result.get("success"):
+        return result
+    from decimation import decimate_points
+    data = result.get("data") or []
+    return dict(result, data=decimate_points(data, max_points, "filter"),
+                total_points=len(data), max_points=int(max_points))
+
+def get_mjd_window(discovery_date=None):
+    """MJD window (mjd_min, mjd_max) to request for an object: 100 days before discovery
+    to a year after it (or today), or the last 6 months without a discovery date"""
     # Calculate targeted time window based on discovery date
     if discovery_date is None:
         # Fallback: use 6 months ago to now if no discovery date provided
@@ -388,63 +533,18 @@ def get_atlas_photometry(username, password, ra, dec, discovery_date=None):
             mjd_max = (end_date - datetime(1858, 11, 17)).days
             
             print(f"Using discovery-based window: {discovery_dt.strftime('%Y-%m-%d')} -> MJD {mjd_min} to {mjd_max} ({start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')})", file=sys.stderr)
-
-    # Generate cache key based on coordinates and time window
-    cache_key = f"atlas_{ra:.6f}_{dec:.6f}_{mjd_min}_{mjd_max}"
-    cached_result = get_cached_result(cache_key)
     
-    if cached_result:
-        print(f"Returning cached ATLAS data for RA={ra}, Dec={dec}", file=sys.stderr)
-        return cached_result
+    return mjd_min, mjd_max
 
-    print(f"Fetching fresh ATLAS data for RA={ra}, Dec={dec}, MJD_min={mjd_min}, MJD_max={mjd_max}", file=sys.stderr)
-    
-    # Get authentication token
-    token_result = get_atlas_token(username, password)
-    if not token_result["success"]:
-        return token_result
-    
-    token = token_result["token"]
-    
-    # Queue the job
-    queue_result = queue_atlas_job(token, ra, dec, mjd_min, mjd_max)
-    if not queue_result["success"]:
-        return queue_result
-    
-    task_url = queue_result["task_url"]
-    
-    # Wait for results
-    wait_result = wait_for_results(token, task_url)
-    if not wait_result["success"]:
-        return wait_result
-    
-    # Check if job completed but no data was found
-    if wait_result.get("no_data"):
-        cache_data = {
-            "success": True,
-            "data": [],
-            "cached_at": datetime.now().isoformat(),
-            "parameters": {
-                "ra": ra,
-                "dec": dec, 
-                "mjd_min": mjd_min,
-                "mjd_max": mjd_max
-            }
-        }
-        save_to_cache_with_key(cache_key, cache_data)
-        return cache_data
-    
-    result_url = wait_result["result_url"]
-    
-    # Download results
-    download_result = download_atlas_results(token, result_url)
-    if not download_result["success"]:
-        return download_result
-    
-    # Save to cache
+def get_atlas_cache_key(ra, dec, mjd_min, mjd_max):
+    """Cache key of a target's photometry: position and MJD window"""
+    return f"atlas_{ra:.6f}_{dec:.6f}_{mjd_min}_{mjd_max}"
+
+def store_atlas_result(cache_key, ra, dec, mjd_min, mjd_max, data):
+    """Cache the photometry of a finished job and return the cached result"""
     cache_data = {
         "success": True,
-        "data": download_result["data"],
+        "data": data,
         "cached_at": datetime.now().isoformat(),
         "parameters": {
             "ra": ra,
@@ -454,15 +554,292 @@ def get_atlas_photometry(username, password, ra, dec, discovery_date=None):
         }
     }
     save_to_cache_with_key(cache_key, cache_data)
+    return cache_data
+
+def run_atlas_job(token, username, cache_key, ra, dec, mjd_min, mjd_max, deadline=None):
+    """Get a target's photometry through the job journal and cache it.
+
+    Attaches to a journaled job for the same target and account (still
+    queued, or finished but not downloaded) or queues a new one and journals
+    its task URL before polling, so a restart never loses it. A job that
+    times out here stays in the journal for the next request or for
+    atlas_jobs.resume_jobs; a job ATLAS rejects is marked failed.
+    """
+    deadline = Deadline.from_value(deadline)
+    wait = QUEUING_TIMEOUT if deadline.remaining() is None else min(QUEUING_TIMEOUT, deadline.remaining())
+    job = claim_job(cache_key, username, ra, dec, mjd_min, mjd_max, wait=wait)
+    
+    if job is not None and job["state"] == "queuing":
+        # Another request is still submitting this target's job; queueing it again would duplicate it
+        return {"success": False, "error": "ATLAS job for this target is still being queued by another request"}
     
+    if job is not None and job["packed"]:
+        # Part of a packed job: collect it for all of its targets
+        packed_result = run_packed_job(token, username, job["task_url"], deadline)
+        if not packed_result["success"]:
+            return packed_result
+        if cache_key in packed_result["data"]:
+            return packed_result["data"][cache_key]
+        # Another process collected it first
+        return get_cached_result(cache_key) or {"success": False, "error": "Packed ATLAS job result not found"}
+    
+    if job is not None and job["state"] == "finished":
+        result_url = job["result_url"]
+    else:
+        if job is None:
+            # Queue the job
+            queue_result = queue_atlas_job(token, ra, dec, mjd_min, mjd_max, deadline)
+            if not queue_result["success"]:
+                record_failed(cache_key, username, queue_result["error"])
+                return queue_result
+            task_url = queue_result["task_url"]
+            record_queued(cache_key, username, task_url)
+        else:
+            task_url = job["task_url"]
+        
+        # Wait for results
+        wait_result = wait_for_results(token, task_url, deadline=deadline)
+        if not wait_result["success"]:
+            if "task_url" not in wait_result:  # Timeouts leave the job to be picked up later
+                record_failed(cache_key, username, wait_result["error"])
+            return wait_result
+        
+        # A job that completed without data has no result URL
+        result_url = wait_result.get("result_url")
+        record_finished(cache_key, username, result_url)
+    
+    if result_url is None:
+        cache_data = store_atlas_result(cache_key, ra, dec, mjd_min, mjd_max, [])
+        record_done(cache_key, username)
+        return cache_data
+    
+    # Download results; on failure the job stays finished and is downloaded next time
+    download_result = download_atlas_results(token, result_url, deadline)
+    if not download_result["success"]:
+        return download_result
+    
+    cache_data = store_atlas_result(cache_key, ra, dec, mjd_min, mjd_max, download_result["data"])
+    record_done(cache_key, username)
     return cache_data
 
+def run_packed_job(token, username, task_url, deadline=None):
+    """Collect a packed job: wait for it, download its combined table once,
+    split it per target and cache every target.
+
+    Returns ``data`` as a dict of cache key -> cached result for the targets
+    collected by this call (empty if another process got there first).
+    """
+    deadline = Deadline.from_value(deadline)
+    members = jobs_for_task(task_url, username)
+    if not members:
+        return {"success": True, "data": {}}
+    
+    if members[0]["state"] == "finished":
+        result_url = members[0]["result_url"]
+    else:
+        wait_result = wait_for_results(token, task_url, deadline=deadline)
+        if not wait_result["success"]:
+            if "task_url" not in wait_result:  # Timeouts leave the job to be picked up later
+                update_task(task_url, username, state="failed", error=str(wait_result["error"])[:500])
+            return wait_result
+        result_url = wait_result.get("result_url")
+        update_task(task_url, username, state="finished", result_url=result_url)
+    
+    if result_url is None:
+        per_target = [[] for _ in members]
+    else:
+        download_result = download_atlas_results(token, result_url, deadline, targets=members)
+        if not download_result["success"]:
+            return download_result
+        per_target = download_result["data"]
+    
+    stored = {
+        member["cache_key"]: store_atlas_result(member["cache_key"], member["ra"], member["dec"],
+                                                member["mjd_min"], member["mjd_max"], data)
+        for member, data in zip(members, per_target)
+    }
+    update_task(task_url, username, state="done")
+    print(f"Packed job: Cached photometry for {len(stored)} targets", file=sys.stderr)
+    return {"success": True, "data": stored}
+
+def pack_targets(targets, max_targets=MAX_PACKED_TARGETS, max_padding=MAX_WINDOW_PADDING):
+    """Group targets into packed jobs with compatible MJD windows.
+
+    A packed job runs over the union of its targets' windows, so targets are
+    taken in order of window start and a group is closed once the union
+    would be more than ``max_padding`` days longer than the shortest window
+    in it (or it holds ``max_targets``). Returns lists of targets, ordered by
+    the position of each group's first-listed target in ``targets``, so a
+    caller trimming to a job quota keeps the targets it listed first.
+    """
+    groups = []
+    group, union_min, union_max, shortest = [], None, None, None
+    for position, target in sorted(enumerate(targets), key=lambda item: (item[1]["mjd_min"], item[1]["mjd_max"])):
+        span = target["mjd_max"] - target["mjd_min"]
+        if group:
+            new_min, new_max = min(union_min, target["mjd_min"]), max(union_max, target["mjd_max"])
+            new_shortest = min(shortest, span)
+            if len(group) < max_targets and (new_max - new_min) - new_shortest <= max_padding:
+                group.append((position, target))
+                union_min, union_max, shortest = new_min, new_max, new_shortest
+                continue
+            groups.append(group)
+        group, union_min, union_max, shortest = [(position, target)], target["mjd_min"], target["mjd_max"], span
+    if group:
+        groups.append(group)
+    groups.sort(key=lambda members: min(position for position, _ in members))
+    return [[target for _, target in members] for members in groups]
+
+def get_atlas_photometry_batch(username, password, targets, deadline=None, max_points=None, use_cache=True,
+                               max_jobs=None):
+    """
+    ATLAS forced photometry for many targets, queued as a few packed jobs
+    
+    Targets with fresh cached data are served from the cache. The rest are
+    grouped by ``pack_targets``, each group queued as one multi-target job
+    (all jobs are queued before any is polled, so ATLAS works on them in
+    parallel) and the combined results split back into per-target cache
+    entries. Targets another process already has a job for attach to it.
+    
+    Args:
+        targets: List of dicts with ra, dec and optionally discovery_date
+        max_jobs: Optional limit on new packed jobs; targets beyond it fail
+            with an error and are not queued
+    
+    Returns:
+        Dict with success status and ``data``, a list of per-target results
+        (as from get_atlas_photometry) in the order of ``targets``
+    """
+    deadline = Deadline.from_value(deadline)
+    results = [None] * len(targets)
+    pending = []
+    for index, target in enumerate(targets):
+        mjd_min, mjd_max = get_mjd_window(target.get("discovery_date"))
+        cache_key = get_atlas_cache_key(target["ra"], target["dec"], mjd_min, mjd_max)
+        cached = find_cached_result(cache_key, target["ra"], target["dec"], allow_stale=False) if use_cache else None
+        if cached and cached[2]:
+            results[index] = decimate_atlas_result(dict(cached[0], cache=cache_info("fresh", cached[1])), max_points)
+            continue
+        pending.append({"index": index, "cache_key": cache_key, "ra": target["ra"], "dec": target["dec"],
+                        "mjd_min": mjd_min, "mjd_max": mjd_max})
+    
+    if pending:
+        token_result = get_atlas_token(username, password, deadline)
+        if not token_result["success"]:
+            return token_result
+        token = token_result["token"]
+        
+        claimed, busy = claim_jobs(pending, username)
+        # Groups come back in input order, so the quota drops the targets listed last
+        groups = pack_targets(claimed)
+        if max_jobs is not None and len(groups) > max_jobs:
+            for group in groups[max_jobs:]:
+                for target in group:
+                    record_failed(target["cache_key"], username, "Not queued: packed job quota reached")
+                    results[target["index"]] = {"success": False, "error": "ATLAS job quota reached"}
+            groups = groups[:max_jobs]
+        print(f"Fetching ATLAS data for {len(pending)} targets: {len(claimed)} in {len(groups)} packed jobs, "
+              f"{len(busy)} already queued", file=sys.stderr)
+        
+        task_urls = []
+        for group in groups:
+            queue_result = queue_atlas_job(token, None, None, min(t["mjd_min"] for t in group),
+                                           max(t["mjd_max"] for t in group), deadline,
+                                           coordinates=[(t["ra"], t["dec"]) for t in group])
+            if not queue_result["success"]:
+                for target in group:
+                    record_failed(target["cache_key"], username, queue_result["error"])
+                    results[target["index"]] = queue_result
+                continue
+            record_packed_queued([t["cache_key"] for t in group], username, queue_result["task_url"])
+            task_urls.append((queue_result["task_url"], group))
+        
+        for task_url, group in task_urls:
+            packed_result = run_packed_job(token, username, task_url, deadline)
+            for target in group:
+                if not packed_result["success"]:
+                    results[target["index"]] = packed_result
+                elif target["cache_key"] in packed_result["data"]:
+                    cache_data = packed_result["data"][target["cache_key"]]
+                    results[target["index"]] = decimate_atlas_result(dict(cache_data, cache=cache_info("fetched")),
+                                                                     max_points)
+                else:
+                    results[target["index"]] = {"success": False, "error": "Packed ATLAS job result not found"}
+        
+        for target in busy:
+            # A duplicate of a target packed above is in the cache by now
+            cache_data = get_cached_result(target["cache_key"]) or \
+                run_atlas_job(token, username, target["cache_key"], target["ra"], target["dec"],
+                              target["mjd_min"], target["mjd_max"], deadline)
+            results[target["index"]] = decimate_atlas_result(dict(cache_data, cache=cache_info("fetched")), max_points) \
+                if cache_data["success"] else cache_data
+    
+    return {"success": True, "data": results}
+
+def get_atlas_photometry(username, password, ra, dec, discovery_date=None, deadline=None, max_points=None,
+                         use_cache=True, allow_stale=True):
+    """
+    Main function to get ATLAS forced photometry with caching
+    
+    Args:
+        username: ATLAS username
+        password: ATLAS password
+        ra: Right ascension in decimal degrees
+        dec: Declination in decimal degrees
+        discovery_date: Discovery date as string (YYYY-MM-DD) or datetime object
+        deadline: Optional time budget in seconds (or a Deadline) for the whole request
+        max_points: Optional per-filter point budget for plotting; the cache
+            always keeps full resolution
+        use_cache: False to skip the cache and always run a new job
+        allow_stale: False to run a new job instead of serving expired data
+    
+    Returns:
+        Dict with success status and data or error message; ``cache`` says
+        whether the data was fresh, stale (being refreshed in the background)
+        or fetched by this call
+    """
+    mjd_min, mjd_max = get_mjd_window(discovery_date)
+
+    # Generate cache key based on coordinates and time window
+    cache_key = get_atlas_cache_key(ra, dec, mjd_min, mjd_max)
+    cached = find_cached_result(cache_key, ra, dec, allow_stale) if use_cache else None
+    
+    if cached:
+        cached_result, age, exact = cached
+        if exact and age <= CACHE_DURATION * 86400:
+            print(f"Returning cached ATLAS data for RA={ra}, Dec={dec}", file=sys.stderr)
+            return decimate_atlas_result(dict(cached_result, cache=cache_info("fresh", age)), max_points)
+        # Expired (or for an older window): serve it now, refetch once in the background
+        print(f"Returning stale ATLAS data ({age / 86400:.1f} days old) for RA={ra}, Dec={dec}", file=sys.stderr)
+        refreshing = bool(username and password) and spawn_refresh("atlas", cache_key, {
+            "username": username, "password": password, "ra": ra, "dec": dec,
+            "discovery_date": discovery_date if isinstance(discovery_date, str) or discovery_date is None
+            else discovery_date.strftime('%Y-%m-%d %H:%M:%S')
+        })
+        return decimate_atlas_result(dict(cached_result, cache=cache_info("stale", age, refreshing)), max_points)
+
+    print(f"Fetching fresh ATLAS data for RA={ra}, Dec={dec}, MJD_min={mjd_min}, MJD_max={mjd_max}", file=sys.stderr)
+    
+    # Get authentication token
+    deadline = Deadline.from_value(deadline)
+    token_result = get_atlas_token(username, password, deadline)
+    if not token_result["success"]:
+        return token_result
+    
+    cache_data = run_atlas_job(token_result["token"], username, cache_key, ra, dec, mjd_min, mjd_max, deadline)
+    if not cache_data["success"]:
+        return cache_data
+    
+    return decimate_atlas_result(dict(cache_data, cache=cache_info("fetched")), max_points)
+
 if __name__ == "__main__":
     # Command line interface for testing and integration
     if len(sys.argv) != 2:
         print("Usage: python atlas_api.py '<json_args>'")
         sys.exit(1)
     
+    from profiling import profiled
+
     try:
         args = json.loads(sys.argv[1])
         username = args.get('username')
@@ -470,10 +847,23 @@ if __name__ == "__main__":
         ra = args.get('ra')
         dec = args.get('dec')
         discovery_date = args.get('discovery_date')
+        deadline = args.get('deadline')  # Seconds for the whole request
         
-        result = get_atlas_photometry(username, password, ra, dec, discovery_date)
-        print(json.dumps(result))
+        max_points = args.get('max_points')  # Per-filter budget for plotting; omit for full resolution
+        
+        with profiled("atlas", args) as report:
+            if args.get('targets') is not None:
+                # Batch of {"ra", "dec", "discovery_date"} targets, queued as packed jobs
+                result = get_atlas_photometry_batch(username, password, args['targets'], deadline, max_points,
+                                                    use_cache=args.get('use_cache', True),
+                                                    max_jobs=args.get('max_jobs'))
+            else:
+                result = get_atlas_photometry(username, password, ra, dec, discovery_date, deadline, max_points,
+                                              use_cache=args.get('use_cache', True),
+                                              allow_stale=args.get('allow_stale', True))
+            report["success"] = result.get("success")
+        write_output(result, args.get('output_format', 'json'))
         
     except Exception as e:
         error_result = {"success": False, "error": f"Script error: {str(e)}"}
-        print(json.dumps(error_result)) 
\ No newline at end of file
+        write_output(error_result)
\ No newline at end of file
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+ATLAS Job Journal
+Durable record of queued ATLAS forced-photometry jobs, so a task URL is not
+lost when the process polling it dies. Requests for a target whose job is
+already in the journal attach to it instead of queueing the same job again,
+and ``resume_jobs`` (run at startup) polls outstanding jobs and collects
+finished results into the ATLAS cache.
+
+Jobs are keyed by the ATLAS cache key (position and MJD window) and the
+ATLAS account that queued them, since task URLs need that account's token.
+States: queuing (a process is submitting it), queued, finished (result URL
+known, not yet downloaded), done, failed.
+
+A packed job (several targets queued as one ATLAS request, see
+atlas_api.get_atlas_photometry_batch) has one row per target, all with the
+same task URL and ``packed`` set; it is collected for all of them at once.
+
+Usage:
+    ATLAS_USERNAME=... ATLAS_PASSWORD=... python atlas_jobs.py '{"action": "resume"}'
+    python atlas_jobs.py '{"action": "list"}'
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+
+ATLAS_JOB_DB_FILE = os.environ.get("ATLAS_JOB_DB", "atlas_jobs.db")
+JOB_MAX_AGE = 2 * 86400  # Seconds after which a journaled job is not reused (ATLAS expires results)
+QUEUING_TIMEOUT = 60  # Seconds a submission may take before another process queues the job itself
+ATTACH_POLL_INTERVAL = 2  # Seconds between journal checks while another process is submitting
+ACTIVE_STATES = ("queuing", "queued", "finished")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    cache_key TEXT,
+    username TEXT,
+    ra REAL,
+    dec REAL,
+    mjd_min REAL,
+    mjd_max REAL,
+    task_url TEXT,
+    result_url TEXT,
+    state TEXT,
+    error TEXT,
+    queued_at REAL,
+    updated_at REAL,
+    packed INTEGER DEFAULT 0,
+    PRIMARY KEY (cache_key, username)
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state);
+"""
+
+def open_job_journal(db_file=ATLAS_JOB_DB_FILE):
+    """Connection to the job journal, creating the table on first use"""
+    connection = sqlite3.connect(db_file, timeout=30, isolation_level=None)
+    connection.row_factory = sqlite3.Row
+    connection.executescript(SCHEMA)
+    columns = [row["name"] for row in connection.execute("PRAGMA table_info(jobs)")]
+    if "packed" not in columns:  # Journals created before packed jobs
+        connection.execute("ALTER TABLE jobs ADD COLUMN packed INTEGER DEFAULT 0")
+    connection.execute("CREATE INDEX IF NOT EXISTS jobs_task ON jobs (task_url)")
+    return connection
+
+def get_job(cache_key, username, db_file=ATLAS_JOB_DB_FILE):
+    """Journal entry for a cache key and account, or None"""
+    connection = open_job_journal(db_file)
+    try:
+        row = connection.execute("SELECT * FROM jobs WHERE cache_key = ? AND username = ?",
+                                 (cache_key, username)).fetchone()
+        return dict(row) if row else None
+    finally:
+        connection.close()
+
+def is_reusable(job, now=None):
+    """True if a journaled job can serve a new request"""
+    now = now or time.time()
+    if job is None or job["state"] not in ACTIVE_STATES:
+        return False
+    if job["state"] == "queuing":
+        return now - job["updated_at"] < QUEUING_TIMEOUT
+    return now - job["queued_at"] < JOB_MAX_AGE
+
+def claim_job(cache_key, username, ra, dec, mjd_min, mjd_max, db_file=ATLAS_JOB_DB_FILE, wait=QUEUING_TIMEOUT):
+    """Attach to the journaled job for a target or claim the right to queue it.
+
+    Returns the job to attach to (with its task or result URL), or None when
+    the caller should queue the job and report it with ``record_queued``.
+    A job another process is still submitting is waited for up to ``wait``
+    seconds; if it is still being submitted then, it is returned in its
+    queuing state (without a task URL) and must not be queued again. Only a
+    submission older than QUEUING_TIMEOUT is treated as abandoned and claimed.
+    """
+    deadline = time.time() + wait
+    while True:
+        connection = open_job_journal(db_file)
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute("SELECT * FROM jobs WHERE cache_key = ? AND username = ?",
+                                     (cache_key, username)).fetchone()
+            job = dict(row) if row else None
+            now = time.time()
+            if not is_reusable(job, now):
+                connection.execute(
+                    "INSERT OR REPLACE INTO jobs (cache_key, username, ra, dec, mjd_min, mjd_max, state, queued_at, "
+                    "updated_at) VALUES (?, ?, ?, ?, ?, ?, 'queuing', ?, ?)",
+                    (cache_key, username, ra, dec, mjd_min, mjd_max, now, now)
+                )
+                connection.execute("COMMIT")
+                return None
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+        if job["state"] != "queuing":
+            print(f"ATLAS jobs: Attaching to {job['state']} job {job['task_url']}", file=sys.stderr)
+            return job
+        if time.time() >= deadline:
+            return job
+        time.sleep(min(ATTACH_POLL_INTERVAL, max(0.0, deadline - time.time())))
+
+def claim_jobs(targets, username, db_file=ATLAS_JOB_DB_FILE):
+    """Claim the right to queue many targets in one transaction (for packing).
+
+    ``targets`` are dicts with cache_key, ra, dec, mjd_min and mjd_max.
+    Returns (claimed, busy): targets now marked queuing by the caller, and
+    targets with a job already in the journal, which the caller should
+    attach to one by one with ``claim_job``.
+    """
+    claimed, busy = [], []
+    connection = open_job_journal(db_file)
+    try:
+        connection.execute("BEGIN IMMEDIATE")
+        now = time.time()
+        for target in targets:
+            row = connection.execute("SELECT * FROM jobs WHERE cache_key = ? AND username = ?",
+                                     (target["cache_key"], username)).fetchone()
+            if is_reusable(dict(row) if row else None, now):
+                busy.append(target)
+                continue
+            connection.execute(
+                "INSERT OR REPLACE INTO jobs (cache_key, username, ra, dec, mjd_min, mjd_max, state, queued_at, "
+                "updated_at) VALUES (?, ?, ?, ?, ?, ?, 'queuing', ?, ?)",
+                (target["cache_key"], username, target["ra"], target["dec"], target["mjd_min"], target["mjd_max"],
+                 now, now)
+            )
+            claimed.append(target)
+        connection.execute("COMMIT")
+    except Exception:
+        connection.execute("ROLLBACK")
+        raise
+    finally:
+        connection.close()
+    return claimed, busy
+
+def update_job(cache_key, username, db_file=ATLAS_JOB_DB_FILE, **fields):
+    """Set fields of a journaled job (state, task_url, result_url, error)"""
+    fields["updated_at"] = time.time()
+    connection = open_job_journal(db_file)
+    try:
+        connection.execute(
+            f"UPDATE jobs SET {', '.join(f'{name} = ?' for name in fields)} WHERE cache_key = ? AND username = ?",
+            list(fields.values()) + [cache_key, username]
+        )
+    finally:
+        connection.close()
+
+def record_queued(cache_key, username, task_url, db_file=ATLAS_JOB_DB_FILE):
+    update_job(cache_key, username, db_file, state="queued", task_url=task_url, queued_at=time.time())
+
+def record_packed_queued(cache_keys, username, task_url, db_file=ATLAS_JOB_DB_FILE):
+    """Journal one packed job for all of its targets"""
+    now = time.time()
+    connection = open_job_journal(db_file)
+    try:
+        connection.execute("BEGIN IMMEDIATE")
+        connection.executemany(
+            "UPDATE jobs SET state = 'queued', task_url = ?, packed = 1, queued_at = ?, updated_at = ? "
+            "WHERE cache_key = ? AND username = ?",
+            [(task_url, now, now, cache_key, username) for cache_key in cache_keys]
+        )
+        connection.execute("COMMIT")
+    except Exception:
+        connection.execute("ROLLBACK")
+        raise
+    finally:
+        connection.close()
+
+def jobs_for_task(task_url, username, db_file=ATLAS_JOB_DB_FILE):
+    """Targets still waiting on a (packed) job, in the order they were journaled"""
+    connection = open_job_journal(db_file)
+    try:
+        rows = connection.execute(
+            "SELECT * FROM jobs WHERE task_url = ? AND username = ? AND state IN ('queued', 'finished') ORDER BY rowid",
+            (task_url, username)
+        ).fetchall()
+        return [dict(row) for row in rows]
+    finally:
+        connection.close()
+
+def update_task(task_url, username, db_file=ATLAS_JOB_DB_FILE, **fields):
+    """Set fields of every target still waiting on a (packed) job"""
+    fields["updated_at"] = time.time()
+    connection = open_job_journal(db_file)
+    try:
+        connection.execute(
+            f"UPDATE jobs SET {', '.join(f'{name} = ?' for name in fields)} "
+            "WHERE task_url = ? AND username = ? AND state IN ('queued', 'finished')",
+            list(fields.values()) + [task_url, username]
+        )
+    finally:
+        connection.close()
+
+def record_finished(cache_key, username, result_url, db_file=ATLAS_JOB_DB_FILE):
+    """Job done on the ATLAS side; a result URL of None means it found no data"""
+    update_job(cache_key, username, db_file, state="finished", result_url=result_url)
+
+def record_done(cache_key, username, db_file=ATLAS_JOB_DB_FILE):
+    update_job(cache_key, username, db_file, state="done")
+
+def record_failed(cache_key, username, error, db_file=ATLAS_JOB_DB_FILE):
+    update_job(cache_key, username, db_file, state="failed", error=str(error)[:500])
+
+def outstanding_jobs(username=None, db_file=ATLAS_JOB_DB_FILE):
+    """Queued or finished jobs that are still recent enough to collect"""
+    connection = open_job_journal(db_file)
+    try:
+        rows = connection.execute(
+            "SELECT * FROM jobs WHERE state IN ('queued', 'finished') AND queued_at > ?"
+            + (" AND username = ?" if username else ""),
+            (time.time() - JOB_MAX_AGE,) + ((username,) if username else ())
+        ).fetchall()
+        return [dict(row) for row in rows]
+    finally:
+        connection.close()
+
+def list_jobs(limit=100, db_file=ATLAS_JOB_DB_FILE):
+    connection = open_job_journal(db_file)
+    try:
+        rows = connection.execute("SELECT * FROM jobs ORDER BY updated_at DESC LIMIT ?", (int(limit),)).fetchall()
+        return [dict(row) for row in rows]
+    finally:
+        connection.close()
+
+def resume_jobs(username, password, db_file=ATLAS_JOB_DB_FILE):
+    """Poll every outstanding job of an account and download finished results into the cache"""
+    from atlas_api import get_atlas_token, run_atlas_job, run_packed_job
+
+    jobs = outstanding_jobs(username, db_file)
+    if not jobs:
+        return {"success": True, "data": {"resumed": 0, "collected": 0}}
+    token_result = get_atlas_token(username, password)
+    if not token_result["success"]:
+        return token_result
+    print(f"ATLAS jobs: Resuming {len(jobs)} outstanding jobs", file=sys.stderr)
+    collected = 0
+    packed_tasks = set()
+    for job in jobs:
+        if job["packed"]:
+            # One collection serves every target of a packed job
+            if job["task_url"] in packed_tasks:
+                continue
+            packed_tasks.add(job["task_url"])
+            result = run_packed_job(token_result["token"], username, job["task_url"])
+            collected += len(result["data"]) if result.get("success") else 0
+            continue
+        result = run_atlas_job(token_result["token"], username, job["cache_key"], job["ra"], job["dec"],
+                               job["mjd_min"], job["mjd_max"])
+        collected += bool(result.get("success"))
+    return {"success": True, "data": {"resumed": len(jobs), "collected": collected}}
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python atlas_jobs.py '<json_args>'")
+        sys.exit(1)
+
+    try:
+        args = json.loads(sys.argv[1])
+        action = args.get('action', 'resume')
+        if action == 'resume':
+            username = args.get('username') or os.environ.get('ATLAS_USERNAME')
+            password = args.get('password') or os.environ.get('ATLAS_PASSWORD')
+            if not (username and password):
+                result = {"success": False, "error": "ATLAS credentials not provided"}
+            else:
+                result = resume_jobs(username, password)
+        elif action == 'list':
+            result = {"success": True, "data": list_jobs(args.get('limit', 100))}
+        else:
+            result = {"success": False, "error": f"Unknown action: {action}"}
+        print(json.dumps(result))
+
+    except Exception as e:
+        error_result = {"success": False, "error": f"Script error: {str(e)}"}
+        print(json.dumps(error_result))
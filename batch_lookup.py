@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Batch Positional Lookup
+Resolves many RA/Dec positions (e.g. a night's TNS reports) against the
+ALeRCE, Antares and Lasair cone searches in one call and returns a single
+table mapping every input row to its broker matches and separations.
+"""
+import os
+import sys
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from broker_client import (
+    get_lasair_headers, query_alerce_by_coordinates, query_antares_by_coordinates,
+    query_lasair_by_coordinates
+)
+from resilience import Deadline
+
+CONE_CACHE_DIR = "cone_cache"
+CONE_CACHE_DURATION = 1  # Days; new alerts can add matches, so keep this short
+DEDUPE_RADIUS_ARCSEC = 1.0  # Positions closer than this are looked up once
+ZONE_HEIGHT_DEG = 1.0  # Declination band height used to group positions by sky region
+MAX_WORKERS = 8
+MAX_WORKERS_PER_BROKER = 4
+BROKERS = ["alerce", "antares", "lasair"]
+
+def cluster_positions(ras, decs, radius_arcsec=DEDUPE_RADIUS_ARCSEC):
+    """Label positions so that near-identical ones share a label.
+
+    Close pairs are found with a declination sweep (positions sorted by Dec,
+    each compared only with the neighbours inside its Dec window, one
+    vectorized step per window offset) and merged transitively by min-label
+    propagation. Returns an array giving, for each row, the index of the row
+    that represents its group.
+    """
+    import numpy as np
+
+    ras = np.asarray(ras, dtype=float)
+    decs = np.asarray(decs, dtype=float)
+    labels = np.arange(ras.size)
+    if ras.size < 2:
+        return labels
+    radius_deg = radius_arcsec / 3600.0
+    order = np.argsort(decs, kind="stable")
+    sorted_decs = decs[order]
+    window_end = np.searchsorted(sorted_decs, sorted_decs + radius_deg, side="right")
+    positions = np.arange(ras.size)
+    firsts, seconds = [], []
+    for offset in range(1, int((window_end - positions).max())):
+        candidates = positions[positions + offset < window_end]
+        a, b = order[candidates], order[candidates + offset]
+        close = angular_separation_arcsec(ras[a], decs[a], ras[b], decs[b]) <= radius_arcsec
+        firsts.append(a[close])
+        seconds.append(b[close])
+    if not firsts:
+        return labels
+    idx1 = np.concatenate(firsts + seconds)
+    idx2 = np.concatenate(seconds + firsts)
+    while True:
+        updated = labels.copy()
+        np.minimum.at(updated, idx1, labels[idx2])
+        if np.array_equal(updated, labels):
+            return labels
+        labels = updated
+
+def sky_order(ras, decs, zone_height=ZONE_HEIGHT_DEG):
+    """Indices that sort positions by declination zone, then RA within the zone"""
+    import numpy as np
+
+    zones = np.floor((np.asarray(decs, dtype=float) + 90.0) / zone_height)
+    return np.lexsort((np.asarray(ras, dtype=float), zones))
+
+def angular_separation_arcsec(ra1, dec1, ra2, dec2):
+    """Great-circle separation in arcsec (haversine), vectorized over arrays"""
+    import numpy as np
+
+    ra1, dec1, ra2, dec2 = (np.radians(np.asarray(v, dtype=float)) for v in (ra1, dec1, ra2, dec2))
+    a = np.sin((dec2 - dec1) / 2)**2 + np.cos(dec1) * np.cos(dec2) * np.sin((ra2 - ra1) / 2)**2
+    return np.degrees(2 * np.arcsin(np.sqrt(np.clip(a, 0, 1)))) * 3600
+
+def get_cone_cache_file(broker, ra, dec):
+    """Cache file for one broker cone search, keyed by position rounded to ~0.04 arcsec"""
+    key = hashlib.md5(f"{broker}_{ra:.5f}_{dec:.5f}".encode()).hexdigest()
+    return os.path.join(CONE_CACHE_DIR, f"{broker}_{key}.json")
+
+def load_cone_cache(broker, ra, dec):
+    """Cached cone-search result, or None if missing or expired"""
+    cache_file = get_cone_cache_file(broker, ra, dec)
+    if not os.path.exists(cache_file):
+        return None
+    cache_date = datetime.fromtimestamp(os.path.getmtime(cache_file))
+    if datetime.now() - cache_date > timedelta(days=CONE_CACHE_DURATION):
+        return None
+    try:
+        with open(cache_file, 'r') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Batch lookup: Error loading cache: {e}", file=sys.stderr)
+        return None
+
+def save_cone_cache(broker, ra, dec, result):
+    """Cache a successful cone-search result"""
+    if not os.path.exists(CONE_CACHE_DIR):
+        os.makedirs(CONE_CACHE_DIR, exist_ok=True)
+    try:
+        with open(get_cone_cache_file(broker, ra, dec), 'w') as f:
+            json.dump(result, f)
+    except Exception as e:
+        print(f"Batch lookup: Error saving cache: {e}", file=sys.stderr)
+
+def extract_matches(broker, result):
+    """Normalize a broker cone-search result to (match_id, ra, dec, separation) tuples.
+
+    ``separation`` is None unless the broker reports it.
+    """
+    if not result or not result.get("success"):
+        return []
+    data = result.get("data") or []
+    if isinstance(data, dict):
+        data = [data]
+    matches = []
+    for item in data:
+        if broker == "alerce":
+            matches.append((item.get("oid"), item.get("meanra"), item.get("meandec"), None))
+        elif broker == "antares":
+            matches.append((item.get("locus_id"), item.get("ra"), item.get("dec"), None))
+        elif broker == "lasair":
+            object_data = item.get("objectData") or {}
+            matches.append((
+                item.get("objectId") or item.get("object"),
+                object_data.get("ramean", item.get("ra")),
+                object_data.get("decmean", item.get("dec")),
+                item.get("separation")
+            ))
+    return matches
+
+def batch_cone_search(ras, decs, brokers=None, api_token=None, max_workers=MAX_WORKERS,
+                      max_workers_per_broker=MAX_WORKERS_PER_BROKER, use_cache=True,
+                      dedupe_radius_arcsec=DEDUPE_RADIUS_ARCSEC, deadline=None):
+    """Cross-match many positions against the broker cone searches.
+
+    Near-duplicate positions are collapsed, the unique positions are visited in
+    sky order (declination zone, then RA) so neighbouring targets run together,
+    and each (position, broker) search goes through a bounded thread pool with
+    at most ``max_workers_per_broker`` concurrent calls per broker. Results are
+    cached per broker and rounded position.
+
+    Returns a list of rows, one per input row and match (a row with
+    ``match_id`` None means the broker found nothing), with the separation
+    between the input position and the match in arcsec.
+    """
+    try:
+        import numpy as np
+
+        deadline = Deadline.from_value(deadline)
+        brokers = brokers or BROKERS
+        unknown = [broker for broker in brokers if broker not in BROKERS]
+        if unknown:
+            return {"success": False, "error": f"Unknown brokers: {', '.join(unknown)}"}
+        ras = np.asarray(ras, dtype=float)
+        decs = np.asarray(decs, dtype=float)
+        if ras.shape != decs.shape:
+            return {"success": False, "error": "ra and dec must have the same length"}
+        if ras.size == 0:
+            return {"success": True, "data": []}
+
+        groups = cluster_positions(ras, decs, dedupe_radius_arcsec)
+        unique_rows = np.unique(groups)
+        ordered_rows = unique_rows[sky_order(ras[unique_rows], decs[unique_rows])]
+        print(f"Batch lookup: {ras.size} positions, {unique_rows.size} unique after deduplication", file=sys.stderr)
+
+        headers = get_lasair_headers(api_token)
+        semaphores = {broker: threading.Semaphore(max(1, int(max_workers_per_broker))) for broker in brokers}
+        searches = {
+            "alerce": lambda ra, dec: query_alerce_by_coordinates(ra, dec, deadline=deadline),
+            "antares": lambda ra, dec: query_antares_by_coordinates(ra, dec, deadline=deadline),
+            "lasair": lambda ra, dec: query_lasair_by_coordinates(ra, dec, headers, deadline=deadline),
+        }
+
+        def search(task):
+            row, broker = task
+            ra, dec = float(ras[row]), float(decs[row])
+            if use_cache:
+                cached = load_cone_cache(broker, ra, dec)
+                if cached is not None:
+                    return task, cached
+            if deadline.expired():
+                return task, {"success": False, "error": "Request deadline exceeded", "partial": True}
+            with semaphores[broker]:
+                result = searches[broker](ra, dec)
+            if result is None:
+                # ALeRCE reports "nothing found" as None
+                result = {"success": True, "data": []}
+            if use_cache and result.get("success") and not result.get("partial"):
+                save_cone_cache(broker, ra, dec, result)
+            return task, result
+
+        tasks = [(int(row), broker) for row in ordered_rows for broker in brokers]
+        with ThreadPoolExecutor(max_workers=max(1, int(max_workers))) as executor:
+            results = dict(executor.map(search, tasks))
+
+        rows = []
+        partial = False
+        for input_row in range(ras.size):
+            group = int(groups[input_row])
+            for broker in brokers:
+                result = results[(group, broker)]
+                partial = partial or bool(result.get("partial"))
+                base = {"row": input_row, "ra": float(ras[input_row]), "dec": float(decs[input_row]),
+                        "group": group, "broker": broker}
+                matches = extract_matches(broker, result)
+                if not matches:
+                    rows.append(dict(base, match_id=None, match_ra=None, match_dec=None,
+                                     separation_arcsec=None, error=None if result.get("success") else result.get("error")))
+                    continue
+                match_ras = np.array([m[1] if m[1] is not None else np.nan for m in matches], dtype=float)
+                match_decs = np.array([m[2] if m[2] is not None else np.nan for m in matches], dtype=float)
+                separations = angular_separation_arcsec(ras[input_row], decs[input_row], match_ras, match_decs)
+                for (match_id, match_ra, match_dec, reported), separation in zip(matches, separations):
+                    if np.isnan(separation):
+                        separation = reported
+                    rows.append(dict(base, match_id=match_id, match_ra=match_ra, match_dec=match_dec,
+                                     separation_arcsec=round(float(separation), 3) if separation is not None else None,
+                                     error=None))
+
+        response = {"success": True, "data": rows, "unique_positions": int(unique_rows.size)}
+        if partial:
+            response["partial"] = True
+        return response
+    except Exception as e:
+        print(f"Batch lookup: Error: {str(e)}", file=sys.stderr)
+        return {"success": False, "error": str(e)}
+
+if __name__ == "__main__":
+    # Command line interface: '{"ra": [...], "dec": [...], "brokers": ["alerce", "lasair"]}'
+    if len(sys.argv) != 2:
+        print("Usage: python batch_lookup.py '<json_args>'")
+        sys.exit(1)
+
+    try:
+        args = json.loads(sys.argv[1])
+        result = batch_cone_search(
+            args.get('ra', []), args.get('dec', []),
+            brokers=args.get('brokers'),
+            api_token=args.get('api_token'),
+            max_workers=args.get('max_workers', MAX_WORKERS),
+            use_cache=args.get('use_cache', True),
+            deadline=args.get('deadline')
+        )
+        print(json.dumps(result))
+
+    except Exception as e:
+        error_result = {"success": False, "error": f"Script error: {str(e)}"}
+        print(json.dumps(error_result))
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Startup Benchmark for the CLI entry points
+Measures import time of broker_client.py / atlas_api.py and time-to-first-result
+for each mode, and fails when a run regresses against a saved baseline or when
+a mode loads heavy dependencies it does not need.
+
+By default the modes run with a tiny deadline so no network round trip is
+included: the timing covers interpreter start, imports and dispatch, which is
+what every spawned request pays. Use --network to time real upstream calls.
+
+Usage:
+    python bench_startup.py                  # run and compare with the baseline
+    python bench_startup.py --save-baseline  # record a new baseline
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+BASELINE_FILE = "bench_startup_baseline.json"
+DEFAULT_TOLERANCE = 1.3  # Fail if a median exceeds the baseline by more than 30%...
+DEFAULT_SLACK_MS = 50  # ...plus this absolute allowance for timer noise
+OFFLINE_DEADLINE = 0.001  # Seconds; makes every mode return before any network call
+
+SAMPLE_ZTF_ID = "ZTF20aaelulu"
+SAMPLE_RA = 185.728875
+SAMPLE_DEC = 15.8236
+
+HEAVY_MODULES = ["alerce", "antares_client", "astropy", "numpy", "pandas"]
+
+# mode name -> (script, CLI args, heavy modules the mode must not import).
+# The client libraries pull in some heavy modules themselves (alerce loads
+# pandas and astropy, antares_client loads pandas), so only modules our own
+# code controls are listed.
+MODES = {
+    "fink": ("broker_client.py", {"broker": "fink", "ztf_id": SAMPLE_ZTF_ID},
+             ["alerce", "antares_client", "astropy", "pandas"]),
+    "lasair": ("broker_client.py", {"broker": "lasair", "ztf_id": SAMPLE_ZTF_ID, "ra": SAMPLE_RA, "dec": SAMPLE_DEC},
+               HEAVY_MODULES),
+    "alerce": ("broker_client.py", {"broker": "alerce", "ztf_id": SAMPLE_ZTF_ID, "ra": SAMPLE_RA, "dec": SAMPLE_DEC},
+               ["antares_client"]),
+    "antares": ("broker_client.py", {"broker": "antares", "ztf_id": SAMPLE_ZTF_ID, "ra": SAMPLE_RA, "dec": SAMPLE_DEC},
+                ["alerce"]),
+    "lightcurve": ("broker_client.py", {"mode": "lightcurve", "ztf_id": SAMPLE_ZTF_ID},
+                   ["antares_client"]),
+    "crossmatch": ("broker_client.py", {"mode": "crossmatch", "ra": SAMPLE_RA, "dec": SAMPLE_DEC},
+                   ["antares_client"]),
+    "atlas": ("atlas_api.py", {"username": "", "password": "", "ra": SAMPLE_RA, "dec": SAMPLE_DEC},
+              HEAVY_MODULES),
+}
+
+# Runs a CLI script in-process and reports which heavy modules it loaded
+RUNNER = """
+import json, runpy, sys
+script, args, heavy = sys.argv[1], sys.argv[2], json.loads(sys.argv[3])
+sys.argv = [script, args]
+runpy.run_path(script, run_name="__main__")
+print("@@modules@@" + json.dumps([name for name in heavy if name in sys.modules]))
+"""
+
+def time_command(command, repeat):
+    """Median wall time of a command in milliseconds, plus its last stdout"""
+    timings = []
+    output = ""
+    for _ in range(repeat):
+        start = time.perf_counter()
+        completed = subprocess.run(command, capture_output=True, text=True)
+        timings.append((time.perf_counter() - start) * 1000)
+        output = completed.stdout
+    return statistics.median(timings), output
+
+def bench_imports(repeat):
+    """Import time of each module, net of bare interpreter startup"""
+    interpreter, _ = time_command([sys.executable, "-c", "pass"], repeat)
+    results = {}
+    for module in ["broker_client", "atlas_api"]:
+        total, _ = time_command([sys.executable, "-c", f"import {module}"], repeat)
+        results[f"import:{module}"] = round(max(0.0, total - interpreter), 1)
+    results["interpreter"] = round(interpreter, 1)
+    return results
+
+def bench_modes(repeat, network):
+    """Time-to-first-result for each CLI mode and the heavy modules each loaded"""
+    timings = {}
+    violations = []
+    for mode, (script, args, forbidden) in MODES.items():
+        args = dict(args)
+        if not network:
+            args["deadline"] = OFFLINE_DEADLINE
+        command = [sys.executable, "-c", RUNNER, script, json.dumps(args), json.dumps(HEAVY_MODULES)]
+        elapsed, output = time_command(command, repeat)
+        timings[f"mode:{mode}"] = round(elapsed, 1)
+        loaded = []
+        for line in output.splitlines():
+            if line.startswith("@@modules@@"):
+                loaded = json.loads(line[len("@@modules@@"):])
+        unexpected = sorted(set(loaded) & set(forbidden))
+        if unexpected:
+            violations.append(f"{mode} imported {', '.join(unexpected)}")
+    return timings, violations
+
+def compare(results, baseline, tolerance, slack_ms):
+    """Names of measurements that regressed against the baseline"""
+    regressions = []
+    for name, value in results.items():
+        if name == "interpreter" or name not in baseline:
+            continue
+        limit = baseline[name] * tolerance + slack_ms
+        if value > limit:
+            regressions.append(f"{name}: {value:.1f} ms > {limit:.1f} ms (baseline {baseline[name]:.1f} ms)")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CLI startup time")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per measurement (median is reported)")
+    parser.add_argument("--network", action="store_true", help="include real upstream calls")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="allowed ratio over baseline")
+    parser.add_argument("--slack-ms", type=float, default=DEFAULT_SLACK_MS, help="allowed absolute excess in ms")
+    options = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    results = bench_imports(options.repeat)
+    mode_timings, violations = bench_modes(options.repeat, options.network)
+    results.update(mode_timings)
+
+    for name, value in results.items():
+        print(f"{name:24s} {value:8.1f} ms")
+
+    if options.save_baseline:
+        with open(options.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {options.baseline}")
+        regressions = []
+    elif os.path.exists(options.baseline):
+        with open(options.baseline, 'r') as f:
+            regressions = compare(results, json.load(f), options.tolerance, options.slack_ms)
+    else:
+        print(f"No baseline at {options.baseline}; run with --save-baseline to create one")
+        regressions = []
+
+    for problem in violations + regressions:
+        print(f"FAIL {problem}")
+    return 1 if violations or regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
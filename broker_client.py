@@ -1,134 +1,504 @@
 #!/usr/bin/env python3
+import os
+import re
+import hashlib
 import sys
 import json
+import queue
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from itertools import islice
+
 import requests
-from alerce.core import Alerce
-from antares_client.search import get_by_ztf_object_id, get_by_id, cone_search
-from astropy.coordinates import SkyCoord, Angle
-import astropy.units as u
+
+# alerce, antares_client, astropy and numpy are imported inside the functions
+# that use them: this script is spawned per HTTP request, and Fink/Lasair
+# queries only need requests.
+from alias_index import resolve_ztf_id
+from resilience import Deadline, DeadlineExceeded, create_session, guard, run_with_deadline
+from revalidate import cache_info, spawn_refresh
+from serialization import to_builtin, write_output
+
+ALERCE_HOST = "api.alerce.online"
+ALERCE_CATSHTM_HOST = "catshtm.alerce.online"
+ANTARES_HOST = "api.antares.noirlab.edu"
+FINK_BASE_URL = "https://api.fink-portal.org/api/v1"
+FINK_COLUMNS = [
+    "i:jd", "i:magpsf", "i:sigmapsf", "i:fid", "i:ra", "i:dec", "d:cdsxmatch", "d:roid",
+    "d:mulens", "d:snn_snia_vs_nonia", "d:snn_sn_vs_all", "d:rf_snia_vs_nonia", "d:tag"
+]
+# Columns summarize_fink_alerts() reads, always fetched when a summary is requested
+FINK_SUMMARY_COLUMNS = [
+    "i:jd", "i:magpsf", "d:tag", "d:cdsxmatch", "d:snn_snia_vs_nonia", "d:rf_snia_vs_nonia"
+]
+LASAIR_BASE_URL = "https://lasair-ztf.lsst.ac.uk/api"
+LASAIR_CACHE_DIR = "lasair_cache"
+SHERLOCK_CACHE_DURATION = 30  # Sherlock context rarely changes; cache for 30 days
+SHERLOCK_CHUNK_SIZE = 50  # objectIds per IN (...) query
+SHERLOCK_QUERY_LIMIT = 10000  # Row limit requested from the Lasair query endpoint
+SHERLOCK_COLUMNS = ",".join(f"sherlock_classifications.{column}" for column in [
+    "objectId", "classification", "association_type", "catalogue_table_name",
+    "catalogue_object_id", "catalogue_object_type", "separationArcsec",
+    "northSeparationArcsec", "eastSeparationArcsec", "physical_separation_kpc",
+    "direct_distance", "distance", "z", "photoZ", "photoZErr", "Mag", "MagFilter",
+    "MagErr", "classificationReliability", "major_axis_arcsec", "description", "summary"
+])
+RESULT_CACHE_DIR = "broker_cache"
+# Hours a cached result stays fresh, per request kind; crossmatches are against static catalogues
+RESULT_CACHE_DURATIONS = {
+    "alerce": 6, "antares": 6, "fink": 6, "lasair": 6, "lightcurve": 6, "crossmatch": 24 * 30
+}
+# Hours past expiry during which a cached result is still served (marked stale) while it is refreshed
+RESULT_CACHE_STALE_GRACE = {
+    "alerce": 48, "antares": 48, "fink": 48, "lasair": 48, "lightcurve": 48, "crossmatch": 24 * 30
+}
+# Arguments that only affect how this one call runs, not what a background refresh should fetch
+REQUEST_ONLY_ARGS = ["deadline", "hedge_delay", "use_cache", "allow_stale", "profile", "output_format",
+                     "update_features"]
+# Request options that change the result and so belong in the cache key
+RESULT_CACHE_OPTIONS = [
+    "radius", "limit", "max_points", "properties", "include_tags", "columns", "include_summary", "include_full_data"
+]
+# Brokers whose results depend on the caller's API token
+TOKEN_GATED_BROKERS = ["lasair"]
+HEDGE_DELAY = 1.5  # Seconds to wait on an ID lookup before starting the coordinate lookup
+ZTF_ID_PATTERN = re.compile(r'^ZTF\d{2}[a-z]{7}$')
+
+_session = None
 
 def is_ztf_id(name):
     """Check if a name appears to be a ZTF ID."""
     return name and (name.startswith('ZTF') or name.startswith('ztf'))
 
-def query_alerce(ra=None, dec=None, ztf_id=None):
+def get_alerce_client():
+    """Create an ALeRCE client, importing the library on first use."""
+    from alerce.core import Alerce
+    return Alerce()
+
+def get_session():
+    """Return a process-wide requests session with a pooled, resilient HTTP adapter."""
+    global _session
+    if _session is None:
+        _session = create_session()
+    return _session
+
+def resolve_target(ztf_id=None, ra=None, dec=None, broker="Broker"):
+    """Swap a TNS/ATLAS/PS name, or a bare position, for the object's ZTF ID.
+
+    Uses the TNS alias index so lookups can take the direct ID endpoints;
+    names that cannot be resolved are returned unchanged.
+    """
+    if ztf_id and is_ztf_id(ztf_id):
+        return ztf_id
+    if not ztf_id and not has_coordinates(ra, dec):
+        return ztf_id
+    resolved = resolve_ztf_id(ztf_id, ra, dec)
+    if resolved:
+        print(f"{broker}: Resolved {ztf_id or f'RA={ra}, Dec={dec}'} to {resolved} via TNS alias index", file=sys.stderr)
+        return resolved
+    return ztf_id
+
+def has_coordinates(ra, dec):
+    """Check that both coordinates were provided."""
+    return ra is not None and dec is not None and ra != '' and dec != ''
+
+def is_useful_result(result):
+    """A result worth returning from a hedged lookup: successful and non-empty."""
+    return bool(result) and result.get("success") and result.get("data") not in (None, [], {})
+
+class QueryCancelled(Exception):
+    """The other query of a hedged lookup has already answered"""
+
+def check_cancelled(cancel_event):
+    """Raise QueryCancelled once a hedged lookup's cancel event is set.
+
+    Called before taking a rate-limit token and again before issuing the
+    request, so the losing query neither holds a token nor the half-open
+    probe (the breaker treats the exception as neutral and hands it back).
+    """
+    if cancel_event is not None and cancel_event.is_set():
+        raise QueryCancelled("Hedged lookup already answered")
+
+def hedged_lookup(id_query, coordinate_query, hedge_delay=HEDGE_DELAY, broker="Broker", deadline=None):
+    """Race an ID lookup against a coordinate lookup.
+
+    The ID query starts first; the coordinate query starts once the ID query
+    has not produced a useful answer within ``hedge_delay`` seconds (0 starts
+    both immediately). The first useful answer wins and the shared cancel
+    event is set so the other query stops issuing follow-up requests. Both
+    queries are called with that event and run on daemon threads, so an
+    abandoned request never keeps the process alive.
+
+    When neither answer is useful the coordinate result is returned (as in
+    the sequential fallback), then the ID result. If ``deadline`` runs out
+    first, the best answer so far is returned flagged as partial.
+    """
+    deadline = Deadline.from_value(deadline)
+    results = queue.Queue()
+    cancel_event = threading.Event()
+
+    def run(kind, query):
+        try:
+            result = query(cancel_event)
+        except Exception as e:
+            result = {"success": False, "error": str(e)}
+        results.put((kind, result))
+
+    def start(kind, query):
+        threading.Thread(target=run, args=(kind, query), daemon=True).start()
+        pending.add(kind)
+
+    pending = set()
+    outcomes = {}
+    start("id", id_query)
+    try:
+        kind, result = results.get(timeout=max(0.0, float(hedge_delay)))
+        pending.discard(kind)
+        outcomes[kind] = result
+        if is_useful_result(result):
+            cancel_event.set()
+            return result
+    except queue.Empty:
+        print(f"{broker}: ID query slower than {hedge_delay}s, starting coordinate query", file=sys.stderr)
+    start("coordinates", coordinate_query)
+
+    while pending:
+        try:
+            kind, result = results.get(timeout=deadline.remaining())
+        except queue.Empty:
+            print(f"{broker}: Deadline reached during hedged lookup", file=sys.stderr)
+            cancel_event.set()
+            best = outcomes.get("coordinates") or outcomes.get("id") or {"success": False, "error": "Request deadline exceeded"}
+            return dict(best, partial=True)
+        pending.discard(kind)
+        outcomes[kind] = result
+        if is_useful_result(result):
+            print(f"{broker}: Hedged lookup answered by {kind} query", file=sys.stderr)
+            cancel_event.set()
+            return result
+    cancel_event.set()
+    return outcomes.get("coordinates") or outcomes.get("id")
+
+def query_alerce_by_id(ztf_id, cancel_event=None, deadline=None):
+    """Look up an ALeRCE object by ZTF ID; returns None when nothing was found."""
+    try:
+        alerce_client = get_alerce_client()
+        print(f"ALeRCE: Attempting direct ID query for {ztf_id}", file=sys.stderr)
+        check_cancelled(cancel_event)
+        with guard("alerce", ALERCE_HOST, deadline=deadline):
+            check_cancelled(cancel_event)
+            result = run_with_deadline(lambda: alerce_client.query_objects(oid=[ztf_id], format="json"), deadline)
+        if result and len(result) > 0:
+            print(f"ALeRCE: Found object by ID {ztf_id}", file=sys.stderr)
+            return {"success": True, "data": result if isinstance(result, list) else [result]}
+        print(f"ALeRCE: No results for ID {ztf_id}", file=sys.stderr)
+    except QueryCancelled:
+        print("ALeRCE: ID query cancelled, the coordinate query answered first", file=sys.stderr)
+    except Exception as e:
+        print(f"ALeRCE: ID query failed: {str(e)}", file=sys.stderr)
+    return None
+
+def query_alerce_by_coordinates(ra, dec, cancel_event=None, deadline=None):
+    """Search ALeRCE within 3 arcsec; returns None when nothing was found."""
     try:
-        alerce_client = Alerce()
+        alerce_client = get_alerce_client()
+        print(f"ALeRCE: Attempting coordinate search at RA={ra}, Dec={dec}", file=sys.stderr)
+        check_cancelled(cancel_event)
+        with guard("alerce", ALERCE_HOST, deadline=deadline):
+            check_cancelled(cancel_event)
+            result = run_with_deadline(lambda: alerce_client.query_objects(
+                ra=float(ra),
+                dec=float(dec),
+                radius=3/3600.0,  # 3 arcsec in degrees
+                format="json"
+            ), deadline)
+        if result and len(result) > 0:
+            print(f"ALeRCE: Found {len(result)} objects by coordinates", file=sys.stderr)
+            return {"success": True, "data": result if isinstance(result, list) else [result]}
+        print("ALeRCE: No results from coordinate search", file=sys.stderr)
+        return None
+    except QueryCancelled:
+        print("ALeRCE: Coordinate query cancelled, the ID query answered first", file=sys.stderr)
+        return None
+    except Exception as e:
+        print(f"ALeRCE: Coordinate query failed: {str(e)}", file=sys.stderr)
+        return {"success": False, "error": str(e)}
+
+def query_alerce(ra=None, dec=None, ztf_id=None, hedge_delay=None, deadline=None):
+    """Query ALeRCE by ZTF ID, falling back to a coordinate search.
+
+    With ``hedge_delay`` set, the two lookups are raced via hedged_lookup()
+    instead of running one after the other. ``deadline`` (seconds or a
+    Deadline) bounds the whole lookup.
+    """
+    try:
+        deadline = Deadline.from_value(deadline)
+        ztf_id = resolve_target(ztf_id, ra, dec, "ALeRCE")
+        if hedge_delay is not None and ztf_id and has_coordinates(ra, dec):
+            result = hedged_lookup(
+                lambda cancel_event: query_alerce_by_id(ztf_id, cancel_event, deadline),
+                lambda cancel_event: query_alerce_by_coordinates(ra, dec, cancel_event, deadline),
+                hedge_delay, "ALeRCE", deadline
+            )
+            if result:
+                return result
+            return {"success": False, "error": "No valid search criteria provided or no results found"}
         # Always try name/ID search if provided
         if ztf_id:
-            try:
-                print(f"ALeRCE: Attempting direct ID query for {ztf_id}", file=sys.stderr)
-                result = alerce_client.query_objects(oid=[ztf_id], format="json")
-                if result and len(result) > 0:
-                    print(f"ALeRCE: Found object by ID {ztf_id}", file=sys.stderr)
-                    return {"success": True, "data": result if isinstance(result, list) else [result]}
-                print(f"ALeRCE: No results for ID {ztf_id}", file=sys.stderr)
-            except Exception as e:
-                print(f"ALeRCE: ID query failed: {str(e)}", file=sys.stderr)
+            result = query_alerce_by_id(ztf_id, deadline=deadline)
+            if result:
+                return result
         # If name/ID search failed or wasn't possible, try coordinates
-        if ra is not None and dec is not None and ra != '' and dec != '':
-            try:
-                print(f"ALeRCE: Attempting coordinate search at RA={ra}, Dec={dec}", file=sys.stderr)
-                result = alerce_client.query_objects(
-                    ra=float(ra),
-                    dec=float(dec),
-                    radius=3/3600.0,  # 3 arcsec in degrees
-                    format="json"
-                )
-                if result and len(result) > 0:
-                    print(f"ALeRCE: Found {len(result)} objects by coordinates", file=sys.stderr)
-                    return {"success": True, "data": result if isinstance(result, list) else [result]}
-                print("ALeRCE: No results from coordinate search", file=sys.stderr)
-            except Exception as e:
-                print(f"ALeRCE: Coordinate query failed: {str(e)}", file=sys.stderr)
-                return {"success": False, "error": str(e)}
+        if has_coordinates(ra, dec):
+            result = query_alerce_by_coordinates(ra, dec, deadline=deadline)
+            if result:
+                return result
         return {"success": False, "error": "No valid search criteria provided or no results found"}
     except Exception as e:
         print(f"ALeRCE: Query error: {str(e)}", file=sys.stderr)
         return {"success": False, "error": str(e)}
 
-def query_antares(ra=None, dec=None, ztf_id=None):
+def format_antares_locus(locus, properties=None, include_tags=True):
+    """Convert an Antares locus to a dict, keeping only whitelisted properties.
+
+    ``properties=None`` keeps the full properties dict.
+    """
+    if properties is None:
+        locus_properties = locus.properties
+    else:
+        locus_properties = {key: locus.properties[key] for key in properties if key in (locus.properties or {})}
+    formatted = {
+        "locus_id": locus.locus_id,
+        "ra": locus.ra,
+        "dec": locus.dec,
+        "properties": locus_properties
+    }
+    if include_tags:
+        formatted["tags"] = locus.tags
+    return formatted
+
+def stream_antares_cone_search(center, radius=None, limit=None, properties=None, include_tags=True):
+    """Yield formatted loci from an Antares cone search one at a time.
+
+    ``cone_search`` pages through results lazily, so stopping after ``limit``
+    loci (or when the caller stops iterating) avoids fetching further pages.
+    """
+    from antares_client.search import cone_search
+    from astropy.coordinates import Angle
+
+    radius = radius if radius is not None else Angle("3s")  # 3 arcsec
+    loci = cone_search(center, radius)
+    if limit is not None:
+        loci = islice(loci, int(limit))
+    for locus in loci:
+        yield format_antares_locus(locus, properties, include_tags)
+
+def query_antares_by_id(ztf_id, properties=None, include_tags=True, cancel_event=None, deadline=None):
+    """Look up an Antares locus by ZTF ID; returns None when nothing was found."""
+    try:
+        from antares_client.search import get_by_ztf_object_id
+
+        print(f"Antares: Attempting direct ID query for {ztf_id}", file=sys.stderr)
+        check_cancelled(cancel_event)
+        with guard("antares", ANTARES_HOST, deadline=deadline):
+            check_cancelled(cancel_event)
+            result = run_with_deadline(lambda: get_by_ztf_object_id(ztf_id), deadline)
+        if result:
+            print(f"Antares: Found object by ID {ztf_id}", file=sys.stderr)
+            return {"success": True, "data": format_antares_locus(result, properties, include_tags)}
+        print(f"Antares: No results for ID {ztf_id}", file=sys.stderr)
+    except QueryCancelled:
+        print("Antares: ID query cancelled, the coordinate query answered first", file=sys.stderr)
+    except Exception as e:
+        print(f"Antares: ID query failed: {str(e)}", file=sys.stderr)
+    return None
+
+def query_antares_by_coordinates(ra, dec, limit=None, properties=None, include_tags=True, cancel_event=None,
+                                 deadline=None):
+    """Cone search Antares within 3 arcsec, stopping early if cancelled."""
     try:
+        from astropy.coordinates import SkyCoord
+        import astropy.units as u
+
+        print(f"Antares: Attempting coordinate search at RA={ra}, Dec={dec}", file=sys.stderr)
+        # RA and Dec are already in decimal degrees
+        center = SkyCoord(ra=float(ra)*u.deg, dec=float(dec)*u.deg)
+
+        def search():
+            formatted_results = []
+            for locus in stream_antares_cone_search(center, limit=limit, properties=properties, include_tags=include_tags):
+                if cancel_event is not None and cancel_event.is_set():
+                    break
+                formatted_results.append(locus)
+            return formatted_results
+
+        check_cancelled(cancel_event)
+        with guard("antares", ANTARES_HOST, deadline=deadline):
+            check_cancelled(cancel_event)
+            formatted_results = run_with_deadline(search, deadline)
+        if formatted_results:
+            print(f"Antares: Found {len(formatted_results)} objects by coordinates", file=sys.stderr)
+            return {"success": True, "data": formatted_results}
+        print("Antares: No results from coordinate search", file=sys.stderr)
+        return {"success": True, "data": []}
+    except QueryCancelled:
+        print("Antares: Coordinate query cancelled, the ID query answered first", file=sys.stderr)
+        return None
+    except Exception as e:
+        print(f"Antares: Coordinate query failed: {str(e)}", file=sys.stderr)
+        return {"success": False, "error": str(e)}
+
+def query_antares(ra=None, dec=None, ztf_id=None, limit=None, properties=None, include_tags=True,
+                  hedge_delay=None, deadline=None):
+    """Query Antares by ZTF ID, falling back to a cone search.
+
+    ``limit`` caps the number of loci returned by the cone search and
+    ``properties`` whitelists which locus properties are kept. With
+    ``hedge_delay`` set, the two lookups are raced via hedged_lookup().
+    ``deadline`` (seconds or a Deadline) bounds the whole lookup.
+    """
+    try:
+        deadline = Deadline.from_value(deadline)
+        ztf_id = resolve_target(ztf_id, ra, dec, "Antares")
+        if hedge_delay is not None and ztf_id and has_coordinates(ra, dec):
+            return hedged_lookup(
+                lambda cancel_event: query_antares_by_id(ztf_id, properties, include_tags, cancel_event, deadline),
+                lambda cancel_event: query_antares_by_coordinates(ra, dec, limit, properties, include_tags,
+                                                                  cancel_event, deadline),
+                hedge_delay, "Antares", deadline
+            )
         # Always try name/ID search if provided
         if ztf_id:
-            try:
-                print(f"Antares: Attempting direct ID query for {ztf_id}", file=sys.stderr)
-                result = get_by_ztf_object_id(ztf_id)
-                if result:
-                    print(f"Antares: Found object by ID {ztf_id}", file=sys.stderr)
-                    return {"success": True, "data": {
-                        "locus_id": result.locus_id,
-                        "ra": result.ra,
-                        "dec": result.dec,
-                        "properties": result.properties,
-                        "tags": result.tags
-                    }}
-                print(f"Antares: No results for ID {ztf_id}", file=sys.stderr)
-            except Exception as e:
-                print(f"Antares: ID query failed: {str(e)}", file=sys.stderr)
+            result = query_antares_by_id(ztf_id, properties, include_tags, deadline=deadline)
+            if result:
+                return result
         # If name/ID search failed or wasn't possible, try coordinates
-        if ra is not None and dec is not None and ra != '' and dec != '':
+        if has_coordinates(ra, dec):
+            return query_antares_by_coordinates(ra, dec, limit, properties, include_tags, deadline=deadline)
+        return {"success": False, "error": "No valid search criteria provided or no results found"}
+    except Exception as e:
+        print(f"Antares: Query error: {str(e)}", file=sys.stderr)
+        return {"success": False, "error": str(e)}
+
+def query_antares_batch(ras, decs, radius_arcsec=3.0, limit=None, properties=None,
+                        include_tags=True, max_workers=8, deadline=None):
+    """Run many Antares cone searches through a thread pool.
+
+    All centres are built with one vectorized ``SkyCoord`` call. Returns a
+    list with one ``{"success", "data"}`` result per input position, in order;
+    searches cut off by ``deadline`` fail and the batch is flagged partial.
+    """
+    try:
+        import numpy as np
+        from astropy.coordinates import SkyCoord, Angle
+        import astropy.units as u
+
+        deadline = Deadline.from_value(deadline)
+        if len(ras) != len(decs):
+            return {"success": False, "error": "ras and decs must have the same length"}
+        if len(ras) == 0:
+            return {"success": True, "data": []}
+        centers = SkyCoord(ra=np.asarray(ras, dtype=float)*u.deg, dec=np.asarray(decs, dtype=float)*u.deg)
+        radius = Angle(float(radius_arcsec), unit=u.arcsec)
+
+        def search(index):
             try:
-                print(f"Antares: Attempting coordinate search at RA={ra}, Dec={dec}", file=sys.stderr)
-                # RA and Dec are already in decimal degrees
-                center = SkyCoord(ra=float(ra)*u.deg, dec=float(dec)*u.deg)
-                radius = Angle("3s")  # 3 arcsec
-                results = [result for result in cone_search(center, radius)]
-                if results:
-                    print(f"Antares: Found {len(results)} objects by coordinates", file=sys.stderr)
-                    formatted_results = []
-                    for result in results:
-                        formatted_results.append({
-                            "locus_id": result.locus_id,
-                            "ra": result.ra,
-                            "dec": result.dec,
-                            "properties": result.properties,
-                            "tags": result.tags
-                        })
-                    return {"success": True, "data": formatted_results}
-                print("Antares: No results from coordinate search", file=sys.stderr)
-                return {"success": True, "data": []}
+                with guard("antares", ANTARES_HOST, deadline=deadline):
+                    loci = run_with_deadline(lambda: list(stream_antares_cone_search(
+                        centers[index], radius, limit=limit, properties=properties, include_tags=include_tags
+                    )), deadline)
+                return {"success": True, "data": loci}
+            except DeadlineExceeded as e:
+                return {"success": False, "error": str(e), "partial": True}
             except Exception as e:
-                print(f"Antares: Coordinate query failed: {str(e)}", file=sys.stderr)
+                print(f"Antares: Batch cone search {index} failed: {str(e)}", file=sys.stderr)
                 return {"success": False, "error": str(e)}
-        return {"success": False, "error": "No valid search criteria provided or no results found"}
+
+        with ThreadPoolExecutor(max_workers=max(1, min(int(max_workers), len(ras)))) as executor:
+            results = list(executor.map(search, range(len(ras))))
+        num_found = sum(1 for result in results if result["success"] and result["data"])
+        print(f"Antares: Batch cone search found matches for {num_found} of {len(ras)} positions", file=sys.stderr)
+        batch_result = {"success": True, "data": results}
+        if any(result.get("partial") for result in results):
+            batch_result["partial"] = True
+        return batch_result
     except Exception as e:
-        print(f"Antares: Query error: {str(e)}", file=sys.stderr)
+        print(f"Antares: Batch query error: {str(e)}", file=sys.stderr)
         return {"success": False, "error": str(e)}
 
-def get_alerce_lightcurve(ztf_id):
+def format_alerce_detections(detections_raw):
+    """Convert raw ALeRCE detections to the light-curve point format."""
+    detections = []
+    for d in detections_raw:
+        detections.append({
+            "mjd": d.get("mjd"),
+            "mag": d.get("magpsf"),
+            "e_mag": d.get("sigmapsf"),
+            "fid": d.get("fid")
+        })
+    return detections
+
+def format_alerce_non_detections(non_detections_raw):
+    """Convert raw ALeRCE non-detections to the upper-limit point format."""
+    non_detections = []
+    for nd in non_detections_raw:
+        non_detections.append({
+            "mjd": nd.get("mjd"),
+            "diffmaglim": nd.get("diffmaglim"),
+            "fid": nd.get("fid")
+        })
+    return non_detections
+
+def get_alerce_lightcurve(ztf_id, deadline=None, max_points=None):
+    """Fetch ZTF detections and non-detections from ALeRCE.
+
+    If ``deadline`` runs out after the detections arrived, they are returned
+    without non-detections and the result is flagged partial. With
+    ``max_points`` each band is decimated for plotting (see decimation.py);
+    by default every epoch is returned.
+    """
     try:
-        alerce_client = Alerce()
-        detections_raw = alerce_client.query_detections(oid=ztf_id, format="json")
-        non_detections_raw = alerce_client.query_non_detections(oid=ztf_id, format="json")
-        # Format detections
-        detections = []
-        for d in detections_raw:
-            detections.append({
-                "mjd": d.get("mjd"),
-                "mag": d.get("magpsf"),
-                "e_mag": d.get("sigmapsf"),
-                "fid": d.get("fid")
-            })
-        non_detections = []
-        for nd in non_detections_raw:
-            non_detections.append({
-                "mjd": nd.get("mjd"),
-                "diffmaglim": nd.get("diffmaglim"),
-                "fid": nd.get("fid")
-            })
+        deadline = Deadline.from_value(deadline)
+        ztf_id = resolve_target(ztf_id, broker="ALeRCE")
+        alerce_client = get_alerce_client()
+        with guard("alerce", ALERCE_HOST, deadline=deadline):
+            detections_raw = run_with_deadline(lambda: alerce_client.query_detections(oid=ztf_id, format="json"), deadline)
+        partial = False
+        try:
+            with guard("alerce", ALERCE_HOST, deadline=deadline):
+                non_detections_raw = run_with_deadline(
+                    lambda: alerce_client.query_non_detections(oid=ztf_id, format="json"), deadline
+                )
+        except DeadlineExceeded:
+            print(f"ALeRCE: Deadline reached before non-detections for {ztf_id}", file=sys.stderr)
+            non_detections_raw = []
+            partial = True
         result = {
-            "detections": detections,
-            "non_detections": non_detections
+            "detections": format_alerce_detections(detections_raw),
+            "non_detections": format_alerce_non_detections(non_detections_raw)
         }
-        return {"success": True, "data": result}
+        if max_points:
+            from decimation import decimate_points
+            result["total_detections"] = len(result["detections"])
+            result["total_non_detections"] = len(result["non_detections"])
+            result["detections"] = decimate_points(result["detections"], max_points, "fid")
+            result["non_detections"] = decimate_points(result["non_detections"], max_points, "fid",
+                                                       value_key="diffmaglim", keep_peak=False)
+            result["max_points"] = int(max_points)
+        response = {"success": True, "data": result}
+        if partial:
+            response["partial"] = True
+        return response
     except Exception as e:
         return {"success": False, "error": str(e)}
 
-def get_alerce_crossmatch(ra=None, dec=None, radius=20):
+def get_alerce_crossmatch(ra=None, dec=None, radius=20, deadline=None):
     """Query ALeRCE crossmatch API for catalog cross-matches."""
     try:
-        alerce_client = Alerce()
+        deadline = Deadline.from_value(deadline)
+        alerce_client = get_alerce_client()
         
         # Validate coordinates
         if ra is None or dec is None:
@@ -137,13 +507,14 @@ def get_alerce_crossmatch(ra=None, dec=None, radius=20):
         print(f"ALeRCE Crossmatch: Querying RA={ra}, Dec={dec}, radius={radius} arcsec", file=sys.stderr)
         
         # Query crossmatch for all catalogs
-        crossmatch_data = alerce_client.catshtm_crossmatch(
-            ra=float(ra),
-            dec=float(dec),
-            radius=float(radius),
-            catalog_name='all',
-            format='pandas'
-        )
+        with guard("alerce", ALERCE_CATSHTM_HOST, deadline=deadline):
+            crossmatch_data = run_with_deadline(lambda: alerce_client.catshtm_crossmatch(
+                ra=float(ra),
+                dec=float(dec),
+                radius=float(radius),
+                catalog_name='all',
+                format='pandas'
+            ), deadline)
         
         # Convert pandas DataFrames to serializable dictionaries
         result = {}
@@ -158,37 +529,9 @@ def get_alerce_crossmatch(ra=None, dec=None, radius=20):
                         # Handle pandas DataFrame (2D)
                         catalog_dict = df.to_dict(orient='records')[0] if len(df) > 0 else {}
                     
-                    # Clean the data for JSON serialization
-                    cleaned_catalog = {}
-                    for key, value in catalog_dict.items():
-                        if value is not None and str(value) != 'nan' and str(value) != 'None':
-                            try:
-                                # Convert various types to JSON-serializable formats
-                                if hasattr(value, 'item'):
-                                    # Handle numpy types
-                                    value = value.item()
-                                elif hasattr(value, 'dtype'):
-                                    # Handle pandas/numpy types
-                                    if 'int' in str(value.dtype):
-                                        value = int(value)
-                                    elif 'float' in str(value.dtype):
-                                        value = float(value)
-                                    else:
-                                        value = str(value)
-                                elif isinstance(value, (int, float, bool)):
-                                    # Keep native Python types as-is
-                                    pass
-                                else:
-                                    # Convert everything else to string
-                                    value = str(value)
-                                
-                                # Final check for valid values
-                                if str(value) not in ['nan', 'None', '']:
-                                    cleaned_catalog[key] = value
-                                    
-                            except Exception as e:
-                                print(f"ALeRCE Crossmatch: Skipping key {key} due to conversion error: {e}", file=sys.stderr)
-                                continue
+                    # numpy values to Python, NaN and empty values dropped, anything else as text
+                    cleaned_catalog = {key: value for key, value in to_builtin(catalog_dict).items()
+                                       if str(value) not in ['nan', 'None', '']}
                     
                     if cleaned_catalog:  # Only include non-empty matches
                         result[catalog_name] = cleaned_catalog
@@ -202,72 +545,198 @@ def get_alerce_crossmatch(ra=None, dec=None, radius=20):
         print(f"ALeRCE Crossmatch error: {str(e)}", file=sys.stderr)
         return {"success": False, "error": str(e)}
 
-def query_fink(ra=None, dec=None, ztf_id=None):
-    """Query Fink broker for object data."""
+def iter_json_array(chunks):
+    """Incrementally decode a JSON array from an iterable of text chunks.
+
+    Yields one element at a time so a large alert history never has to be
+    held as a single string and a fully materialized list at the same time.
+    A non-array document (e.g. an error object) is yielded as a single item.
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buffer = ""
+    position = 0
+    started = False
+
+    def fill():
+        nonlocal buffer, position
+        for chunk in chunks:
+            if chunk:
+                buffer = buffer[position:] + chunk
+                position = 0
+                return True
+        return False
+
+    while True:
+        while position < len(buffer) and buffer[position] in " \t\r\n,":
+            position += 1
+        if position >= len(buffer):
+            if not fill():
+                if started:
+                    raise ValueError("Truncated JSON array")
+                return
+            continue
+        if not started:
+            if buffer[position] != "[":
+                # Not an array: decode the whole document at once
+                rest = buffer[position:] + "".join(chunks)
+                yield json.loads(rest)
+                return
+            started = True
+            position += 1
+            continue
+        if buffer[position] == "]":
+            return
+        try:
+            item, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if not fill():
+                raise
+            continue
+        yield item
+
+def iter_within_deadline(chunks, deadline):
+    """Pass chunks through, raising DeadlineExceeded once ``deadline`` has expired."""
+    for chunk in chunks:
+        deadline.timeout(None)
+        yield chunk
+
+def summarize_fink_alerts(alerts, ztf_id, columns=None, keep_alerts=True):
+    """Summarize Fink alerts in a single pass.
+
+    ``alerts`` may be any iterable (including a streaming parser). Only the
+    values needed for the summary are collected during the pass; the
+    photometry reductions are then done with NumPy. When ``columns`` is given,
+    kept alerts and the first/latest detections are projected to those columns.
+
+    Returns (summary, kept_alerts); summary is None when there are no alerts.
+    """
+    def project(alert):
+        if columns is None:
+            return alert
+        return {column: alert[column] for column in columns if column in alert}
+
+    num_alerts = 0
+    first_detection = latest_detection = None
+    first_jd = float('inf')
+    latest_jd = 0
+    classifications = {}
+    mags = []
+    valid_flags = []
+    kept_alerts = [] if keep_alerts else None
+
+    for alert in alerts:
+        num_alerts += 1
+        jd = alert.get('i:jd', float('inf'))
+        if first_detection is None or jd < first_jd:
+            first_jd, first_detection = jd, alert
+        jd = alert.get('i:jd', 0)
+        if latest_detection is None or jd > latest_jd:
+            latest_jd, latest_detection = jd, alert
+
+        if alert.get('d:cdsxmatch'):
+            classifications['cdsxmatch'] = alert['d:cdsxmatch']
+        if alert.get('d:snn_snia_vs_nonia') is not None:
+            classifications['snn_snia_vs_nonia'] = alert['d:snn_snia_vs_nonia']
+        if alert.get('d:rf_snia_vs_nonia') is not None:
+            classifications['rf_snia_vs_nonia'] = alert['d:rf_snia_vs_nonia']
+
+        mag = alert.get('i:magpsf')
+        if mag:
+            mags.append(mag)
+            valid_flags.append(alert.get('d:tag') == 'valid')
+
+        if keep_alerts:
+            kept_alerts.append(project(alert))
+
+    if num_alerts == 0:
+        return None, kept_alerts
+
+    photometry_summary = {}
+    if mags:
+        import numpy as np
+
+        mags = np.asarray(mags, dtype=float)
+        valid_flags = np.asarray(valid_flags, dtype=bool)
+        # Prefer alerts tagged 'valid'; otherwise use all alerts with magnitudes
+        if valid_flags.any():
+            mags = mags[valid_flags]
+        photometry_summary = {
+            'num_valid_detections': int(mags.size),
+            'brightest_mag': float(mags.min()),
+            'faintest_mag': float(mags.max()),
+            'mean_mag': float(mags.mean())
+        }
+
+    summary = {
+        "objectId": ztf_id,
+        "num_alerts": num_alerts,
+        "first_detection": project(first_detection),
+        "latest_detection": project(latest_detection),
+        "classifications": classifications,
+        "photometry_summary": photometry_summary
+    }
+    return summary, kept_alerts
+
+def query_fink(ra=None, dec=None, ztf_id=None, columns=None, include_summary=True,
+               include_full_data=True, stream=False, deadline=None):
+    """Query Fink broker for object data.
+
+    ``columns`` restricts the returned alert fields (the fields the summary
+    needs are still fetched). ``include_full_data=False`` drops the raw alert
+    list from the response, and ``stream=True`` parses the alert history
+    incrementally instead of loading the whole JSON body first. ``deadline``
+    (seconds or a Deadline) caps the request timeout.
+    """
     try:
+        deadline = Deadline.from_value(deadline)
+        ztf_id = resolve_target(ztf_id, ra, dec, "Fink")
         # Fink primarily works with ZTF object IDs
         if ztf_id and is_ztf_id(ztf_id):
             try:
                 print(f"Fink: Attempting query for ZTF ID {ztf_id}", file=sys.stderr)
-                
+
+                if isinstance(columns, str):
+                    columns = [column.strip() for column in columns.split(',') if column.strip()]
+                if columns:
+                    request_columns = list(columns)
+                    if include_summary:
+                        request_columns += [c for c in FINK_SUMMARY_COLUMNS if c not in request_columns]
+                else:
+                    columns = None
+                    request_columns = FINK_COLUMNS
+
                 # Query Fink API
-                response = requests.post(
-                    "https://api.fink-portal.org/api/v1/objects",
+                response = get_session().post(
+                    f"{FINK_BASE_URL}/objects",
                     json={
                         "objectId": ztf_id,
                         "output-format": "json",
-                        "columns": "i:jd,i:magpsf,i:sigmapsf,i:fid,i:ra,i:dec,d:cdsxmatch,d:roid,d:mulens,d:snn_snia_vs_nonia,d:snn_sn_vs_all,d:rf_snia_vs_nonia,d:tag"
+                        "columns": ",".join(request_columns)
                     },
-                    timeout=10
+                    timeout=deadline.timeout(10),
+                    stream=stream
                 )
-                
+
                 if response.status_code == 200:
-                    data = response.json()
-                    if data and len(data) > 0:
-                        print(f"Fink: Found {len(data)} alerts for {ztf_id}", file=sys.stderr)
-                        
-                        # Process and summarize the data
-                        summary = {
-                            "objectId": ztf_id,
-                            "num_alerts": len(data),
-                            "first_detection": min(data, key=lambda x: x.get('i:jd', float('inf'))),
-                            "latest_detection": max(data, key=lambda x: x.get('i:jd', 0)),
-                            "classifications": {},
-                            "photometry_summary": {}
-                        }
-                        
-                        # Extract classifications
-                        for alert in data:
-                            if alert.get('d:cdsxmatch'):
-                                summary['classifications']['cdsxmatch'] = alert['d:cdsxmatch']
-                            if alert.get('d:snn_snia_vs_nonia') is not None:
-                                summary['classifications']['snn_snia_vs_nonia'] = alert['d:snn_snia_vs_nonia']
-                            if alert.get('d:rf_snia_vs_nonia') is not None:
-                                summary['classifications']['rf_snia_vs_nonia'] = alert['d:rf_snia_vs_nonia']
-                        
-                        # Photometry summary
-                        valid_photometry = [a for a in data if a.get('d:tag') == 'valid' and a.get('i:magpsf')]
-                        if valid_photometry:
-                            mags = [a['i:magpsf'] for a in valid_photometry]
-                            summary['photometry_summary'] = {
-                                'num_valid_detections': len(valid_photometry),
-                                'brightest_mag': min(mags),
-                                'faintest_mag': max(mags),
-                                'mean_mag': sum(mags) / len(mags)
-                            }
-                        else:
-                            # If no 'd:tag' == 'valid', use all data with magnitudes
-                            all_photometry = [a for a in data if a.get('i:magpsf')]
-                            if all_photometry:
-                                mags = [a['i:magpsf'] for a in all_photometry]
-                                summary['photometry_summary'] = {
-                                    'num_valid_detections': len(all_photometry),
-                                    'brightest_mag': min(mags),
-                                    'faintest_mag': max(mags),
-                                    'mean_mag': sum(mags) / len(mags)
-                                }
-                        
-                        return {"success": True, "data": {"summary": summary, "full_data": data}}
+                    if stream:
+                        response.encoding = response.encoding or 'utf-8'
+                        chunks = response.iter_content(chunk_size=65536, decode_unicode=True)
+                        alerts = iter_json_array(iter_within_deadline(chunks, deadline))
+                    else:
+                        alerts = response.json() or []
+
+                    summary, full_data = summarize_fink_alerts(
+                        alerts, ztf_id, columns=columns, keep_alerts=include_full_data
+                    )
+                    if summary:
+                        print(f"Fink: Found {summary['num_alerts']} alerts for {ztf_id}", file=sys.stderr)
+                        data = {}
+                        if include_summary:
+                            data["summary"] = summary
+                        if include_full_data:
+                            data["full_data"] = full_data
+                        return {"success": True, "data": data}
                     else:
                         print(f"Fink: No data found for {ztf_id}", file=sys.stderr)
                         return {"success": True, "data": []}
@@ -275,6 +744,10 @@ def query_fink(ra=None, dec=None, ztf_id=None):
                     print(f"Fink: HTTP {response.status_code} for {ztf_id}", file=sys.stderr)
                     return {"success": False, "error": f"HTTP {response.status_code}"}
                     
+            except DeadlineExceeded as e:
+                # Subclass of Timeout: the request budget, not Fink, ran out
+                print(f"Fink: Deadline reached querying {ztf_id}", file=sys.stderr)
+                return {"success": False, "error": str(e), "partial": True}
             except requests.exceptions.Timeout:
                 print(f"Fink: Timeout querying {ztf_id}", file=sys.stderr)
                 return {"success": False, "error": "Request timeout"}
@@ -289,163 +762,231 @@ def query_fink(ra=None, dec=None, ztf_id=None):
         print(f"Fink: General error: {str(e)}", file=sys.stderr)
         return {"success": False, "error": str(e)}
 
-def query_lasair(ra=None, dec=None, ztf_id=None, api_token=None):
-    """Query Lasair broker for object data."""
+def get_lasair_headers(api_token=None):
+    """Request headers for Lasair, with the API token when one is provided."""
+    headers = {}
+    if api_token:
+        headers['Authorization'] = f'Token {api_token}'
+    return headers
+
+def query_lasair_by_id(ztf_id, headers, cancel_event=None, deadline=None):
+    """Fetch a Lasair object plus its Sherlock context by ZTF ID.
+
+    Returns None when the object was not found or the lookup failed, so the
+    caller can fall back to a cone search. The Sherlock follow-up queries are
+    skipped once ``cancel_event`` is set; if ``deadline`` runs out during
+    them, the object data gathered so far is returned flagged as partial.
+    """
+    base_url = LASAIR_BASE_URL
+    deadline = Deadline.from_value(deadline)
     try:
-        base_url = "https://lasair-ztf.lsst.ac.uk/api"
+        print(f"Lasair: Attempting object query for ZTF ID {ztf_id}", file=sys.stderr)
         
-        # Set up headers with API token if provided
-        headers = {}
-        if api_token:
-            headers['Authorization'] = f'Token {api_token}'
-            print(f"Lasair: Using API token for authentication", file=sys.stderr)
-        else:
-            print(f"Lasair: No API token provided - some queries may fail", file=sys.stderr)
+        # Query specific object
+        response = get_session().get(
+            f"{base_url}/object/",
+            params={
+                "objectId": ztf_id,
+                "format": "json"
+            },
+            headers=headers,
+            timeout=deadline.timeout(10)
+        )
         
-        # Try object query first if we have a ZTF ID
-        if ztf_id and is_ztf_id(ztf_id):
-            try:
-                print(f"Lasair: Attempting object query for ZTF ID {ztf_id}", file=sys.stderr)
+        if response.status_code == 200:
+            data = response.json()
+            if data and data.get('objectId'):
+                print(f"Lasair: Found object data for {ztf_id}", file=sys.stderr)
                 
-                # Query specific object
-                response = requests.get(
-                    f"{base_url}/object/",
-                    params={
-                        "objectId": ztf_id,
-                        "format": "json"
-                    },
-                    headers=headers,
-                    timeout=10
-                )
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    if data and data.get('objectId'):
-                        print(f"Lasair: Found object data for {ztf_id}", file=sys.stderr)
+                # Get rich Sherlock and annotator data using SQL queries
+                try:
+                    if cancel_event is not None and cancel_event.is_set():
+                        return {"success": True, "data": data}
+
+                    # Query sherlock_classifications table for detailed contextual data
+                    sherlock_response = get_session().get(
+                        f"{base_url}/query/",
+                        params={
+                            "selected": SHERLOCK_COLUMNS,
+                            "tables": "sherlock_classifications",
+                            "conditions": f"sherlock_classifications.objectId='{ztf_id}'",
+                            "format": "json"
+                        },
+                        headers=headers,
+                        timeout=deadline.timeout(15)
+                    )
+                    
+                    if sherlock_response.status_code == 200:
+                        sherlock_data = sherlock_response.json()
+                        if sherlock_data and len(sherlock_data) > 0:
+                            data['sherlock_classifications'] = sherlock_data
+                            print(f"Lasair: Added detailed Sherlock classifications for {ztf_id}", file=sys.stderr)
+                        else:
+                            print(f"Lasair: No sherlock_classifications data found for {ztf_id}", file=sys.stderr)
+                    else:
+                        print(f"Lasair: Sherlock classifications query HTTP {sherlock_response.status_code}", file=sys.stderr)
+                    
+                    # Note: Annotator table access seems to require special format, skipping for now
+                    
+                    if cancel_event is not None and cancel_event.is_set():
+                        return {"success": True, "data": data}
+
+                    # Also get the original Sherlock data for compatibility
+                    sherlock_response = get_session().get(
+                        f"{base_url}/sherlock/object/",
+                        params={
+                            "objectId": ztf_id,
+                            "format": "json"
+                        },
+                        headers=headers,
+                        timeout=deadline.timeout(15)
+                    )
+                    if sherlock_response.status_code == 200:
+                        sherlock_legacy = sherlock_response.json()
+                        data['sherlock'] = sherlock_legacy
+                        print(f"Lasair: Added legacy Sherlock data for {ztf_id}", file=sys.stderr)
                         
-                        # Get rich Sherlock and annotator data using SQL queries
-                        try:
-                            # Query sherlock_classifications table for detailed contextual data
-                            sherlock_response = requests.get(
-                                f"{base_url}/query/",
-                                params={
-                                    "selected": f"sherlock_classifications.objectId,sherlock_classifications.classification,sherlock_classifications.association_type,sherlock_classifications.catalogue_table_name,sherlock_classifications.catalogue_object_id,sherlock_classifications.catalogue_object_type,sherlock_classifications.separationArcsec,sherlock_classifications.northSeparationArcsec,sherlock_classifications.eastSeparationArcsec,sherlock_classifications.physical_separation_kpc,sherlock_classifications.direct_distance,sherlock_classifications.distance,sherlock_classifications.z,sherlock_classifications.photoZ,sherlock_classifications.photoZErr,sherlock_classifications.Mag,sherlock_classifications.MagFilter,sherlock_classifications.MagErr,sherlock_classifications.classificationReliability,sherlock_classifications.major_axis_arcsec,sherlock_classifications.description,sherlock_classifications.summary",
-                                    "tables": "sherlock_classifications",
-                                    "conditions": f"sherlock_classifications.objectId='{ztf_id}'",
-                                    "format": "json"
-                                },
-                                headers=headers,
-                                timeout=15
-                            )
-                            
-                            if sherlock_response.status_code == 200:
-                                sherlock_data = sherlock_response.json()
-                                if sherlock_data and len(sherlock_data) > 0:
-                                    data['sherlock_classifications'] = sherlock_data
-                                    print(f"Lasair: Added detailed Sherlock classifications for {ztf_id}", file=sys.stderr)
-                                else:
-                                    print(f"Lasair: No sherlock_classifications data found for {ztf_id}", file=sys.stderr)
-                            else:
-                                print(f"Lasair: Sherlock classifications query HTTP {sherlock_response.status_code}", file=sys.stderr)
-                            
-                            # Note: Annotator table access seems to require special format, skipping for now
-                            
-                            # Also get the original Sherlock data for compatibility
-                            sherlock_response = requests.get(
-                                f"{base_url}/sherlock/object/",
+                except DeadlineExceeded:
+                    print(f"Lasair: Deadline reached during enhanced data queries for {ztf_id}", file=sys.stderr)
+                    return {"success": True, "data": data, "partial": True}
+                except Exception as e:
+                    print(f"Lasair: Enhanced data query failed: {str(e)}", file=sys.stderr)
+                
+                return {"success": True, "data": data}
+            else:
+                print(f"Lasair: No object data found for {ztf_id}", file=sys.stderr)
+        elif response.status_code == 401:
+            print(f"Lasair: Authentication required (HTTP 401)", file=sys.stderr)
+            return {"success": False, "error": "Authentication required. Lasair API requires a token for most queries. Please visit https://lasair-ztf.lsst.ac.uk/ to get an API token."}
+        else:
+            print(f"Lasair: Object query HTTP {response.status_code} for {ztf_id}", file=sys.stderr)
+            
+    except DeadlineExceeded:
+        print(f"Lasair: Deadline reached during object query for {ztf_id}", file=sys.stderr)
+    except requests.exceptions.Timeout:
+        print(f"Lasair: Object query timeout for {ztf_id}", file=sys.stderr)
+    except Exception as e:
+        print(f"Lasair: Object query failed for {ztf_id}: {str(e)}", file=sys.stderr)
+    return None
+
+def query_lasair_by_coordinates(ra, dec, headers, cancel_event=None, deadline=None):
+    """Cone search Lasair within 3 arcsec and fetch details for up to 3 hits.
+
+    Hits whose details could not be fetched before ``deadline`` keep their
+    basic cone-search info and the result is flagged partial.
+    """
+    base_url = LASAIR_BASE_URL
+    deadline = Deadline.from_value(deadline)
+    try:
+        print(f"Lasair: Attempting cone search at RA={ra}, Dec={dec}", file=sys.stderr)
+        
+        response = get_session().get(
+            f"{base_url}/cone/",
+            params={
+                "ra": float(ra),
+                "dec": float(dec),
+                "radius": 3.0,  # 3 arcseconds
+                "requestType": "all",
+                "format": "json"
+            },
+            headers=headers,
+            timeout=deadline.timeout(10)
+        )
+        
+        if response.status_code == 200:
+            data = response.json()
+            if data and len(data) > 0:
+                print(f"Lasair: Found {len(data)} objects by cone search", file=sys.stderr)
+                
+                # For each object found, try to get detailed information
+                detailed_objects = []
+                partial = False
+                for obj in data[:3]:  # Limit to first 3 objects to avoid too many requests
+                    if cancel_event is not None and cancel_event.is_set():
+                        break
+                    try:
+                        obj_id = obj.get('object')
+                        if obj_id:
+                            obj_response = get_session().get(
+                                f"{base_url}/object/",
                                 params={
-                                    "objectId": ztf_id,
+                                    "objectId": obj_id,
                                     "format": "json"
                                 },
                                 headers=headers,
-                                timeout=15
+                                timeout=deadline.timeout(5)
                             )
-                            if sherlock_response.status_code == 200:
-                                sherlock_legacy = sherlock_response.json()
-                                data['sherlock'] = sherlock_legacy
-                                print(f"Lasair: Added legacy Sherlock data for {ztf_id}", file=sys.stderr)
-                                
-                        except Exception as e:
-                            print(f"Lasair: Enhanced data query failed: {str(e)}", file=sys.stderr)
-                        
-                        return {"success": True, "data": data}
-                    else:
-                        print(f"Lasair: No object data found for {ztf_id}", file=sys.stderr)
-                elif response.status_code == 401:
-                    print(f"Lasair: Authentication required (HTTP 401)", file=sys.stderr)
-                    return {"success": False, "error": "Authentication required. Lasair API requires a token for most queries. Please visit https://lasair-ztf.lsst.ac.uk/ to get an API token."}
-                else:
-                    print(f"Lasair: Object query HTTP {response.status_code} for {ztf_id}", file=sys.stderr)
-                    
-            except requests.exceptions.Timeout:
-                print(f"Lasair: Object query timeout for {ztf_id}", file=sys.stderr)
-            except Exception as e:
-                print(f"Lasair: Object query failed for {ztf_id}: {str(e)}", file=sys.stderr)
+                            if obj_response.status_code == 200:
+                                obj_data = obj_response.json()
+                                obj_data['separation'] = obj.get('separation')
+                                detailed_objects.append(obj_data)
+                    except DeadlineExceeded:
+                        # Out of time: keep the basic cone-search info
+                        detailed_objects.append(obj)
+                        partial = True
+                    except Exception as e:
+                        print(f"Lasair: Failed to get details for {obj.get('object')}: {str(e)}", file=sys.stderr)
+                        # Add basic info if detailed query fails
+                        detailed_objects.append(obj)
+                
+                result = {"success": True, "data": detailed_objects if detailed_objects else data}
+                if partial:
+                    print(f"Lasair: Deadline reached, returning partial cone search details", file=sys.stderr)
+                    result["partial"] = True
+                return result
+            else:
+                print("Lasair: No objects found by cone search", file=sys.stderr)
+                return {"success": True, "data": []}
+        elif response.status_code == 401:
+            print(f"Lasair: Authentication required for cone search (HTTP 401)", file=sys.stderr)
+            return {"success": False, "error": "Authentication required. Lasair API requires a token for cone searches. Please visit https://lasair-ztf.lsst.ac.uk/ to get an API token."}
+        else:
+            print(f"Lasair: Cone search HTTP {response.status_code}", file=sys.stderr)
+            return {"success": False, "error": f"HTTP {response.status_code}"}
+            
+    except DeadlineExceeded as e:
+        print(f"Lasair: Deadline reached during cone search", file=sys.stderr)
+        return {"success": False, "error": str(e), "partial": True}
+    except requests.exceptions.Timeout:
+        print(f"Lasair: Cone search timeout", file=sys.stderr)
+        return {"success": False, "error": "Request timeout"}
+    except Exception as e:
+        print(f"Lasair: Cone search failed: {str(e)}", file=sys.stderr)
+        return {"success": False, "error": str(e)}
+
+def query_lasair(ra=None, dec=None, ztf_id=None, api_token=None, hedge_delay=None, deadline=None):
+    """Query Lasair broker for object data.
+
+    With ``hedge_delay`` set, the object lookup and the cone search are raced
+    via hedged_lookup() instead of running one after the other. ``deadline``
+    (seconds or a Deadline) bounds all sub-requests together.
+    """
+    try:
+        deadline = Deadline.from_value(deadline)
+        ztf_id = resolve_target(ztf_id, ra, dec, "Lasair")
+        # Set up headers with API token if provided
+        headers = get_lasair_headers(api_token)
+        if api_token:
+            print(f"Lasair: Using API token for authentication", file=sys.stderr)
+        else:
+            print(f"Lasair: No API token provided - some queries may fail", file=sys.stderr)
+        
+        if hedge_delay is not None and ztf_id and is_ztf_id(ztf_id) and has_coordinates(ra, dec):
+            return hedged_lookup(
+                lambda cancel_event: query_lasair_by_id(ztf_id, headers, cancel_event, deadline),
+                lambda cancel_event: query_lasair_by_coordinates(ra, dec, headers, cancel_event, deadline),
+                hedge_delay, "Lasair", deadline
+            )
+
+        # Try object query first if we have a ZTF ID
+        if ztf_id and is_ztf_id(ztf_id):
+            result = query_lasair_by_id(ztf_id, headers, deadline=deadline)
+            if result:
+                return result
         
         # If object query failed or no ZTF ID, try cone search
-        if ra is not None and dec is not None and ra != '' and dec != '':
-            try:
-                print(f"Lasair: Attempting cone search at RA={ra}, Dec={dec}", file=sys.stderr)
-                
-                response = requests.get(
-                    f"{base_url}/cone/",
-                    params={
-                        "ra": float(ra),
-                        "dec": float(dec),
-                        "radius": 3.0,  # 3 arcseconds
-                        "requestType": "all",
-                        "format": "json"
-                    },
-                    headers=headers,
-                    timeout=10
-                )
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    if data and len(data) > 0:
-                        print(f"Lasair: Found {len(data)} objects by cone search", file=sys.stderr)
-                        
-                        # For each object found, try to get detailed information
-                        detailed_objects = []
-                        for obj in data[:3]:  # Limit to first 3 objects to avoid too many requests
-                            try:
-                                obj_id = obj.get('object')
-                                if obj_id:
-                                    obj_response = requests.get(
-                                        f"{base_url}/object/",
-                                        params={
-                                            "objectId": obj_id,
-                                            "format": "json"
-                                        },
-                                        headers=headers,
-                                        timeout=5
-                                    )
-                                    if obj_response.status_code == 200:
-                                        obj_data = obj_response.json()
-                                        obj_data['separation'] = obj.get('separation')
-                                        detailed_objects.append(obj_data)
-                            except Exception as e:
-                                print(f"Lasair: Failed to get details for {obj.get('object')}: {str(e)}", file=sys.stderr)
-                                # Add basic info if detailed query fails
-                                detailed_objects.append(obj)
-                        
-                        return {"success": True, "data": detailed_objects if detailed_objects else data}
-                    else:
-                        print("Lasair: No objects found by cone search", file=sys.stderr)
-                        return {"success": True, "data": []}
-                elif response.status_code == 401:
-                    print(f"Lasair: Authentication required for cone search (HTTP 401)", file=sys.stderr)
-                    return {"success": False, "error": "Authentication required. Lasair API requires a token for cone searches. Please visit https://lasair-ztf.lsst.ac.uk/ to get an API token."}
-                else:
-                    print(f"Lasair: Cone search HTTP {response.status_code}", file=sys.stderr)
-                    return {"success": False, "error": f"HTTP {response.status_code}"}
-                    
-            except requests.exceptions.Timeout:
-                print(f"Lasair: Cone search timeout", file=sys.stderr)
-                return {"success": False, "error": "Request timeout"}
-            except Exception as e:
-                print(f"Lasair: Cone search failed: {str(e)}", file=sys.stderr)
-                return {"success": False, "error": str(e)}
+        if has_coordinates(ra, dec):
+            return query_lasair_by_coordinates(ra, dec, headers, deadline=deadline)
         
         return {"success": False, "error": "No valid search criteria provided or no results found"}
         
@@ -453,8 +994,158 @@ def query_lasair(ra=None, dec=None, ztf_id=None, api_token=None):
         print(f"Lasair: General error: {str(e)}", file=sys.stderr)
         return {"success": False, "error": str(e)}
 
-if __name__ == "__main__":
-    args = json.loads(sys.argv[1])
+def get_sherlock_cache_file(object_id):
+    """Cache file holding the Sherlock rows for one objectId"""
+    return os.path.join(LASAIR_CACHE_DIR, f"sherlock_{object_id}.json")
+
+def load_sherlock_cache(object_id):
+    """Return cached Sherlock rows for an object, or None if missing or expired"""
+    cache_file = get_sherlock_cache_file(object_id)
+    if not os.path.exists(cache_file):
+        return None
+    cache_date = datetime.fromtimestamp(os.path.getmtime(cache_file))
+    if datetime.now() - cache_date > timedelta(days=SHERLOCK_CACHE_DURATION):
+        return None
+    try:
+        with open(cache_file, 'r') as f:
+            return json.load(f)["rows"]
+    except Exception as e:
+        print(f"Lasair: Error loading Sherlock cache for {object_id}: {e}", file=sys.stderr)
+        return None
+
+def save_sherlock_cache(object_id, rows):
+    """Save Sherlock rows for an object to the cache"""
+    if not os.path.exists(LASAIR_CACHE_DIR):
+        os.makedirs(LASAIR_CACHE_DIR)
+    try:
+        with open(get_sherlock_cache_file(object_id), 'w') as f:
+            json.dump({"cached_at": datetime.now().isoformat(), "rows": rows}, f)
+    except Exception as e:
+        print(f"Lasair: Error saving Sherlock cache for {object_id}: {e}", file=sys.stderr)
+
+def fetch_sherlock_chunk(object_ids, headers, timeout=15):
+    """Run one sherlock_classifications query for a chunk of objectIds.
+
+    Returns the list of rows, or raises on HTTP errors and timeouts so the
+    caller can split the chunk and retry.
+    """
+    id_list = ",".join(f"'{object_id}'" for object_id in object_ids)
+    response = get_session().get(
+        f"{LASAIR_BASE_URL}/query/",
+        params={
+            "selected": SHERLOCK_COLUMNS,
+            "tables": "sherlock_classifications",
+            "conditions": f"sherlock_classifications.objectId IN ({id_list})",
+            "limit": SHERLOCK_QUERY_LIMIT,
+            "format": "json"
+        },
+        headers=headers,
+        timeout=timeout
+    )
+    if response.status_code == 401:
+        raise PermissionError("Authentication required. Lasair API requires a token for SQL queries.")
+    if response.status_code != 200:
+        raise RuntimeError(f"HTTP {response.status_code}")
+    rows = response.json() or []
+    if len(rows) >= SHERLOCK_QUERY_LIMIT and len(object_ids) > 1:
+        # The row limit was hit, so some objects may be truncated
+        raise RuntimeError(f"Row limit {SHERLOCK_QUERY_LIMIT} reached")
+    return rows
+
+def query_lasair_sherlock_batch(ztf_ids, api_token=None, chunk_size=SHERLOCK_CHUNK_SIZE, use_cache=True,
+                                deadline=None):
+    """Fetch Sherlock classifications for many ZTF objects at once.
+
+    Objects are looked up in the local cache first; the remainder are queried
+    in chunks with a single ``IN (...)`` condition each over a pooled session.
+    A chunk that fails (timeout, HTTP error or truncated result) is split in
+    half and retried, so the effective chunk size adapts to what Lasair accepts.
+
+    Returns a dict whose ``data`` maps each objectId to its list of
+    classification rows (empty when Sherlock has nothing for the object).
+    Objects not reached before ``deadline`` are listed under ``unfetched``
+    and the result is flagged partial.
+    """
+    try:
+        deadline = Deadline.from_value(deadline)
+        headers = get_lasair_headers(api_token)
+
+        # Normalize and validate IDs; they are interpolated into SQL
+        object_ids = []
+        invalid_ids = []
+        for ztf_id in ztf_ids or []:
+            object_id = f"ZTF{ztf_id[3:]}" if ztf_id and is_ztf_id(ztf_id) else ztf_id
+            if object_id and ZTF_ID_PATTERN.match(object_id):
+                if object_id not in object_ids:
+                    object_ids.append(object_id)
+            else:
+                invalid_ids.append(ztf_id)
+        if invalid_ids:
+            print(f"Lasair: Skipping {len(invalid_ids)} invalid ZTF IDs", file=sys.stderr)
+        if not object_ids:
+            return {"success": False, "error": "No valid ZTF object IDs provided"}
+
+        result = {}
+        pending = []
+        for object_id in object_ids:
+            cached_rows = load_sherlock_cache(object_id) if use_cache else None
+            if cached_rows is not None:
+                result[object_id] = cached_rows
+            else:
+                pending.append(object_id)
+        print(f"Lasair: Sherlock batch for {len(object_ids)} objects ({len(result)} cached, {len(pending)} to query)", file=sys.stderr)
+
+        chunk_size = max(1, int(chunk_size))
+        chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+        failed_ids = []
+        unfetched_ids = []
+        num_queries = 0
+        while chunks:
+            chunk = chunks.pop()
+            if deadline.expired():
+                unfetched_ids.extend(chunk)
+                continue
+            num_queries += 1
+            try:
+                rows = fetch_sherlock_chunk(chunk, headers, timeout=deadline.timeout(15))
+            except PermissionError as e:
+                return {"success": False, "error": str(e)}
+            except DeadlineExceeded:
+                unfetched_ids.extend(chunk)
+                continue
+            except Exception as e:
+                if len(chunk) > 1:
+                    middle = len(chunk) // 2
+                    print(f"Lasair: Sherlock chunk of {len(chunk)} failed ({str(e)}), splitting", file=sys.stderr)
+                    chunks.extend([chunk[:middle], chunk[middle:]])
+                else:
+                    print(f"Lasair: Sherlock query failed for {chunk[0]}: {str(e)}", file=sys.stderr)
+                    failed_ids.extend(chunk)
+                continue
+
+            rows_by_object = {object_id: [] for object_id in chunk}
+            for row in rows:
+                if row.get('objectId') in rows_by_object:
+                    rows_by_object[row['objectId']].append(row)
+            for object_id, object_rows in rows_by_object.items():
+                result[object_id] = object_rows
+                if use_cache:
+                    save_sherlock_cache(object_id, object_rows)
+
+        print(f"Lasair: Sherlock batch finished with {num_queries} queries, {len(failed_ids)} failures", file=sys.stderr)
+        ordered = {object_id: result[object_id] for object_id in object_ids if object_id in result}
+        batch_result = {"success": True, "data": ordered, "failed": failed_ids, "invalid": invalid_ids}
+        if unfetched_ids:
+            print(f"Lasair: Deadline reached with {len(unfetched_ids)} objects unfetched", file=sys.stderr)
+            batch_result["unfetched"] = unfetched_ids
+            batch_result["partial"] = True
+        return batch_result
+    except Exception as e:
+        print(f"Lasair: Sherlock batch error: {str(e)}", file=sys.stderr)
+        return {"success": False, "error": str(e)}
+
+def run_request(args, deadline=None):
+    """Dispatch one CLI request (a dict of arguments) to the matching query"""
     mode = args.get('mode', 'default')
     broker = args.get('broker')
     ra = args.get('ra')
@@ -462,19 +1153,189 @@ if __name__ == "__main__":
     ztf_id = args.get('ztf_id')
     api_token = args.get('api_token')
     radius = args.get('radius', 20)
-    
+    hedge_delay = args.get('hedge_delay')
+    deadline = Deadline.from_value(deadline if deadline is not None else args.get('deadline'))
+
     if mode == 'lightcurve' and ztf_id:
-        result = get_alerce_lightcurve(ztf_id)
-    elif mode == 'crossmatch':
-        result = get_alerce_crossmatch(ra, dec, radius)
-    elif broker == 'alerce':
-        result = query_alerce(ra, dec, ztf_id)
-    elif broker == 'antares':
-        result = query_antares(ra, dec, ztf_id)
-    elif broker == 'fink':
-        result = query_fink(ra, dec, ztf_id)
-    elif broker == 'lasair':
-        result = query_lasair(ra, dec, ztf_id, api_token)
-    else:
-        result = {"success": False, "error": f"Unknown broker: {broker}"}
-    print(json.dumps(result)) 
\ No newline at end of file
+        return get_alerce_lightcurve(ztf_id, deadline=deadline, max_points=args.get('max_points'))
+    if mode == 'sherlock_batch':
+        return query_lasair_sherlock_batch(
+            args.get('ztf_ids', []), api_token,
+            chunk_size=args.get('chunk_size', SHERLOCK_CHUNK_SIZE),
+            use_cache=args.get('use_cache', True),
+            deadline=deadline
+        )
+    if mode == 'antares_batch':
+        coordinates = args.get('coordinates', [])
+        return query_antares_batch(
+            [c[0] for c in coordinates], [c[1] for c in coordinates],
+            radius_arcsec=args.get('radius', 3.0),
+            limit=args.get('limit'),
+            properties=args.get('properties'),
+            include_tags=args.get('include_tags', True),
+            max_workers=args.get('max_workers', 8),
+            deadline=deadline
+        )
+    if mode == 'crossmatch':
+        return get_alerce_crossmatch(ra, dec, radius, deadline=deadline)
+    if broker == 'alerce':
+        return query_alerce(ra, dec, ztf_id, hedge_delay=hedge_delay, deadline=deadline)
+    if broker == 'antares':
+        return query_antares(
+            ra, dec, ztf_id,
+            limit=args.get('limit'),
+            properties=args.get('properties'),
+            include_tags=args.get('include_tags', True),
+            hedge_delay=hedge_delay,
+            deadline=deadline
+        )
+    if broker == 'fink':
+        return query_fink(
+            ra, dec, ztf_id,
+            columns=args.get('columns'),
+            include_summary=args.get('include_summary', True),
+            include_full_data=args.get('include_full_data', True),
+            stream=args.get('stream', False),
+            deadline=deadline
+        )
+    if broker == 'lasair':
+        return query_lasair(ra, dec, ztf_id, api_token, hedge_delay=hedge_delay, deadline=deadline)
+    return {"success": False, "error": f"Unknown broker: {broker}"}
+
+def get_request_kind(args):
+    """Cache kind of a request: its mode, or its broker for plain broker queries"""
+    mode = args.get('mode', 'default')
+    return mode if mode != 'default' else args.get('broker')
+
+def get_credential_key(args):
+    """Short hash of the API token for token-gated brokers, or None if the result does not depend on it"""
+    api_token = args.get('api_token')
+    if not api_token or args.get('broker') not in TOKEN_GATED_BROKERS:
+        return None
+    return hashlib.sha256(str(api_token).encode()).hexdigest()[:16]
+
+def get_result_cache_file(args):
+    """Result cache file for a request, or None if the request is not cacheable.
+
+    Requests for the same object share a key whichever alias they used: names
+    are resolved through the TNS alias index and positions are rounded to
+    ~0.04 arcsec. Options that change the result are part of the key, and so
+    is a hash of the API token for token-gated brokers; deadlines and hedging
+    are not.
+    """
+    kind = get_request_kind(args)
+    if kind not in RESULT_CACHE_DURATIONS:
+        return None
+    ra, dec = args.get('ra'), args.get('dec')
+    target = resolve_ztf_id(args.get('ztf_id'), ra, dec) or args.get('ztf_id')
+    key = {"target": target}
+    if not (target and is_ztf_id(target)) or kind == 'crossmatch':
+        if has_coordinates(ra, dec):
+            key["position"] = [round(float(ra), 5), round(float(dec), 5)]
+    for option in RESULT_CACHE_OPTIONS:
+        if args.get(option) is not None:
+            key[option] = args[option]
+    for option in ("radius", "limit", "max_points"):
+        if option in key:
+            # Query strings arrive as text ("2"), in-process callers pass numbers
+            key[option] = float(key[option])
+    credential = get_credential_key(args)
+    if credential:
+        key["credential"] = credential
+    digest = hashlib.md5(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()
+    return os.path.join(RESULT_CACHE_DIR, f"{kind}_{digest}.json")
+
+def load_result_cache(cache_file, max_age_hours):
+    """Cached result, or None if missing or older than ``max_age_hours``"""
+    entry = load_result_cache_entry(cache_file, max_age_hours)
+    return entry[0] if entry else None
+
+def load_result_cache_entry(cache_file, max_age_hours):
+    """(cached result, age in seconds), or None if missing or older than ``max_age_hours``"""
+    if not os.path.exists(cache_file):
+        return None
+    age = (datetime.now() - datetime.fromtimestamp(os.path.getmtime(cache_file))).total_seconds()
+    if age > max_age_hours * 3600:
+        return None
+    try:
+        with open(cache_file, 'r') as f:
+            return json.load(f), age
+    except Exception as e:
+        print(f"Result cache: Error loading {cache_file}: {e}", file=sys.stderr)
+        return None
+
+def save_result_cache(cache_file, result):
+    """Atomically cache a result"""
+    if not os.path.exists(RESULT_CACHE_DIR):
+        os.makedirs(RESULT_CACHE_DIR, exist_ok=True)
+    try:
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(result, f)
+        os.replace(tmp_file, cache_file)
+    except Exception as e:
+        print(f"Result cache: Error saving {cache_file}: {e}", file=sys.stderr)
+
+def is_result_cached(args):
+    """True when a fresh cached result exists for a request"""
+    cache_file = get_result_cache_file(args)
+    if cache_file is None:
+        return False
+    return load_result_cache(cache_file, RESULT_CACHE_DURATIONS[get_request_kind(args)]) is not None
+
+def spawn_feature_update(ztf_id, cache_file):
+    """Refresh the object's stored features from a freshly cached light curve.
+
+    Runs feature_store.py as a detached process reading the result cache
+    file, so the response is not held up by the extraction or its SQLite write.
+    """
+    try:
+        subprocess.Popen(
+            [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "feature_store.py"),
+             json.dumps({"action": "update_cached", "ztf_id": ztf_id, "cache_file": os.path.abspath(cache_file)})],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True
+        )
+    except Exception as e:
+        print(f"Feature store: Could not start update for {ztf_id}: {str(e)}", file=sys.stderr)
+
+def handle_request(args):
+    """Serve a request from the result cache, or run it and cache a complete success.
+
+    A result past its cache duration but within RESULT_CACHE_STALE_GRACE is
+    returned at once and refreshed in the background (one refresh per key).
+    Cacheable responses carry ``cache``: fresh, stale (with ``refreshing``)
+    or fetched, and the data's age. ``use_cache: false`` bypasses the cache
+    for reading; ``allow_stale: false`` fetches instead of serving stale data.
+    """
+    kind = get_request_kind(args)
+    cache_file = get_result_cache_file(args)
+    if cache_file is not None and args.get('use_cache', True):
+        max_age = RESULT_CACHE_DURATIONS[kind]
+        grace = RESULT_CACHE_STALE_GRACE[kind] if args.get('allow_stale', True) else 0
+        entry = load_result_cache_entry(cache_file, max_age + grace)
+        if entry is not None:
+            cached, age = entry
+            if age <= max_age * 3600:
+                print(f"Result cache: Hit for {kind} request", file=sys.stderr)
+                return dict(cached, cache=cache_info("fresh", age))
+            print(f"Result cache: Serving stale {kind} result ({age / 3600:.1f}h old)", file=sys.stderr)
+            refresh_args = {key: value for key, value in args.items() if key not in REQUEST_ONLY_ARGS}
+            refreshing = spawn_refresh("broker", os.path.basename(cache_file)[:-len(".json")], refresh_args)
+            return dict(cached, cache=cache_info("stale", age, refreshing))
+    result = run_request(args)
+    if cache_file is not None and result.get("success"):
+        if not result.get("partial"):
+            save_result_cache(cache_file, result)
+            if kind == 'lightcurve' and not args.get('max_points') and args.get('update_features', True):
+                spawn_feature_update(resolve_ztf_id(args.get('ztf_id')) or args.get('ztf_id'), cache_file)
+        result = dict(result, cache=cache_info("fetched"))
+    return result
+
+if __name__ == "__main__":
+    from profiling import profiled
+
+    args = json.loads(sys.argv[1])
+    with profiled(f"broker_{args.get('mode') or args.get('broker', '')}", args) as report:
+        result = handle_request(args)
+        report["success"] = result.get("success")
+    write_output(result, args.get("output_format", "json"))
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+Bulk Photometry Export
+Writes ZTF (ALeRCE) and ATLAS photometry for many objects to Parquet or
+Arrow IPC files, plus a catalog table of their TNS metadata:
+
+    <output_dir>/photometry/object=<id>/band=<band>/part-0.<ext>
+    <output_dir>/catalog.<ext>
+
+The photometry directory is a hive-partitioned dataset, so it can be read
+with e.g. ``pyarrow.dataset.dataset(path, partitioning="hive")`` or
+``pandas.read_parquet(path)``. Objects are fetched and written one at a
+time, so memory stays bounded by the largest single light curve. Fetches
+go through broker_client's result cache and atlas_api's cache, so objects
+already viewed or prefetched cost no upstream calls. Objects whose
+partition already exists are skipped, which makes interrupted runs
+resumable.
+
+Usage:
+    python bulk_export.py '{"objects": ["2024abc", "ZTF24aaabcde"], "format": "parquet"}'
+    python bulk_export.py '{"recent_days": 7, "max_objects": 1000, "output_dir": "export"}'
+"""
+import os
+import sys
+import json
+import shutil
+
+from alias_index import TNS_CACHE_FILE, ZTF_NAME_PATTERN, normalize_name, parse_coordinate, split_internal_names
+from lightcurve import BANDS, atlas_columns, ztf_columns
+from prefetch import prefetch_atlas, prefetch_atlas_batch, select_recent_objects
+from resilience import Deadline
+from tns_catalog import load_catalog_records
+
+EXPORT_DIR = "export"
+EXPORT_FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+CATALOG_BATCH_SIZE = 500  # Catalog rows buffered before a batch is written
+OBJECT_TIME_BUDGET = 600  # Seconds per object, including a new ATLAS job
+ATLAS_BATCH_SIZE = 100  # Objects whose ATLAS photometry is fetched ahead together
+# TNS fields copied into the catalog table (all kept as text, as TNS publishes them)
+CATALOG_TNS_FIELDS = ["name_prefix", "name", "ra", "declination", "type", "redshift", "discoverydate",
+                      "discoverymag", "discmagfilter", "internal_names", "lastmodified"]
+
+def photometry_schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ("mjd", pa.float64()),
+        ("mag", pa.float64()),
+        ("mag_err", pa.float64()),
+        ("flux_ujy", pa.float64()),
+        ("flux_err_ujy", pa.float64()),
+        ("limit_mag", pa.float64()),
+        ("detected", pa.bool_()),
+        ("survey", pa.string()),
+    ])
+
+def catalog_schema():
+    import pyarrow as pa
+
+    return pa.schema([("object_id", pa.string()), ("ztf_id", pa.string())]
+                     + [(f"tns_{field}", pa.string()) for field in CATALOG_TNS_FIELDS]
+                     + [(f"n_{band}", pa.int64()) for band in BANDS]
+                     + [("ztf_status", pa.string()), ("atlas_status", pa.string())])
+
+def object_id(obj):
+    """Partition value for an object: its TNS name without prefix, else its ZTF ID"""
+    return obj["name"] or obj["ztf_id"]
+
+def select_named_objects(records, names):
+    """Objects for the given TNS names, internal names or ZTF IDs, in the given order.
+
+    Uses the same object format as prefetch.select_recent_objects, with the
+    TNS record attached. ZTF IDs that TNS does not know are exported with
+    ZTF photometry only.
+    """
+    wanted = {normalize_name(name): name for name in names}
+    found = {}
+    for record in records:
+        keys = [normalize_name(record.get("name") or "")]
+        keys += [normalize_name(alias) for alias in split_internal_names(record.get("internal_names"))]
+        for key in keys:
+            if key in wanted and key not in found:
+                found[key] = record
+    objects = []
+    seen = set()
+    for key, name in wanted.items():
+        record = found.get(key)
+        if record is not None and id(record) in seen:
+            continue  # Two of the given names are aliases of one object
+        if record is None:
+            if ZTF_NAME_PATTERN.match(str(name).strip()):
+                objects.append({"name": None, "ztf_id": str(name).strip(), "ra": None, "dec": None,
+                                "discoverydate": None, "tns": {}})
+            else:
+                print(f"Bulk export: {name} not found in the TNS cache", file=sys.stderr)
+            continue
+        seen.add(id(record))
+        ztf_id = next((alias for alias in split_internal_names(record.get("internal_names"))
+                       if ZTF_NAME_PATTERN.match(alias)), None)
+        objects.append({
+            "name": record.get("name"),
+            "ztf_id": ztf_id,
+            "ra": parse_coordinate(record.get("ra"), True),
+            "dec": parse_coordinate(record.get("declination", record.get("dec")), False),
+            "discoverydate": record.get("discoverydate"),
+            "tns": record
+        })
+    return objects
+
+def fetch_ztf(obj, deadline, include_non_detections=True):
+    """ZTF detections (and upper limits) for an object, through the broker result cache"""
+    from broker_client import handle_request
+
+    if not obj["ztf_id"]:
+        return {"success": False, "error": "No ZTF ID"}
+    result = handle_request({"mode": "lightcurve", "ztf_id": obj["ztf_id"], "deadline": deadline.remaining()})
+    if result.get("success") and not include_non_detections:
+        result["data"] = dict(result["data"], non_detections=[])
+    return result
+
+def fetch_atlas(obj, username, password, deadline):
+    """ATLAS forced photometry for an object, through atlas_api's cache"""
+    if obj["ra"] is None or obj["dec"] is None:
+        return {"success": False, "error": "No coordinates"}
+    if not (username and password):
+        return {"success": False, "error": "ATLAS credentials not provided"}
+    return prefetch_atlas(obj, username, password, deadline)
+
+def photometry_tables(ztf_result, atlas_result):
+    """Per-band Arrow tables for one object's ZTF and ATLAS results"""
+    import numpy as np
+    import pyarrow as pa
+
+    parts = []
+    if ztf_result.get("success"):
+        detections = (ztf_result.get("data") or {}).get("detections") or []
+        limits = (ztf_result.get("data") or {}).get("non_detections") or []
+        columns = ztf_columns(detections)
+        parts.append(dict(columns, mag=np.array([d.get("mag") for d in detections], dtype=float),
+                          mag_err=np.array([d.get("e_mag") for d in detections], dtype=float),
+                          limit_mag=np.full(len(detections), np.nan), detected=np.ones(len(detections), dtype=bool)))
+        if limits:
+            limit_columns = ztf_columns([{"mjd": nd.get("mjd"), "fid": nd.get("fid")} for nd in limits])
+            nan = np.full(len(limits), np.nan)
+            parts.append(dict(limit_columns, flux_ujy=nan, flux_err_ujy=nan, mag=nan, mag_err=nan,
+                              limit_mag=np.array([nd.get("diffmaglim") for nd in limits], dtype=float),
+                              detected=np.zeros(len(limits), dtype=bool)))
+    if atlas_result.get("success"):
+        points = atlas_result.get("data") or []
+        columns = atlas_columns(points)
+        parts.append(dict(columns, mag=np.array([p.get("mag") for p in points], dtype=float),
+                          mag_err=np.array([p.get("e_mag") for p in points], dtype=float),
+                          limit_mag=np.full(len(points), np.nan), detected=np.ones(len(points), dtype=bool)))
+    if not parts:
+        return {}
+
+    names = ["mjd", "band", "mag", "mag_err", "flux_ujy", "flux_err_ujy", "limit_mag", "detected"]
+    merged = {name: np.concatenate([part[name] for part in parts]) for name in names}
+    usable = (merged["band"] >= 0) & np.isfinite(merged["mjd"])
+    order = np.lexsort((merged["mjd"][usable], merged["band"][usable]))
+    merged = {name: values[usable][order] for name, values in merged.items()}
+    band_ids, starts = np.unique(merged["band"], return_index=True)
+    ends = list(starts[1:]) + [merged["band"].size]
+
+    schema = photometry_schema()
+    tables = {}
+    for band_id, start, end in zip(band_ids, starts, ends):
+        band = BANDS[band_id]
+        columns = {name: merged[name][start:end] for name in names if name != "band"}
+        columns = {name: pa.array(values, from_pandas=True) for name, values in columns.items()}
+        columns["survey"] = pa.array([band.split("_")[0]] * (end - start), pa.string())
+        tables[band] = pa.table(columns).select(schema.names).cast(schema)
+    return tables
+
+def write_table(table, path, export_format):
+    """Write one table as Parquet or Arrow IPC"""
+    if export_format == "parquet":
+        import pyarrow.parquet as pq
+        pq.write_table(table, path, compression="zstd")
+    else:
+        import pyarrow as pa
+        with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+def write_object(tables, object_dir, export_format):
+    """Write an object's per-band tables, moving the partition into place only when complete"""
+    tmp_dir = f"{object_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    for band, table in tables.items():
+        band_dir = os.path.join(tmp_dir, f"band={band}")
+        os.makedirs(band_dir, exist_ok=True)
+        write_table(table, os.path.join(band_dir, f"part-0{EXPORT_FORMATS[export_format]}"), export_format)
+    os.makedirs(tmp_dir, exist_ok=True)  # An object without photometry still gets an (empty) partition
+    shutil.rmtree(object_dir, ignore_errors=True)
+    os.replace(tmp_dir, object_dir)
+
+class CatalogWriter:
+    """Streams catalog rows to a Parquet or Arrow IPC file in batches"""
+
+    def __init__(self, path, export_format):
+        import pyarrow as pa
+
+        self.schema = catalog_schema()
+        self.rows = []
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        if export_format == "parquet":
+            import pyarrow.parquet as pq
+            self.writer = pq.ParquetWriter(self.tmp_path, self.schema, compression="zstd")
+        else:
+            self.sink = pa.OSFile(self.tmp_path, "wb")
+            self.writer = pa.ipc.new_file(self.sink, self.schema)
+
+    def add(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= CATALOG_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        import pyarrow as pa
+
+        if self.rows:
+            self.writer.write_table(pa.Table.from_pylist(self.rows, schema=self.schema))
+            self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+        if hasattr(self, "sink"):
+            self.sink.close()
+        os.replace(self.tmp_path, self.path)
+
+def existing_counts(object_dir, export_format):
+    """Rows per band of a partition written by an earlier run, read from file metadata only"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    counts = {}
+    for band in BANDS:
+        path = os.path.join(object_dir, f"band={band}", f"part-0{EXPORT_FORMATS[export_format]}")
+        if not os.path.exists(path):
+            continue
+        if export_format == "parquet":
+            counts[band] = pq.read_metadata(path).num_rows
+        else:
+            with pa.memory_map(path) as source:
+                reader = pa.ipc.open_file(source)
+                counts[band] = sum(reader.get_batch(i).num_rows for i in range(reader.num_record_batches))
+    return counts
+
+def catalog_row(obj, counts, ztf_result=None, atlas_result=None):
+    """One catalog row: TNS fields, point counts per band and per-source status (None if exported earlier)"""
+    row = {"object_id": object_id(obj), "ztf_id": obj["ztf_id"]}
+    row.update({f"tns_{field}": (None if obj["tns"].get(field) is None else str(obj["tns"].get(field)))
+                for field in CATALOG_TNS_FIELDS})
+    row.update({f"n_{band}": counts.get(band, 0) for band in BANDS})
+    for source, result in (("ztf", ztf_result), ("atlas", atlas_result)):
+        row[f"{source}_status"] = None if result is None else "ok" if result.get("success") else result.get("error")
+    return row
+
+def export_objects(objects, output_dir=EXPORT_DIR, export_format="parquet", sources=("ztf", "atlas"),
+                   atlas_username=None, atlas_password=None, include_non_detections=True, overwrite=False):
+    """Export photometry and catalog rows for a list of objects, one object at a time.
+
+    Returns counts of exported, skipped (already present) and failed objects.
+    The catalog is rewritten on every run and lists every object given.
+    ATLAS photometry is fetched ahead in packed multi-target jobs of
+    ATLAS_BATCH_SIZE objects, so the per-object fetch reads it from the cache.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {export_format}")
+    photometry_dir = os.path.join(output_dir, "photometry")
+    os.makedirs(photometry_dir, exist_ok=True)
+    catalog = CatalogWriter(os.path.join(output_dir, f"catalog{EXPORT_FORMATS[export_format]}"), export_format)
+    counts = {"exported": 0, "skipped": 0, "failed": 0, "points": 0}
+    skipped_source = {"success": False, "error": "Not requested"}
+    try:
+        for i, obj in enumerate(objects):
+            if i % ATLAS_BATCH_SIZE == 0 and "atlas" in sources and atlas_username and atlas_password:
+                batch = [o for o in objects[i:i + ATLAS_BATCH_SIZE] if o["ra"] is not None and o["dec"] is not None
+                         and (overwrite or not os.path.isdir(os.path.join(photometry_dir, f"object={object_id(o)}")))]
+                if batch:
+                    prefetch_atlas_batch(batch, atlas_username, atlas_password, Deadline(OBJECT_TIME_BUDGET), None)
+            object_dir = os.path.join(photometry_dir, f"object={object_id(obj)}")
+            if os.path.isdir(object_dir) and not overwrite:
+                catalog.add(catalog_row(obj, existing_counts(object_dir, export_format)))
+                counts["skipped"] += 1
+                continue
+            deadline = Deadline(OBJECT_TIME_BUDGET)
+            ztf_result = fetch_ztf(obj, deadline, include_non_detections) if "ztf" in sources else skipped_source
+            atlas_result = (fetch_atlas(obj, atlas_username, atlas_password, deadline)
+                            if "atlas" in sources else skipped_source)
+            tables = photometry_tables(ztf_result, atlas_result)
+            catalog.add(catalog_row(obj, {band: table.num_rows for band, table in tables.items()},
+                                    ztf_result, atlas_result))
+            if not tables and not ztf_result.get("success") and not atlas_result.get("success"):
+                counts["failed"] += 1
+                continue
+            write_object(tables, object_dir, export_format)
+            counts["exported"] += 1
+            counts["points"] += sum(table.num_rows for table in tables.values())
+            print(f"Bulk export: [{i + 1}/{len(objects)}] {object_id(obj)}: "
+                  f"{sum(table.num_rows for table in tables.values())} points in {len(tables)} bands", file=sys.stderr)
+    finally:
+        catalog.close()
+    return counts
+
+def run_export(objects=None, recent_days=None, max_objects=None, tns_file=TNS_CACHE_FILE, **options):
+    """Select objects (by name, or recently updated in TNS) and export them"""
+    try:
+        records = load_catalog_records(tns_file) if os.path.exists(tns_file) else []
+        if objects:
+            selected = select_named_objects(records, objects)
+        elif recent_days:
+            selected = select_recent_objects(records, recent_days, max_objects or len(records))
+            # Index only the selected names, so no reference to the rest of the catalog outlives `records`
+            wanted = {obj["name"] for obj in selected}
+            by_name = {record.get("name"): record for record in records if record.get("name") in wanted}
+            selected = [dict(obj, tns=by_name.get(obj["name"], {})) for obj in selected]
+            del by_name
+        else:
+            return {"success": False, "error": "Either objects or recent_days is required"}
+        del records  # Only the selected objects' rows are kept while exporting
+        print(f"Bulk export: {len(selected)} objects to export", file=sys.stderr)
+        counts = export_objects(selected, **options)
+        return {"success": True, "data": dict(counts, output_dir=options.get("output_dir", EXPORT_DIR))}
+    except Exception as e:
+        print(f"Bulk export: Error: {str(e)}", file=sys.stderr)
+        return {"success": False, "error": str(e)}
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python bulk_export.py '<json_args>'")
+        sys.exit(1)
+
+    try:
+        args = json.loads(sys.argv[1])
+        result = run_export(
+            objects=args.get('objects'),
+            recent_days=args.get('recent_days'),
+            max_objects=args.get('max_objects'),
+            output_dir=args.get('output_dir', EXPORT_DIR),
+            export_format=args.get('format', 'parquet'),
+            sources=tuple(args.get('sources') or ("ztf", "atlas")),
+            atlas_username=args.get('atlas_username') or os.environ.get('ATLAS_USERNAME'),
+            atlas_password=args.get('atlas_password') or os.environ.get('ATLAS_PASSWORD'),
+            include_non_detections=args.get('include_non_detections', True),
+            overwrite=args.get('overwrite', False)
+        )
+        print(json.dumps(result))
+
+    except Exception as e:
+        error_result = {"success": False, "error": f"Script error: {str(e)}"}
+        print(json.dumps(error_result))
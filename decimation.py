@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Light-Curve Decimation
+Shape-preserving downsampling of light curves for plotting, using
+largest-triangle-three-buckets (LTTB) per band. The first and last point of
+each band and the band's peak (brightest magnitude) are always kept.
+"""
+
+def lttb_indices(x, y, target):
+    """Indices of the points LTTB keeps when reducing (x, y) to ``target`` points.
+
+    ``x`` must be sorted. The first and last points are always kept; the rest
+    are split into ``target - 2`` buckets and from each bucket the point that
+    forms the largest triangle with the previously kept point and the mean of
+    the next bucket is kept.
+    """
+    import numpy as np
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = x.size
+    if target >= n or target < 3:
+        return np.arange(n) if target >= n else np.array(sorted({0, n - 1}), dtype=int)
+    edges = np.linspace(1, n - 1, target - 1).astype(int)
+    selected = np.empty(target, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+    previous = 0
+    for bucket in range(target - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        if bucket + 2 < len(edges):
+            next_start, next_end = edges[bucket + 1], edges[bucket + 2]
+        else:
+            next_start, next_end = n - 1, n
+        mean_x = x[next_start:next_end].mean()
+        mean_y = y[next_start:next_end].mean()
+        areas = np.abs((x[previous] - mean_x) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (mean_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+    return selected
+
+def decimate_points(points, max_points, band_key, value_key="mag", time_key="mjd", keep_peak=True):
+    """Reduce a list of light-curve points to at most ~``max_points`` per band.
+
+    Points without a time or value are dropped from decimated output. With
+    ``keep_peak`` the brightest (smallest magnitude) point of each band is
+    kept even when LTTB would skip it, so a band may end up one point over
+    ``max_points``. Returns the kept points in time order.
+    """
+    import numpy as np
+
+    if not max_points or len(points) <= max_points:
+        return points
+    max_points = max(3, int(max_points))
+    kept = []
+    bands = {}
+    for index, point in enumerate(points):
+        if point.get(time_key) is None or point.get(value_key) is None:
+            continue
+        bands.setdefault(point.get(band_key), []).append(index)
+    for indices in bands.values():
+        indices = np.array(indices, dtype=int)
+        times = np.array([points[i][time_key] for i in indices], dtype=float)
+        values = np.array([points[i][value_key] for i in indices], dtype=float)
+        order = np.argsort(times, kind="stable")
+        indices, times, values = indices[order], times[order], values[order]
+        selected = set(lttb_indices(times, values, max_points).tolist())
+        if keep_peak:
+            selected.add(int(np.nanargmin(values)))
+        kept.extend(indices[sorted(selected)].tolist())
+    kept.sort(key=lambda i: (points[i][time_key], i))
+    return [points[i] for i in kept]
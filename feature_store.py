@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Light-Curve Feature Store
+Extracts summary features (peak magnitude and time, rise and decline rates,
+g-r colour at peak, detections per band) for many objects at once and keeps
+them in an indexed SQLite table, so listing and sorting pages can use them
+without fetching light curves.
+
+Each row stores a signature of the photometry it was computed from; features
+are recomputed only when an object's photometry changes.
+"""
+import os
+import sys
+import json
+import hashlib
+import sqlite3
+from datetime import datetime
+
+from lightcurve import ATLAS_FILTER_BANDS, BANDS, ZTF_FID_BANDS
+
+FEATURE_DB_FILE = os.environ.get("FEATURE_DB", "features.db")
+COLOR_WINDOW = 2.0  # Days around the peak within which g and r detections are paired
+FEATURE_COLUMNS = [
+    "peak_mag", "peak_mjd", "peak_band", "rise_rate", "decline_rate", "color_gr_at_peak",
+    "first_mjd", "last_mjd", "n_detections"
+] + [f"n_{band}" for band in BANDS]
+SORTABLE_COLUMNS = set(FEATURE_COLUMNS) | {"object_id", "computed_at"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS features (
+    object_id TEXT PRIMARY KEY,
+    peak_mag REAL,
+    peak_mjd REAL,
+    peak_band TEXT,
+    rise_rate REAL,
+    decline_rate REAL,
+    color_gr_at_peak REAL,
+    first_mjd REAL,
+    last_mjd REAL,
+    n_detections INTEGER,
+    n_ztf_g INTEGER,
+    n_ztf_r INTEGER,
+    n_ztf_i INTEGER,
+    n_atlas_c INTEGER,
+    n_atlas_o INTEGER,
+    signature TEXT,
+    computed_at TEXT
+);
+CREATE INDEX IF NOT EXISTS features_peak_mag ON features (peak_mag);
+CREATE INDEX IF NOT EXISTS features_peak_mjd ON features (peak_mjd);
+CREATE INDEX IF NOT EXISTS features_last_mjd ON features (last_mjd);
+"""
+
+def point_band(point):
+    """Band index of a light-curve point from ALeRCE (fid), ATLAS (filter) or the merged table (band)"""
+    band = point.get("band") or ZTF_FID_BANDS.get(point.get("fid")) or ATLAS_FILTER_BANDS.get(point.get("filter"))
+    return BANDS.index(band) if band in BANDS else -1
+
+def photometry_signature(points):
+    """Cheap fingerprint of a light curve: changes whenever points are added or revised"""
+    key = sorted((round(float(p.get("mjd") or 0), 5), point_band(p), p.get("mag")) for p in points)
+    return hashlib.md5(json.dumps(key).encode()).hexdigest()
+
+def group_extreme(groups, values, n_groups, largest=False):
+    """Index of the smallest (or largest) value in each group; -1 for empty groups"""
+    import numpy as np
+
+    order = np.lexsort((-values if largest else values, groups))
+    result = np.full(n_groups, -1, dtype=int)
+    unique_groups, first = np.unique(groups[order], return_index=True)
+    result[unique_groups] = order[first]
+    return result
+
+def extract_features(lightcurves):
+    """Compute features for many objects at once.
+
+    ``lightcurves`` maps object IDs to detection lists (magnitudes, with fid,
+    filter or band). All objects are concatenated into flat arrays and every
+    feature is computed with grouped numpy operations, not per-object loops.
+    Rates are in mag/day within the peak band (positive rise = brightening,
+    positive decline = fading). Returns object ID -> feature dict.
+    """
+    import numpy as np
+
+    object_ids = list(lightcurves)
+    rows = [(obj, point_band(p), p.get("mjd"), p.get("mag"))
+            for obj, object_id in enumerate(object_ids) for p in lightcurves[object_id] or []]
+    rows = [row for row in rows if row[1] >= 0 and row[2] is not None and row[3] is not None]
+    features = {object_id: dict({column: None for column in FEATURE_COLUMNS}, n_detections=0,
+                                **{f"n_{band}": 0 for band in BANDS})
+                for object_id in object_ids}
+    if not rows:
+        return features
+
+    obj, band, mjd, mag = (np.array(column) for column in zip(*rows))
+    obj, band = obj.astype(int), band.astype(int)
+    mjd, mag = mjd.astype(float), mag.astype(float)
+    n_objects, n_bands = len(object_ids), len(BANDS)
+
+    counts = np.bincount(obj * n_bands + band, minlength=n_objects * n_bands).reshape(n_objects, n_bands)
+    peak = group_extreme(obj, mag, n_objects)
+    first = group_extreme(obj, mjd, n_objects)
+    last = group_extreme(obj, mjd, n_objects, largest=True)
+
+    # First and last detection in each object's peak band
+    has_data = peak >= 0
+    peak_band = np.where(has_data, band[np.maximum(peak, 0)], -1)
+    in_peak_band = band == peak_band[obj]
+    band_first = group_extreme(obj[in_peak_band], mjd[in_peak_band], n_objects)
+    band_last = group_extreme(obj[in_peak_band], mjd[in_peak_band], n_objects, largest=True)
+    band_index = np.flatnonzero(in_peak_band)
+    peak_mjd = mjd[np.maximum(peak, 0)]
+    peak_mag = mag[np.maximum(peak, 0)]
+
+    def rate(edge, sign):
+        valid = edge >= 0
+        edge_points = band_index[np.maximum(edge, 0)]
+        dt = sign * (mjd[edge_points] - peak_mjd)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values = (mag[edge_points] - peak_mag) / dt
+        return np.where(valid & (dt > 0), values, np.nan)
+
+    rise_rate = rate(band_first, -1)
+    decline_rate = rate(band_last, 1)
+
+    # g-r colour from the g and r detections closest to the peak
+    distance = np.abs(mjd - peak_mjd[obj])
+    colors = {}
+    for name in ("ztf_g", "ztf_r"):
+        selected = np.flatnonzero((band == BANDS.index(name)) & (distance <= COLOR_WINDOW))
+        colors[name] = np.full(n_objects, np.nan)
+        if selected.size:
+            nearest = group_extreme(obj[selected], distance[selected], n_objects)
+            found = nearest >= 0
+            colors[name][found] = mag[selected[nearest[found]]]
+    color_gr = colors["ztf_g"] - colors["ztf_r"]
+
+    def value(array, i, digits):
+        return None if not np.isfinite(array[i]) else round(float(array[i]), digits)
+
+    for i, object_id in enumerate(object_ids):
+        if not has_data[i]:
+            continue
+        features[object_id].update({
+            "peak_mag": round(float(peak_mag[i]), 3),
+            "peak_mjd": round(float(peak_mjd[i]), 5),
+            "peak_band": BANDS[peak_band[i]],
+            "rise_rate": value(rise_rate, i, 4),
+            "decline_rate": value(decline_rate, i, 4),
+            "color_gr_at_peak": value(color_gr, i, 3),
+            "first_mjd": round(float(mjd[first[i]]), 5),
+            "last_mjd": round(float(mjd[last[i]]), 5),
+            "n_detections": int(counts[i].sum()),
+            **{f"n_{band_name}": int(counts[i, b]) for b, band_name in enumerate(BANDS)}
+        })
+    return features
+
+def open_feature_store(db_file=FEATURE_DB_FILE):
+    """Connection to the feature store, creating the table on first use"""
+    connection = sqlite3.connect(db_file, timeout=30)
+    connection.executescript(SCHEMA)
+    return connection
+
+def update_features(lightcurves, db_file=FEATURE_DB_FILE, force=False):
+    """Recompute and store features for the objects whose photometry changed.
+
+    Objects whose stored signature matches their current photometry are
+    skipped unless ``force`` is set. Returns the IDs that were recomputed.
+    """
+    connection = open_feature_store(db_file)
+    try:
+        signatures = {object_id: photometry_signature(points or []) for object_id, points in lightcurves.items()}
+        stored = {}
+        ids = list(signatures)
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            stored.update(connection.execute(
+                f"SELECT object_id, signature FROM features WHERE object_id IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall())
+        stale = [object_id for object_id in ids if force or stored.get(object_id) != signatures[object_id]]
+        if not stale:
+            return []
+        features = extract_features({object_id: lightcurves[object_id] for object_id in stale})
+        computed_at = datetime.now().isoformat()
+        columns = ["object_id"] + FEATURE_COLUMNS + ["signature", "computed_at"]
+        connection.executemany(
+            f"INSERT OR REPLACE INTO features ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            [[object_id] + [features[object_id][column] for column in FEATURE_COLUMNS]
+             + [signatures[object_id], computed_at] for object_id in stale]
+        )
+        connection.commit()
+        print(f"Feature store: Updated {len(stale)} of {len(ids)} objects", file=sys.stderr)
+        return stale
+    finally:
+        connection.close()
+
+def invalidate_features(object_ids, db_file=FEATURE_DB_FILE):
+    """Drop stored features so they are recomputed on the next update"""
+    connection = open_feature_store(db_file)
+    try:
+        connection.executemany("DELETE FROM features WHERE object_id = ?", [(object_id,) for object_id in object_ids])
+        connection.commit()
+    finally:
+        connection.close()
+
+def get_features(object_ids, db_file=FEATURE_DB_FILE):
+    """Stored features for the given objects (missing objects are omitted)"""
+    connection = open_feature_store(db_file)
+    connection.row_factory = sqlite3.Row
+    try:
+        rows = connection.execute(
+            f"SELECT * FROM features WHERE object_id IN ({','.join('?' * len(object_ids))})", list(object_ids)
+        ).fetchall() if object_ids else []
+        return {row["object_id"]: {key: row[key] for key in row.keys() if key != "signature"} for row in rows}
+    finally:
+        connection.close()
+
+def list_features(order_by="peak_mjd", descending=True, limit=100, offset=0, db_file=FEATURE_DB_FILE):
+    """One page of stored features, sorted by an indexed or feature column"""
+    if order_by not in SORTABLE_COLUMNS:
+        raise ValueError(f"Cannot sort by {order_by}")
+    connection = open_feature_store(db_file)
+    connection.row_factory = sqlite3.Row
+    try:
+        rows = connection.execute(
+            f"SELECT * FROM features WHERE {order_by} IS NOT NULL "
+            f"ORDER BY {order_by} {'DESC' if descending else 'ASC'} LIMIT ? OFFSET ?",
+            (int(limit), int(offset))
+        ).fetchall()
+        return [{key: row[key] for key in row.keys() if key != "signature"} for row in rows]
+    finally:
+        connection.close()
+
+if __name__ == "__main__":
+    # Command line interface:
+    #   '{"action": "update"}'  recompute from the watchlist's stored light curves
+    #   '{"action": "update_cached", "ztf_id": ..., "cache_file": ...}'  from a cached light-curve result
+    #   '{"action": "get", "ztf_ids": [...]}'
+    #   '{"action": "list", "order_by": "peak_mag", "descending": false, "limit": 50}'
+    if len(sys.argv) != 2:
+        print("Usage: python feature_store.py '<json_args>'")
+        sys.exit(1)
+
+    try:
+        args = json.loads(sys.argv[1])
+        action = args.get('action', 'list')
+        if action == 'update':
+            from watchlist import list_watchlist, load_entry
+            entries = [load_entry(ztf_id) for ztf_id in (args.get('ztf_ids') or list_watchlist())]
+            updated = update_features({entry["ztf_id"]: entry["detections"] for entry in entries if entry},
+                                      force=args.get('force', False))
+            result = {"success": True, "data": {"updated": updated}}
+        elif action == 'update_cached':
+            # Spawned by broker_client after it cached a freshly fetched light curve
+            with open(args['cache_file'], 'r') as f:
+                cached = json.load(f)
+            updated = update_features({args['ztf_id']: (cached.get("data") or {}).get("detections", [])})
+            result = {"success": True, "data": {"updated": updated}}
+        elif action == 'get':
+            result = {"success": True, "data": get_features(args.get('ztf_ids') or [])}
+        elif action == 'list':
+            result = {"success": True, "data": list_features(
+                args.get('order_by', 'peak_mjd'), args.get('descending', True),
+                args.get('limit', 100), args.get('offset', 0)
+            )}
+        else:
+            result = {"success": False, "error": f"Unknown action: {action}"}
+        print(json.dumps(result))
+
+    except Exception as e:
+        error_result = {"success": False, "error": f"Script error: {str(e)}"}
+        print(json.dumps(error_result))
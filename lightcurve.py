@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Merged Light-Curve Service
+Combines ZTF detections (ALeRCE) and ATLAS forced photometry into one
+columnar table with a common band schema, optionally stacked per band and
+night in flux space so far fewer points reach the browser.
+
+Columns: mjd, band, survey, flux_ujy, flux_err_ujy, mag, mag_err, n_points.
+Fluxes are AB microjanskys (mag = 23.9 - 2.5 log10 uJy).
+"""
+import sys
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from resilience import Deadline
+from serialization import write_output
+
+AB_ZEROPOINT_UJY = 23.9
+# Common band names; ZTF fid 1/2/3 are g/r/i, ATLAS filters are c (cyan) and o (orange)
+BANDS = ["ztf_g", "ztf_r", "ztf_i", "atlas_c", "atlas_o"]
+ZTF_FID_BANDS = {1: "ztf_g", 2: "ztf_r", 3: "ztf_i"}
+ATLAS_FILTER_BANDS = {"c": "atlas_c", "o": "atlas_o"}
+STACK_BIN_DAYS = 1.0  # Width of a "night" in days
+# Night boundaries at 16:30 UT: after dawn in Hawaii and before dusk at Sutherland all year, and daytime in
+# Chile, the Canaries and at Palomar, so no ATLAS unit's (or ZTF's) night is split at UT midnight
+STACK_BIN_OFFSET = 0.6875
+COLUMNS = ["mjd", "band", "survey", "flux_ujy", "flux_err_ujy", "mag", "mag_err", "n_points"]
+
+def mag_to_flux(mag, mag_err):
+    """AB magnitudes and errors to uJy flux and flux error (arrays)"""
+    import numpy as np
+
+    flux = 10 ** ((AB_ZEROPOINT_UJY - mag) / 2.5)
+    return flux, flux * np.log(10) / 2.5 * mag_err
+
+def flux_to_mag(flux, flux_err):
+    """uJy flux and error to AB magnitude and error; NaN where the flux is not positive"""
+    import numpy as np
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        positive = flux > 0
+        mag = np.where(positive, AB_ZEROPOINT_UJY - 2.5 * np.log10(np.where(positive, flux, 1.0)), np.nan)
+        mag_err = np.where(positive, 2.5 / np.log(10) * flux_err / np.where(positive, flux, 1.0), np.nan)
+    return mag, mag_err
+
+def ztf_columns(detections):
+    """Columns (numpy arrays) for ALeRCE detections in get_alerce_lightcurve's format"""
+    import numpy as np
+
+    mjd = np.array([d.get("mjd") for d in detections], dtype=float)
+    mag = np.array([d.get("mag") for d in detections], dtype=float)
+    mag_err = np.array([d.get("e_mag") for d in detections], dtype=float)
+    band = np.array([BANDS.index(ZTF_FID_BANDS[d.get("fid")]) if d.get("fid") in ZTF_FID_BANDS else -1
+                     for d in detections], dtype=int)
+    flux, flux_err = mag_to_flux(mag, mag_err)
+    return {"mjd": mjd, "band": band, "flux_ujy": flux, "flux_err_ujy": flux_err}
+
+def atlas_columns(points):
+    """Columns (numpy arrays) for ATLAS points in download_atlas_results' format.
+
+    The measured uJy/duJy are used when present; magnitudes are converted
+    otherwise.
+    """
+    import numpy as np
+
+    mjd = np.array([p.get("mjd") for p in points], dtype=float)
+    flux = np.array([p.get("flux_ujy") for p in points], dtype=float)
+    flux_err = np.array([p.get("flux_err_ujy") for p in points], dtype=float)
+    mag_flux, mag_flux_err = mag_to_flux(np.array([p.get("mag") for p in points], dtype=float),
+                                         np.array([p.get("e_mag") for p in points], dtype=float))
+    missing = ~np.isfinite(flux) | ~np.isfinite(flux_err)
+    flux = np.where(missing, mag_flux, flux)
+    flux_err = np.where(missing, mag_flux_err, flux_err)
+    band = np.array([BANDS.index(ATLAS_FILTER_BANDS[p.get("filter")]) if p.get("filter") in ATLAS_FILTER_BANDS else -1
+                     for p in points], dtype=int)
+    return {"mjd": mjd, "band": band, "flux_ujy": flux, "flux_err_ujy": flux_err}
+
+def merge_columns(*tables):
+    """Concatenate column tables, drop unusable rows and sort by time"""
+    import numpy as np
+
+    merged = {name: np.concatenate([table[name] for table in tables]) for name in ("mjd", "band", "flux_ujy", "flux_err_ujy")}
+    usable = ((merged["band"] >= 0) & np.isfinite(merged["mjd"]) & np.isfinite(merged["flux_ujy"])
+              & np.isfinite(merged["flux_err_ujy"]) & (merged["flux_err_ujy"] > 0))
+    order = np.argsort(merged["mjd"][usable], kind="stable")
+    merged = {name: values[usable][order] for name, values in merged.items()}
+    merged["n_points"] = np.ones(merged["mjd"].size, dtype=int)
+    return merged
+
+def stack_nightly(table, bin_days=STACK_BIN_DAYS, offset=STACK_BIN_OFFSET):
+    """Inverse-variance weighted mean flux per band and night.
+
+    Nights are bins of ``bin_days`` starting at MJD ``offset``, a fraction of
+    a day after 0h UT (STACK_BIN_OFFSET puts it in daylight at every site).
+    Each stacked point carries the weighted mean MJD, flux and flux error
+    (1/sqrt(sum of weights)) of its inputs and how many points it combines.
+    All bands and nights are reduced at once with bincount.
+    """
+    import numpy as np
+
+    if table["mjd"].size == 0:
+        return table
+    nights = np.floor((table["mjd"] - offset) / bin_days).astype(np.int64)
+    keys = table["band"].astype(np.int64) * (nights.max() - nights.min() + 1) + (nights - nights.min())
+    _, first, groups = np.unique(keys, return_index=True, return_inverse=True)
+    weights = 1.0 / table["flux_err_ujy"] ** 2
+    weight_sum = np.bincount(groups, weights)
+    stacked = {
+        "mjd": np.bincount(groups, weights * table["mjd"]) / weight_sum,
+        "band": table["band"][first],
+        "flux_ujy": np.bincount(groups, weights * table["flux_ujy"]) / weight_sum,
+        "flux_err_ujy": 1.0 / np.sqrt(weight_sum),
+        "n_points": np.bincount(groups, table["n_points"]).astype(int),
+    }
+    order = np.argsort(stacked["mjd"], kind="stable")
+    return {name: values[order] for name, values in stacked.items()}
+
+def to_columnar(table):
+    """JSON-ready columnar table (lists per column) with magnitudes filled in"""
+    import numpy as np
+
+    mag, mag_err = flux_to_mag(table["flux_ujy"], table["flux_err_ujy"])
+
+    def as_list(values, digits):
+        return [None if not np.isfinite(v) else round(float(v), digits) for v in values]
+
+    bands = [BANDS[b] for b in table["band"]]
+    return {
+        "mjd": as_list(table["mjd"], 5),
+        "band": bands,
+        "survey": [band.split("_")[0] for band in bands],
+        "flux_ujy": as_list(table["flux_ujy"], 3),
+        "flux_err_ujy": as_list(table["flux_err_ujy"], 3),
+        "mag": as_list(mag, 3),
+        "mag_err": as_list(mag_err, 3),
+        "n_points": [int(n) for n in table["n_points"]],
+    }
+
+def merge_lightcurves(ztf_detections=None, atlas_points=None, stack=True, bin_days=STACK_BIN_DAYS,
+                      offset=STACK_BIN_OFFSET):
+    """Merge already-fetched ZTF detections and ATLAS points into one columnar table"""
+    table = merge_columns(ztf_columns(ztf_detections or []), atlas_columns(atlas_points or []))
+    raw_points = int(table["mjd"].size)
+    if stack:
+        table = stack_nightly(table, bin_days, offset)
+    return {"columns": COLUMNS, "table": to_columnar(table), "raw_points": raw_points,
+            "points": int(table["mjd"].size), "stacked": bool(stack)}
+
+def get_merged_lightcurve(ztf_id=None, ra=None, dec=None, atlas_username=None, atlas_password=None,
+                          discovery_date=None, stack=True, bin_days=STACK_BIN_DAYS, offset=STACK_BIN_OFFSET,
+                          deadline=None):
+    """Fetch ZTF and ATLAS photometry concurrently and return the merged table.
+
+    ZTF needs a ZTF ID (TNS names and positions are resolved through the alias
+    index); ATLAS needs coordinates and credentials. A source that fails or is
+    unavailable is reported under ``sources`` and the result is flagged partial.
+    """
+    # Imported here so that modules needing only the band schema (feature_store,
+    # which broker_client's feature updates run) do not import broker_client
+    from broker_client import get_alerce_lightcurve, has_coordinates, resolve_target
+
+    try:
+        deadline = Deadline.from_value(deadline)
+        ztf_id = resolve_target(ztf_id, ra, dec, "Light curve")
+
+        def fetch_ztf():
+            if not ztf_id:
+                return {"success": False, "error": "No ZTF ID for this object"}
+            return get_alerce_lightcurve(ztf_id, deadline=deadline)
+
+        def fetch_atlas():
+            if not has_coordinates(ra, dec):
+                return {"success": False, "error": "Coordinates required for ATLAS"}
+            if not (atlas_username and atlas_password):
+                return {"success": False, "error": "ATLAS credentials not provided"}
+            from atlas_api import get_atlas_photometry
+            return get_atlas_photometry(atlas_username, atlas_password, float(ra), float(dec),
+                                        discovery_date, deadline=deadline)
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            ztf_future = executor.submit(fetch_ztf)
+            atlas_future = executor.submit(fetch_atlas)
+            ztf_result = ztf_future.result()
+            atlas_result = atlas_future.result()
+
+        if not ztf_result.get("success") and not atlas_result.get("success"):
+            return {"success": False, "error": f"ZTF: {ztf_result.get('error')}; ATLAS: {atlas_result.get('error')}"}
+        ztf_detections = (ztf_result.get("data") or {}).get("detections", []) if ztf_result.get("success") else []
+        atlas_points = (atlas_result.get("data") or []) if atlas_result.get("success") else []
+        data = merge_lightcurves(ztf_detections, atlas_points, stack, bin_days, offset)
+        data["sources"] = {
+            "ztf": {"success": bool(ztf_result.get("success")), "points": len(ztf_detections),
+                    "error": ztf_result.get("error")},
+            "atlas": {"success": bool(atlas_result.get("success")), "points": len(atlas_points),
+                      "error": atlas_result.get("error")},
+        }
+        response = {"success": True, "data": data}
+        if (not ztf_result.get("success") or not atlas_result.get("success")
+                or ztf_result.get("partial") or atlas_result.get("partial")):
+            response["partial"] = True
+        return response
+    except Exception as e:
+        print(f"Light curve: Error: {str(e)}", file=sys.stderr)
+        return {"success": False, "error": str(e)}
+
+if __name__ == "__main__":
+    # Command line interface: '{"ztf_id": "ZTF...", "ra": ..., "dec": ..., "stack": true}'
+    if len(sys.argv) != 2:
+        print("Usage: python lightcurve.py '<json_args>'")
+        sys.exit(1)
+
+    try:
+        args = json.loads(sys.argv[1])
+        result = get_merged_lightcurve(
+            ztf_id=args.get('ztf_id'),
+            ra=args.get('ra'),
+            dec=args.get('dec'),
+            atlas_username=args.get('atlas_username'),
+            atlas_password=args.get('atlas_password'),
+            discovery_date=args.get('discovery_date'),
+            stack=args.get('stack', True),
+            bin_days=args.get('bin_days', STACK_BIN_DAYS),
+            offset=args.get('offset', STACK_BIN_OFFSET),
+            deadline=args.get('deadline')
+        )
+        write_output(result, args.get('output_format', 'json'))
+
+    except Exception as e:
+        error_result = {"success": False, "error": f"Script error: {str(e)}"}
+        write_output(error_result)
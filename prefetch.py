@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Nightly Prefetch Scheduler
+Warms the broker, crossmatch and ATLAS caches for transients that TNS
+reported or updated recently, so the first visitor to a new object gets
+cache hits instead of paying for every upstream call.
+
+The requests issued here are the same ones the web app makes (see
+server.js), so they land on the same cache keys.
+
+Usage:
+    python prefetch.py '{"days": 2, "max_objects": 200}'        # one pass (cron)
+    python prefetch.py '{"action": "schedule", "interval": 6}'  # long-running scheduler
+"""
+import os
+import sys
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from alias_index import TNS_CACHE_FILE, ZTF_NAME_PATTERN, parse_coordinate, split_internal_names
+from broker_client import handle_request, is_result_cached
+from feature_store import update_features
+from resilience import Deadline, DeadlineExceeded
+from tns_catalog import load_catalog_records
+
+PREFETCH_DAYS = 3  # Objects discovered or modified within this many days are prefetched
+PREFETCH_MAX_OBJECTS = 200  # Most recent objects considered per pass
+PREFETCH_MAX_REQUESTS = 1000  # Upstream broker/crossmatch requests allowed per pass
+PREFETCH_MAX_ATLAS_JOBS = 20  # ATLAS forced-photometry jobs (packed ones count once) allowed per pass
+PREFETCH_WORKERS = 4
+PREFETCH_ATLAS_WORKERS = 2  # ATLAS jobs take minutes each and count against the account
+PREFETCH_TIME_BUDGET = 3 * 3600  # Seconds a single pass may run
+PREFETCH_BROKERS = ["alerce", "antares", "fink", "lasair"]
+CROSSMATCH_RADIUS = 2  # Matches the radius the web app requests
+SCHEDULE_INTERVAL = 6  # Hours between passes when the TNS cache has not changed
+SCHEDULE_POLL = 60  # Seconds between checks for a new TNS download
+
+def parse_tns_datetime(value):
+    """datetime from a TNS date field ('2024-01-15 12:34:56.000' or '2024-01-15'), or None"""
+    if not value:
+        return None
+    for fmt, length in (('%Y-%m-%d %H:%M:%S', 19), ('%Y-%m-%d', 10)):
+        try:
+            return datetime.strptime(str(value)[:length], fmt)
+        except ValueError:
+            continue
+    return None
+
+def select_recent_objects(records, days=PREFETCH_DAYS, max_objects=PREFETCH_MAX_OBJECTS):
+    """Objects discovered or modified in the last ``days`` days, newest first.
+
+    Returns dicts with the name the web app would query (the ZTF ID when TNS
+    lists one, else the TNS name), decimal coordinates and discovery date.
+    """
+    cutoff = datetime.now() - timedelta(days=days)
+    recent = []
+    for record in records:
+        dates = [parse_tns_datetime(record.get(field)) for field in ("discoverydate", "lastmodified", "creationdate")]
+        dates = [d for d in dates if d is not None]
+        if not dates or max(dates) < cutoff:
+            continue
+        ra = parse_coordinate(record.get("ra"), True)
+        dec = parse_coordinate(record.get("declination", record.get("dec")), False)
+        if ra is None or dec is None:
+            continue
+        ztf_id = next((name for name in split_internal_names(record.get("internal_names"))
+                       if ZTF_NAME_PATTERN.match(name)), None)
+        recent.append({
+            "name": record.get("name"),
+            "ztf_id": ztf_id,
+            "ra": ra,
+            "dec": dec,
+            "discoverydate": record.get("discoverydate"),
+            "updated": max(dates)
+        })
+    recent.sort(key=lambda obj: obj["updated"], reverse=True)
+    return recent[:max_objects]
+
+def build_requests(obj, brokers=PREFETCH_BROKERS, api_token=None):
+    """The broker_client requests the web app issues when an object is opened"""
+    name = obj["ztf_id"] or obj["name"]
+    ra, dec = obj["ra"], obj["dec"]
+    requests_ = []
+    for broker in brokers:
+        if broker == 'fink' and not obj["ztf_id"]:
+            continue  # Fink only answers ZTF IDs
+        args = {"broker": broker, "ra": ra, "dec": dec, "ztf_id": name}
+        if broker == 'lasair' and api_token:
+            args["api_token"] = api_token
+        requests_.append(args)
+    requests_.append({"mode": "crossmatch", "ra": ra, "dec": dec, "radius": CROSSMATCH_RADIUS})
+    if obj["ztf_id"]:
+        requests_.append({"mode": "lightcurve", "ztf_id": obj["ztf_id"]})
+    return requests_
+
+def prefetch_atlas(obj, username, password, deadline):
+    """Run (or reuse) the ATLAS forced-photometry job for one object"""
+    from atlas_api import get_atlas_photometry
+    return get_atlas_photometry(username, password, obj["ra"], obj["dec"], obj["discoverydate"], deadline=deadline,
+                                allow_stale=False)
+
+def prefetch_atlas_batch(objects, username, password, deadline, max_jobs):
+    """Run the ATLAS jobs for many objects as packed multi-target jobs; per-object results in order"""
+    from atlas_api import get_atlas_photometry_batch
+    targets = [{"ra": obj["ra"], "dec": obj["dec"], "discovery_date": obj["discoverydate"]} for obj in objects]
+    result = get_atlas_photometry_batch(username, password, targets, deadline=deadline, max_jobs=max_jobs)
+    if not result["success"]:
+        return [result] * len(objects)
+    return result["data"]
+
+def run_prefetch(days=PREFETCH_DAYS, max_objects=PREFETCH_MAX_OBJECTS, max_requests=PREFETCH_MAX_REQUESTS,
+                 max_atlas_jobs=PREFETCH_MAX_ATLAS_JOBS, max_workers=PREFETCH_WORKERS,
+                 atlas_workers=PREFETCH_ATLAS_WORKERS, brokers=None, api_token=None,
+                 atlas_username=None, atlas_password=None, time_budget=PREFETCH_TIME_BUDGET,
+                 tns_file=TNS_CACHE_FILE, atlas_packed=True):
+    """Run one prefetch pass over recent TNS objects.
+
+    Requests whose results are already cached are skipped and do not count
+    against ``max_requests``; ATLAS jobs are limited to ``max_atlas_jobs`` and
+    skipped without credentials. With ``atlas_packed`` every object is queued
+    in multi-target jobs (each counting once against the limit) instead of
+    one job per object. Newest objects are served first, so when a
+    budget runs out it is the older objects that stay cold.
+    """
+    try:
+        deadline = Deadline(time_budget)
+        if not os.path.exists(tns_file):
+            return {"success": False, "error": f"No TNS cache at {tns_file}"}
+        objects = select_recent_objects(load_catalog_records(tns_file), days, max_objects)
+        print(f"Prefetch: {len(objects)} TNS objects updated in the last {days} days", file=sys.stderr)
+
+        pending = []
+        skipped = 0
+        for obj in objects:
+            for args in build_requests(obj, brokers or PREFETCH_BROKERS, api_token):
+                if is_result_cached(args):
+                    skipped += 1
+                else:
+                    pending.append(args)
+        over_quota = max(0, len(pending) - max_requests)
+        pending = pending[:max_requests]
+        print(f"Prefetch: {len(pending)} requests to run, {skipped} already cached, {over_quota} over quota",
+              file=sys.stderr)
+
+        lightcurves = {}
+
+        def fetch(args):
+            try:
+                # Features are extracted for the whole pass at once below, not per request
+                result = handle_request(dict(args, deadline=deadline.timeout(60), allow_stale=False,
+                                             update_features=False))
+            except DeadlineExceeded:
+                return "deadline"
+            if args.get("mode") == "lightcurve" and result.get("success") and not result.get("partial"):
+                lightcurves[args["ztf_id"]] = (result.get("data") or {}).get("detections", [])
+            return "ok" if result.get("success") and not result.get("partial") else "failed"
+
+        counts = {"ok": 0, "failed": 0, "deadline": 0}
+        with ThreadPoolExecutor(max_workers=max(1, int(max_workers))) as executor:
+            for outcome in executor.map(fetch, pending):
+                counts[outcome] += 1
+        if lightcurves:
+            try:
+                update_features(lightcurves)
+            except Exception as e:
+                print(f"Prefetch: Feature update failed: {str(e)}", file=sys.stderr)
+
+        atlas_counts = {"ok": 0, "failed": 0, "deadline": 0}
+        if atlas_username and atlas_password and max_atlas_jobs > 0 and atlas_packed:
+            try:
+                atlas_results = prefetch_atlas_batch(objects, atlas_username, atlas_password, deadline, max_atlas_jobs)
+            except DeadlineExceeded:
+                atlas_results = []
+                atlas_counts["deadline"] = len(objects)
+            for result in atlas_results:
+                atlas_counts["ok" if result.get("success") else "failed"] += 1
+        elif atlas_username and atlas_password and max_atlas_jobs > 0:
+            def fetch_atlas(obj):
+                if deadline.expired():
+                    return "deadline"
+                result = prefetch_atlas(obj, atlas_username, atlas_password, deadline)
+                return "ok" if result.get("success") else "failed"
+
+            with ThreadPoolExecutor(max_workers=max(1, int(atlas_workers))) as executor:
+                for outcome in executor.map(fetch_atlas, objects[:max_atlas_jobs]):
+                    atlas_counts[outcome] += 1
+        else:
+            print("Prefetch: No ATLAS credentials or quota, skipping ATLAS photometry", file=sys.stderr)
+
+        summary = {
+            "objects": len(objects),
+            "requests": counts,
+            "already_cached": skipped,
+            "over_quota": over_quota,
+            "atlas": atlas_counts,
+            "finished_at": datetime.now().isoformat()
+        }
+        print(f"Prefetch: Done {json.dumps(summary)}", file=sys.stderr)
+        return {"success": True, "data": summary}
+    except Exception as e:
+        print(f"Prefetch: Error: {str(e)}", file=sys.stderr)
+        return {"success": False, "error": str(e)}
+
+def run_scheduler(interval_hours=SCHEDULE_INTERVAL, tns_file=TNS_CACHE_FILE, **options):
+    """Run prefetch passes forever: whenever a new TNS download lands, and at least every ``interval_hours``"""
+    last_mtime = None
+    last_run = 0
+    while True:
+        mtime = os.path.getmtime(tns_file) if os.path.exists(tns_file) else None
+        if mtime is not None and (mtime != last_mtime or time.time() - last_run > interval_hours * 3600):
+            run_prefetch(tns_file=tns_file, **options)
+            last_mtime = mtime
+            last_run = time.time()
+        time.sleep(SCHEDULE_POLL)
+
+if __name__ == "__main__":
+    args = json.loads(sys.argv[1]) if len(sys.argv) > 1 else {}
+    options = {
+        "days": args.get('days', PREFETCH_DAYS),
+        "max_objects": args.get('max_objects', PREFETCH_MAX_OBJECTS),
+        "max_requests": args.get('max_requests', PREFETCH_MAX_REQUESTS),
+        "max_atlas_jobs": args.get('max_atlas_jobs', PREFETCH_MAX_ATLAS_JOBS),
+        "max_workers": args.get('max_workers', PREFETCH_WORKERS),
+        "atlas_workers": args.get('atlas_workers', PREFETCH_ATLAS_WORKERS),
+        "brokers": args.get('brokers'),
+        "api_token": args.get('api_token') or os.environ.get('LASAIR_API_TOKEN'),
+        "atlas_username": args.get('atlas_username') or os.environ.get('ATLAS_USERNAME'),
+        "atlas_password": args.get('atlas_password') or os.environ.get('ATLAS_PASSWORD'),
+        "time_budget": args.get('time_budget', PREFETCH_TIME_BUDGET),
+        "atlas_packed": args.get('atlas_packed', True),
+    }
+    if args.get('action') == 'schedule':
+        run_scheduler(args.get('interval', SCHEDULE_INTERVAL), **options)
+    else:
+        print(json.dumps(run_prefetch(**options)))
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+On-Demand Profiling for the CLI entry points
+Wraps a single broker_client.py / atlas_api.py invocation in cProfile and
+tracemalloc when asked to, and writes the results to PROFILE_DIR:
+
+    <stamp>_<pid>_<name>.prof   cProfile stats (pstats, snakeviz, ...)
+    <stamp>_<pid>_<name>.json   request parameters, wall time, slowest functions,
+                                tracemalloc peak and top allocation sites
+
+Enabled per request with a "profile": true field in the JSON args, or for
+every request with METABROKER_PROFILE=1. When off, nothing is imported or
+started, so normal requests pay only an environment lookup.
+"""
+import os
+import sys
+import json
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_TOP_FUNCTIONS = 30  # Functions listed in the JSON summary, by cumulative time
+PROFILE_TOP_ALLOCATIONS = 20  # Allocation sites listed, by size
+TRACEMALLOC_FRAMES = 10  # Stack depth kept per allocation
+SECRET_ARGS = {"api_token", "token", "password", "username", "atlas_password", "atlas_username"}
+
+def profiling_requested(args):
+    """True if this invocation should be profiled (``profile`` arg or METABROKER_PROFILE)"""
+    if isinstance(args, dict) and args.get("profile"):
+        return True
+    return os.environ.get("METABROKER_PROFILE", "").lower() in ("1", "true", "yes")
+
+def redact_args(args):
+    """Request parameters with credentials removed, for the profile report"""
+    return {key: ("***" if key in SECRET_ARGS and value else value) for key, value in (args or {}).items()}
+
+def top_functions(profiler, limit=PROFILE_TOP_FUNCTIONS):
+    """The slowest functions of a profile run, by cumulative time"""
+    import pstats
+
+    stats = pstats.Stats(profiler)
+    rows = []
+    for (filename, line, function), (_, calls, total, cumulative, _) in stats.stats.items():
+        rows.append({
+            "function": f"{os.path.basename(filename)}:{line}({function})",
+            "calls": calls,
+            "total_time": round(total, 6),
+            "cumulative_time": round(cumulative, 6)
+        })
+    rows.sort(key=lambda row: row["cumulative_time"], reverse=True)
+    return rows[:limit]
+
+def top_allocations(snapshot, limit=PROFILE_TOP_ALLOCATIONS):
+    """The largest live allocation sites of a tracemalloc snapshot"""
+    rows = []
+    for stat in snapshot.statistics("traceback")[:limit]:
+        frame = stat.traceback[0]
+        rows.append({
+            "location": f"{frame.filename}:{frame.lineno}",
+            "size_kb": round(stat.size / 1024, 1),
+            "count": stat.count,
+            "traceback": [f"{f.filename}:{f.lineno}" for f in stat.traceback]
+        })
+    return rows
+
+@contextmanager
+def profiled(name, args):
+    """Profile the enclosed block if requested; a no-op otherwise.
+
+    Yields a dict the caller may fill with extra fields for the report
+    (e.g. whether the request succeeded). Report failures are logged and
+    never affect the request itself.
+    """
+    if not profiling_requested(args):
+        yield {}
+        return
+
+    import cProfile
+    import tracemalloc
+
+    report = {"started_at": datetime.now().isoformat()}
+    tracemalloc.start(TRACEMALLOC_FRAMES)
+    profiler = cProfile.Profile()
+    started = time.perf_counter()
+    profiler.enable()
+    try:
+        yield report
+    finally:
+        profiler.disable()
+        wall_time = time.perf_counter() - started
+        try:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            base = os.path.join(PROFILE_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.getpid()}_{name}")
+            profiler.dump_stats(base + ".prof")
+            report.update({
+                "name": name,
+                "args": redact_args(args),
+                "wall_time": round(wall_time, 4),
+                "memory": {"current_kb": round(current / 1024, 1), "peak_kb": round(peak / 1024, 1)},
+                "top_functions": top_functions(profiler),
+                "top_allocations": top_allocations(snapshot),
+                "stats_file": base + ".prof"
+            })
+            with open(base + ".json", 'w') as f:
+                json.dump(report, f, indent=2, default=str)
+            print(f"Profiling: Wrote {base}.json ({wall_time:.2f}s, peak {peak / 1024 / 1024:.1f} MB)", file=sys.stderr)
+        except Exception as e:
+            print(f"Profiling: Could not write profile: {str(e)}", file=sys.stderr)
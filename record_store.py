@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+"""
+Transient Record Store
+One consolidated record per transient in a single SQLite file: the TNS row
+plus each broker's response, the catalogue crossmatch, the ZTF light curve
+and an ATLAS photometry summary, each with its fetch time.
+
+Records are indexed by TNS name, ZTF ID and declination, so a transient page
+is served from one indexed read. Pieces older than their max age are
+returned as-is, flagged stale, and refreshed by a detached background
+process (the web request itself never waits for upstreams). TNS rows are
+synced on the TNS refresh path (tns_ingest.refresh_derived), not by reads.
+"""
+import os
+import sys
+import json
+import math
+import time
+import sqlite3
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from alias_index import (
+    TNS_CACHE_FILE, ZTF_NAME_PATTERN, normalize_name, parse_coordinate,
+    resolve_object, split_internal_names
+)
+from broker_client import get_request_kind, handle_request
+from prefetch import PREFETCH_BROKERS, build_requests
+from tns_catalog import load_catalog_records
+
+RECORD_DB_FILE = os.environ.get("RECORD_DB", "transients.db")
+POSITION_MATCH_RADIUS = 2.0  # Arcsec
+REFRESH_LOCK_TIMEOUT = 600  # Seconds before a refresh that never reported back may be retried
+# Hours each piece stays fresh (broker results follow the result cache durations)
+PIECE_MAX_AGE = {
+    "alerce": 6, "antares": 6, "fink": 6, "lasair": 6, "lightcurve": 6, "crossmatch": 24 * 30, "atlas": 24 * 7
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transients (
+    object_key TEXT PRIMARY KEY,
+    tns_name TEXT,
+    name_key TEXT,
+    ztf_id TEXT,
+    ra REAL,
+    dec REAL,
+    discoverydate TEXT,
+    tns_row TEXT
+);
+CREATE INDEX IF NOT EXISTS transients_name_key ON transients (name_key);
+CREATE INDEX IF NOT EXISTS transients_ztf_id ON transients (ztf_id);
+CREATE INDEX IF NOT EXISTS transients_dec ON transients (dec);
+CREATE TABLE IF NOT EXISTS pieces (
+    object_key TEXT NOT NULL,
+    piece TEXT NOT NULL,
+    data TEXT,
+    fetched_at REAL,
+    refresh_started_at REAL,
+    PRIMARY KEY (object_key, piece)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+def open_record_store(db_file=RECORD_DB_FILE):
+    """Connection to the record store (WAL mode, so readers never wait on a refresh)"""
+    connection = sqlite3.connect(db_file, timeout=30)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.executescript(SCHEMA)
+    return connection
+
+def sync_tns_rows(connection, tns_file=TNS_CACHE_FILE, force=False, records=None):
+    """Upsert every TNS row into the store when the TNS cache changed since the last sync.
+
+    Runs on the TNS refresh path (tns_ingest.refresh_derived, or the CLI
+    ``sync`` action), never inside a read. ``records`` may be passed by a
+    caller that already holds the catalog.
+    """
+    if not os.path.exists(tns_file):
+        return 0
+    source_mtime = os.path.getmtime(tns_file)
+    row = connection.execute("SELECT value FROM meta WHERE key = 'tns_mtime'").fetchone()
+    if not force and row is not None and float(row[0]) >= source_mtime:
+        return 0
+    rows = []
+    for record in records if records is not None else load_catalog_records(tns_file):
+        name = record.get("name")
+        if not name:
+            continue
+        prefix = record.get("name_prefix") or ""
+        tns_name = f"{prefix} {name}".strip() if prefix else name
+        ztf_id = next((alias for alias in split_internal_names(record.get("internal_names"))
+                       if ZTF_NAME_PATTERN.match(alias)), None)
+        rows.append((
+            tns_name, tns_name, normalize_name(name), ztf_id,
+            parse_coordinate(record.get("ra"), True),
+            parse_coordinate(record.get("declination", record.get("dec")), False),
+            record.get("discoverydate"), json.dumps(record)
+        ))
+    connection.executemany(
+        "INSERT INTO transients VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT(object_key) DO UPDATE SET tns_name = excluded.tns_name, name_key = excluded.name_key, "
+        "ztf_id = excluded.ztf_id, ra = excluded.ra, dec = excluded.dec, "
+        "discoverydate = excluded.discoverydate, tns_row = excluded.tns_row",
+        rows
+    )
+    connection.execute("INSERT OR REPLACE INTO meta VALUES ('tns_mtime', ?)", (str(source_mtime),))
+    connection.commit()
+    print(f"Record store: Synced {len(rows)} TNS rows", file=sys.stderr)
+    return len(rows)
+
+def sync_record_store(tns_file=TNS_CACHE_FILE, records=None, force=False, db_file=RECORD_DB_FILE):
+    """Open the store and sync its TNS rows (see sync_tns_rows)"""
+    connection = open_record_store(db_file)
+    try:
+        return sync_tns_rows(connection, tns_file, force, records)
+    finally:
+        connection.close()
+
+def find_object_key(connection, name=None, ztf_id=None, ra=None, dec=None):
+    """Key of the stored transient for a name (any alias), ZTF ID or position, or None"""
+    for candidate in (ztf_id, name):
+        if candidate and ZTF_NAME_PATTERN.match(str(candidate).strip()):
+            row = connection.execute("SELECT object_key FROM transients WHERE ztf_id = ?",
+                                     (str(candidate).strip(),)).fetchone()
+            if row:
+                return row[0]
+    if name:
+        row = connection.execute("SELECT object_key FROM transients WHERE name_key = ?",
+                                 (normalize_name(name),)).fetchone()
+        if row:
+            return row[0]
+        alias = resolve_object(name)
+        if alias:
+            return alias["tns_name"]
+    if ra is not None and dec is not None and ra != '' and dec != '':
+        ra, dec = float(ra), float(dec)
+        radius_deg = POSITION_MATCH_RADIUS / 3600.0
+        best = None
+        for object_key, row_ra, row_dec in connection.execute(
+                "SELECT object_key, ra, dec FROM transients WHERE dec BETWEEN ? AND ?",
+                (dec - radius_deg, dec + radius_deg)):
+            delta_ra = ((row_ra - ra + 180.0) % 360.0 - 180.0) * math.cos(math.radians(dec))
+            separation = math.hypot(delta_ra, row_dec - dec) * 3600
+            if separation <= POSITION_MATCH_RADIUS and (best is None or separation < best[0]):
+                best = (separation, object_key)
+        if best:
+            return best[1]
+    return None
+
+def ensure_object(connection, name=None, ztf_id=None, ra=None, dec=None):
+    """Key of the stored transient, adding a bare record for objects not stored yet.
+
+    That covers objects TNS does not list and TNS objects resolved through
+    the alias index before the next sync; the sync fills in their TNS row.
+    """
+    object_key = find_object_key(connection, name, ztf_id, ra, dec)
+    if object_key and connection.execute("SELECT 1 FROM transients WHERE object_key = ?", (object_key,)).fetchone():
+        return object_key
+    object_key = object_key or ztf_id or name
+    if not object_key:
+        return None
+    connection.execute(
+        "INSERT OR IGNORE INTO transients (object_key, name_key, ztf_id, ra, dec) VALUES (?, ?, ?, ?, ?)",
+        (object_key, normalize_name(name) if name else None,
+         ztf_id if ztf_id and ZTF_NAME_PATTERN.match(ztf_id) else None,
+         float(ra) if ra not in (None, '') else None, float(dec) if dec not in (None, '') else None)
+    )
+    connection.commit()
+    return object_key
+
+def read_record(connection, object_key):
+    """The full record for one transient, read with a single indexed query"""
+    rows = connection.execute(
+        "SELECT t.object_key, t.tns_name, t.ztf_id, t.ra, t.dec, t.discoverydate, t.tns_row, "
+        "p.piece, p.data, p.fetched_at, p.refresh_started_at "
+        "FROM transients t LEFT JOIN pieces p ON p.object_key = t.object_key WHERE t.object_key = ?",
+        (object_key,)
+    ).fetchall()
+    if not rows:
+        return None
+    first = rows[0]
+    record = {
+        "object_key": first[0], "tns_name": first[1], "ztf_id": first[2], "ra": first[3], "dec": first[4],
+        "discoverydate": first[5], "tns": json.loads(first[6]) if first[6] else None, "pieces": {}
+    }
+    now = time.time()
+    for row in rows:
+        piece, data, fetched_at, refresh_started_at = row[7:]
+        if piece is None:
+            continue
+        record["pieces"][piece] = {
+            "data": json.loads(data) if data else None,
+            "fetched_at": datetime.fromtimestamp(fetched_at).isoformat() if fetched_at else None,
+            "stale": fetched_at is None or now - fetched_at > PIECE_MAX_AGE.get(piece, 6) * 3600,
+            "refreshing": bool(refresh_started_at and now - refresh_started_at < REFRESH_LOCK_TIMEOUT)
+        }
+    return record
+
+def applicable_pieces(record, pieces, has_atlas_credentials):
+    """Pieces that can be fetched for this record (e.g. Fink needs a ZTF ID, ATLAS a position)"""
+    needs_ztf = {"fink", "lightcurve"}
+    needs_position = {"crossmatch", "atlas"}
+    return [piece for piece in pieces
+            if (piece not in needs_ztf or record["ztf_id"])
+            and (piece not in needs_position or record["ra"] is not None)
+            and (piece != "atlas" or has_atlas_credentials)]
+
+def stale_pieces(record, pieces):
+    """Pieces that are missing or past their max age and not already being refreshed"""
+    stale = []
+    for piece in pieces:
+        stored = record["pieces"].get(piece)
+        if stored is None or (stored["stale"] and not stored["refreshing"]):
+            stale.append(piece)
+    return stale
+
+def claim_refresh(connection, object_key, pieces):
+    """Mark pieces as being refreshed; returns the pieces this caller now owns"""
+    now = time.time()
+    claimed = []
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        for piece in pieces:
+            row = connection.execute(
+                "SELECT refresh_started_at FROM pieces WHERE object_key = ? AND piece = ?", (object_key, piece)
+            ).fetchone()
+            if row and row[0] and now - row[0] < REFRESH_LOCK_TIMEOUT:
+                continue
+            connection.execute(
+                "INSERT INTO pieces (object_key, piece, refresh_started_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(object_key, piece) DO UPDATE SET refresh_started_at = excluded.refresh_started_at",
+                (object_key, piece, now)
+            )
+            claimed.append(piece)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    return claimed
+
+def summarize_atlas(result):
+    """Compact ATLAS summary: point counts, MJD range and peak per filter"""
+    points = result.get("data") or []
+    summary = {"points": len(points), "filters": {}}
+    for point in points:
+        stats = summary["filters"].setdefault(point.get("filter"), {"points": 0, "peak_mag": None,
+                                                                    "first_mjd": None, "last_mjd": None})
+        stats["points"] += 1
+        mag, mjd = point.get("mag"), point.get("mjd")
+        if mag is not None and (stats["peak_mag"] is None or mag < stats["peak_mag"]):
+            stats["peak_mag"] = mag
+        if mjd is not None:
+            stats["first_mjd"] = mjd if stats["first_mjd"] is None else min(stats["first_mjd"], mjd)
+            stats["last_mjd"] = mjd if stats["last_mjd"] is None else max(stats["last_mjd"], mjd)
+    return summary
+
+def fetch_piece(record, piece, api_token=None, atlas_username=None, atlas_password=None):
+    """Fetch one piece with the same request the web app makes; returns the data or None on failure"""
+    if piece == "atlas":
+        if not (atlas_username and atlas_password) or record["ra"] is None:
+            return None
+        from atlas_api import get_atlas_photometry
+        result = get_atlas_photometry(atlas_username, atlas_password, record["ra"], record["dec"],
+                                      record["discoverydate"], allow_stale=False)
+        return summarize_atlas(result) if result.get("success") else None
+    obj = {"name": record["tns_name"] or record["object_key"], "ztf_id": record["ztf_id"],
+           "ra": record["ra"], "dec": record["dec"], "discoverydate": record["discoverydate"]}
+    for args in build_requests(obj, PREFETCH_BROKERS, api_token):
+        if get_request_kind(args) == piece:
+            # Stale data would be stored as if it were fetched now
+            result = handle_request(dict(args, allow_stale=False))
+            return result.get("data") if result.get("success") else None
+    return None
+
+def refresh_pieces(object_key, pieces, api_token=None, atlas_username=None, atlas_password=None,
+                   db_file=RECORD_DB_FILE, max_workers=4):
+    """Fetch pieces concurrently and store the successful ones.
+
+    Failed pieces keep their previous data and their refresh claim, so they
+    are retried only after REFRESH_LOCK_TIMEOUT instead of on every read.
+    """
+    connection = open_record_store(db_file)
+    try:
+        record = read_record(connection, object_key)
+        if record is None:
+            return {}
+        with ThreadPoolExecutor(max_workers=max(1, int(max_workers))) as executor:
+            fetched = dict(zip(pieces, executor.map(
+                lambda piece: fetch_piece(record, piece, api_token, atlas_username, atlas_password), pieces
+            )))
+        now = time.time()
+        for piece, data in fetched.items():
+            if data is not None:
+                connection.execute(
+                    "INSERT INTO pieces VALUES (?, ?, ?, ?, NULL) ON CONFLICT(object_key, piece) DO UPDATE SET "
+                    "data = excluded.data, fetched_at = excluded.fetched_at, refresh_started_at = NULL",
+                    (object_key, piece, json.dumps(data), now)
+                )
+        connection.commit()
+        print(f"Record store: Refreshed {sum(d is not None for d in fetched.values())} of {len(pieces)} pieces "
+              f"for {object_key}", file=sys.stderr)
+        return fetched
+    finally:
+        connection.close()
+
+def spawn_background_refresh(object_key, pieces, api_token=None, atlas_username=None, atlas_password=None):
+    """Refresh pieces in a detached process so the caller can return immediately.
+
+    Credentials go through the environment rather than the command line.
+    """
+    env = dict(os.environ)
+    for variable, value in (("LASAIR_API_TOKEN", api_token), ("ATLAS_USERNAME", atlas_username),
+                            ("ATLAS_PASSWORD", atlas_password)):
+        if value:
+            env[variable] = value
+    subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__),
+         json.dumps({"action": "refresh", "object_key": object_key, "pieces": pieces})],
+        env=env, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=True
+    )
+
+def get_transient_record(name=None, ztf_id=None, ra=None, dec=None, pieces=None, refresh="background",
+                         api_token=None, atlas_username=None, atlas_password=None, db_file=RECORD_DB_FILE):
+    """Return the consolidated record for a transient.
+
+    ``refresh`` decides what happens to missing or stale pieces:
+    "background" returns what is stored and refreshes in a detached process,
+    "sync" fetches them before returning, "none" only reads.
+    """
+    try:
+        pieces = pieces or list(PIECE_MAX_AGE)
+        connection = open_record_store(db_file)
+        try:
+            object_key = ensure_object(connection, name, ztf_id, ra, dec)
+            if object_key is None:
+                return {"success": False, "error": "A name, ZTF ID or position is required"}
+            record = read_record(connection, object_key)
+            stale = stale_pieces(record, applicable_pieces(record, pieces, atlas_username and atlas_password))
+            if stale and refresh in ("background", "sync"):
+                stale = claim_refresh(connection, object_key, stale)
+        finally:
+            connection.close()
+
+        if stale and refresh == "sync":
+            refresh_pieces(object_key, stale, api_token, atlas_username, atlas_password, db_file)
+            connection = open_record_store(db_file)
+            try:
+                record = read_record(connection, object_key)
+            finally:
+                connection.close()
+        elif stale and refresh == "background":
+            spawn_background_refresh(object_key, stale, api_token, atlas_username, atlas_password)
+            for piece in stale:
+                record["pieces"].setdefault(piece, {"data": None, "fetched_at": None, "stale": True})
+                record["pieces"][piece]["refreshing"] = True
+        return {"success": True, "data": record}
+    except Exception as e:
+        print(f"Record store: Error: {str(e)}", file=sys.stderr)
+        return {"success": False, "error": str(e)}
+
+if __name__ == "__main__":
+    # Command line interface:
+    #   '{"action": "get", "name": "2024abc"}'   (also ztf_id / ra+dec, "refresh": "sync")
+    #   '{"action": "sync"}'                     load the current TNS cache
+    if len(sys.argv) != 2:
+        print("Usage: python record_store.py '<json_args>'")
+        sys.exit(1)
+
+    try:
+        args = json.loads(sys.argv[1])
+        action = args.get('action', 'get')
+        api_token = args.get('api_token') or os.environ.get('LASAIR_API_TOKEN')
+        atlas_username = args.get('atlas_username') or os.environ.get('ATLAS_USERNAME')
+        atlas_password = args.get('atlas_password') or os.environ.get('ATLAS_PASSWORD')
+        if action == 'get':
+            result = get_transient_record(
+                args.get('name'), args.get('ztf_id'), args.get('ra'), args.get('dec'),
+                pieces=args.get('pieces'), refresh=args.get('refresh', 'background'),
+                api_token=api_token, atlas_username=atlas_username, atlas_password=atlas_password
+            )
+        elif action == 'refresh':
+            fetched = refresh_pieces(args['object_key'], args.get('pieces') or list(PIECE_MAX_AGE),
+                                     api_token, atlas_username, atlas_password)
+            result = {"success": True, "data": {piece: data is not None for piece, data in fetched.items()}}
+        elif action == 'sync':
+            result = {"success": True, "data": {"synced": sync_record_store(force=True)}}
+        else:
+            result = {"success": False, "error": f"Unknown action: {action}"}
+        print(json.dumps(result))
+
+    except Exception as e:
+        error_result = {"success": False, "error": f"Script error: {str(e)}"}
+        print(json.dumps(error_result))
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+"""
+Broker Resilience Layer
+Per-broker circuit breakers and per-host token-bucket rate limiters.
+
+State lives in small JSON files guarded by fcntl locks, so it is shared by
+every worker process (the Node server spawns one Python process per request,
+so in-memory state alone would never see more than one call).
+"""
+import os
+import sys
+import json
+import time
+import fcntl
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+STATE_DIR = os.environ.get("RESILIENCE_STATE_DIR", "resilience_state")
+
+BREAKER_FAILURE_THRESHOLD = 5  # Consecutive failures before a breaker opens
+BREAKER_RECOVERY_TIME = 30  # Seconds an open breaker waits before a half-open probe
+BREAKER_PROBE_TIMEOUT = 60  # Seconds after which a stuck half-open probe is abandoned
+RATE_LIMIT_MAX_WAIT = 5  # Seconds to wait for a token before failing fast
+
+# Map upstream hosts to the broker whose breaker they trip
+HOST_BROKERS = {
+    "api.alerce.online": "alerce",
+    "catshtm.alerce.online": "alerce",
+    "api.antares.noirlab.edu": "antares",
+    "api.fink-portal.org": "fink",
+    "lasair-ztf.lsst.ac.uk": "lasair",
+    "fallingstar-data.com": "atlas",
+}
+
+# (requests per second, burst size) per host
+RATE_LIMITS = {
+    "api.alerce.online": (10, 20),
+    "catshtm.alerce.online": (5, 10),
+    "api.antares.noirlab.edu": (5, 10),
+    "api.fink-portal.org": (5, 10),
+    "lasair-ztf.lsst.ac.uk": (2, 5),
+    "fallingstar-data.com": (1, 5),
+}
+DEFAULT_RATE_LIMIT = (5, 10)
+
+class BrokerUnavailableError(requests.exceptions.ConnectionError):
+    """A call was refused locally without contacting the upstream."""
+
+class CircuitOpenError(BrokerUnavailableError):
+    """The broker's circuit breaker is open."""
+
+class RateLimitExceeded(BrokerUnavailableError):
+    """No rate-limit token became available within the allowed wait."""
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """The request-level time budget ran out."""
+
+class Deadline:
+    """Time budget for one request, shared by all of its sub-calls.
+
+    ``Deadline(None)`` never expires, so callers can thread a deadline through
+    unconditionally and keep their per-call timeouts as caps.
+    """
+
+    def __init__(self, seconds=None):
+        self.expires_at = None if seconds is None else time.time() + float(seconds)
+
+    @classmethod
+    def from_value(cls, value):
+        """Accept a Deadline, a number of seconds, or None"""
+        if isinstance(value, Deadline):
+            return value
+        return cls(value)
+
+    def remaining(self):
+        """Seconds left, or None for an unbounded deadline"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.time())
+
+    def expired(self):
+        return self.expires_at is not None and time.time() >= self.expires_at
+
+    def timeout(self, cap):
+        """Timeout for the next sub-call: ``cap`` or the remaining budget, whichever is smaller.
+
+        Raises DeadlineExceeded when nothing is left.
+        """
+        if self.expires_at is None:
+            return cap
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded("Request deadline exceeded")
+        return min(cap, remaining) if cap is not None else remaining
+
+def run_with_deadline(func, deadline):
+    """Call ``func()`` but give up when ``deadline`` expires.
+
+    For client libraries that take no timeout argument: the call runs on a
+    daemon thread and DeadlineExceeded is raised if it has not finished in
+    time (the thread is abandoned, not killed).
+    """
+    if deadline is None or deadline.expires_at is None:
+        return func()
+    remaining = deadline.timeout(None)
+    outcome = {}
+
+    def run():
+        try:
+            outcome["result"] = func()
+        except BaseException as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(remaining)
+    if thread.is_alive():
+        raise DeadlineExceeded("Request deadline exceeded")
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
+
+def ensure_state_dir():
+    """Ensure the shared state directory exists"""
+    if not os.path.exists(STATE_DIR):
+        os.makedirs(STATE_DIR, exist_ok=True)
+
+@contextmanager
+def locked_state(name):
+    """Read-modify-write a JSON state file under an exclusive lock.
+
+    Yields a dict; whatever it holds when the block exits is written back
+    (only if it changed, so read-only checks do not rewrite the file).
+    """
+    ensure_state_dir()
+    path = os.path.join(STATE_DIR, f"{name}.json")
+    with open(path, 'a+') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            f.seek(0)
+            raw = f.read()
+            try:
+                state = json.loads(raw) if raw else {}
+            except ValueError:
+                state = {}
+            before = json.dumps(state, sort_keys=True)
+            yield state
+            if json.dumps(state, sort_keys=True) != before:
+                f.seek(0)
+                f.truncate()
+                json.dump(state, f)
+                f.flush()
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def breaker_allow(broker):
+    """Decide whether a call to ``broker`` may proceed.
+
+    Closed breakers always allow. An open breaker refuses until
+    BREAKER_RECOVERY_TIME has passed, then lets exactly one half-open probe
+    through; other callers are refused until the probe reports back.
+    """
+    now = time.time()
+    with locked_state(f"breaker_{broker}") as state:
+        status = state.get("state", "closed")
+        if status == "closed":
+            return True
+        if status == "open":
+            if now - state.get("opened_at", 0) < BREAKER_RECOVERY_TIME:
+                return False
+            state["state"] = "half_open"
+            state["probe_started_at"] = now
+            print(f"Resilience: {broker} breaker half-open, probing", file=sys.stderr)
+            return True
+        # half_open: only one probe at a time, unless the probe got stuck
+        if now - state.get("probe_started_at", 0) > BREAKER_PROBE_TIMEOUT:
+            state["probe_started_at"] = now
+            return True
+        return False
+
+def breaker_release(broker):
+    """Give back a half-open probe that never reached the upstream.
+
+    The breaker returns to open with its recovery time already elapsed, so
+    the next caller probes instead of everyone waiting out
+    BREAKER_PROBE_TIMEOUT. A closed or open breaker is left alone.
+    """
+    with locked_state(f"breaker_{broker}") as state:
+        if state.get("state") == "half_open":
+            state["state"] = "open"
+            state["opened_at"] = time.time() - BREAKER_RECOVERY_TIME
+            state.pop("probe_started_at", None)
+
+def breaker_record(broker, success):
+    """Report the outcome of a call to ``broker``'s breaker"""
+    now = time.time()
+    with locked_state(f"breaker_{broker}") as state:
+        status = state.get("state", "closed")
+        if success:
+            if status != "closed":
+                print(f"Resilience: {broker} breaker closed", file=sys.stderr)
+            state.clear()
+            state["state"] = "closed"
+            state["failures"] = 0
+            return
+        failures = state.get("failures", 0) + 1
+        state["failures"] = failures
+        state["last_failure_at"] = now
+        if status == "half_open" or failures >= BREAKER_FAILURE_THRESHOLD:
+            if status != "open":
+                print(f"Resilience: {broker} breaker opened after {failures} failures", file=sys.stderr)
+            state["state"] = "open"
+            state["opened_at"] = now
+
+def acquire_token(host, max_wait=RATE_LIMIT_MAX_WAIT):
+    """Take one token from ``host``'s bucket, waiting up to ``max_wait`` seconds.
+
+    Raises RateLimitExceeded if the bucket cannot refill in time.
+    """
+    rate, burst = RATE_LIMITS.get(host, DEFAULT_RATE_LIMIT)
+    deadline = time.time() + max_wait
+    while True:
+        now = time.time()
+        with locked_state(f"bucket_{host}") as state:
+            tokens = state.get("tokens", burst)
+            updated_at = state.get("updated_at", now)
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            state["updated_at"] = now
+            if tokens >= 1:
+                state["tokens"] = tokens - 1
+                return
+            state["tokens"] = tokens
+            wait = (1 - tokens) / rate
+        if now + wait > deadline:
+            raise RateLimitExceeded(f"Rate limit for {host} exceeded")
+        time.sleep(wait)
+
+def is_unrecorded(exc):
+    """True for errors that say nothing about the upstream's health: local
+    refusals and the caller's own deadline running out. They are not
+    reported to the breaker at all, neither as failure nor as success."""
+    return isinstance(exc, (BrokerUnavailableError, DeadlineExceeded))
+
+def is_transport_error(exc):
+    """True for errors that say the upstream is unhealthy (not e.g. 'not found')"""
+    if isinstance(exc, (BrokerUnavailableError, DeadlineExceeded)):
+        return False
+    if isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                        TimeoutError, ConnectionError)):
+        return True
+    # Client libraries built on other HTTP stacks (e.g. httpx)
+    name = type(exc).__name__
+    return "Timeout" in name or "Connect" in name
+
+def exception_status(exc):
+    """HTTP status code an exception carries (requests' HTTPError, client library API errors), or None"""
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None)
+    if status is None:
+        status = getattr(exc, "status_code", getattr(exc, "code", None))
+    return status if isinstance(status, int) and 100 <= status < 600 else None
+
+def call_outcome(exc):
+    """What an exception from a guarded call says about the upstream: False
+    for a failure (transport error, 5xx, 429), True when the upstream
+    answered (e.g. a 404 from a client library), None when it says nothing
+    (local refusals, the caller's deadline, errors without a status)."""
+    if is_unrecorded(exc):
+        return None
+    if is_transport_error(exc):
+        return False
+    status = exception_status(exc)
+    if status is None:
+        return None
+    return status < 500 and status != 429
+
+def report_exception(broker, exc):
+    """Record a guarded call's exception with the breaker, or hand back its probe if it says nothing"""
+    outcome = call_outcome(exc)
+    if outcome is None:
+        breaker_release(broker)
+    else:
+        breaker_record(broker, outcome)
+
+@contextmanager
+def guard(broker, host=None, max_wait=RATE_LIMIT_MAX_WAIT, deadline=None):
+    """Protect a block that calls ``broker`` (e.g. through a client library).
+
+    Refuses immediately with CircuitOpenError when the breaker is open, takes
+    a rate-limit token for ``host`` (waiting no longer than ``deadline``
+    allows) and records the outcome: success only when the block completes,
+    failure for transport errors and 5xx/429 statuses (see call_outcome).
+    Exceptions that say nothing about the upstream are not recorded; if the
+    call was the half-open probe, the probe is handed back.
+    """
+    if not breaker_allow(broker):
+        raise CircuitOpenError(f"{broker} is temporarily unavailable (circuit open)")
+    if host:
+        try:
+            acquire_token(host, deadline.timeout(max_wait) if deadline is not None else max_wait)
+        except Exception:
+            breaker_release(broker)
+            raise
+    try:
+        yield
+    except Exception as e:
+        report_exception(broker, e)
+        raise
+    breaker_record(broker, True)
+
+def token_wait(timeout, max_wait=RATE_LIMIT_MAX_WAIT):
+    """Longest wait for a rate-limit token within a request's timeout.
+
+    Callers pass ``deadline.timeout(...)`` as the request timeout, so the
+    token wait stays inside the remaining deadline. A (connect, read) pair
+    is capped by its connect part.
+    """
+    if isinstance(timeout, tuple):
+        timeout = timeout[0]
+    if timeout is None:
+        return max_wait
+    return max(0.0, min(max_wait, float(timeout)))
+
+class ResilientAdapter(HTTPAdapter):
+    """HTTP adapter that applies the breaker and rate limiter of the target host.
+
+    HTTP 5xx and 429 responses count as failures, as do timeouts and
+    connection errors; any other response counts as success. Other
+    exceptions are not recorded (see call_outcome).
+    """
+
+    def send(self, request, **kwargs):
+        host = urlparse(request.url).hostname or ""
+        broker = HOST_BROKERS.get(host, host)
+        if not breaker_allow(broker):
+            raise CircuitOpenError(f"{broker} is temporarily unavailable (circuit open)", request=request)
+        try:
+            acquire_token(host, token_wait(kwargs.get("timeout")))
+        except Exception:
+            breaker_release(broker)
+            raise
+        try:
+            response = super().send(request, **kwargs)
+        except Exception as e:
+            report_exception(broker, e)
+            raise
+        breaker_record(broker, response.status_code < 500 and response.status_code != 429)
+        return response
+
+def create_session(pool_connections=8, pool_maxsize=16):
+    """A requests session with ResilientAdapter mounted for http and https"""
+    session = requests.Session()
+    adapter = ResilientAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def get_status():
+    """Current breaker and bucket state for every broker and host"""
+    status = {"breakers": {}, "buckets": {}}
+    for broker in sorted(set(HOST_BROKERS.values())):
+        with locked_state(f"breaker_{broker}") as state:
+            status["breakers"][broker] = dict(state) or {"state": "closed", "failures": 0}
+    for host in sorted(RATE_LIMITS):
+        with locked_state(f"bucket_{host}") as state:
+            status["buckets"][host] = dict(state)
+    return status
+
+if __name__ == "__main__":
+    # Command line interface: '{"action": "status"}' or '{"action": "reset", "broker": "fink"}'
+    args = json.loads(sys.argv[1]) if len(sys.argv) > 1 else {}
+    action = args.get('action', 'status')
+    if action == 'reset':
+        brokers = [args['broker']] if args.get('broker') else sorted(set(HOST_BROKERS.values()))
+        for broker in brokers:
+            breaker_record(broker, True)
+        result = {"success": True, "data": get_status()}
+    elif action == 'status':
+        result = {"success": True, "data": get_status()}
+    else:
+        result = {"success": False, "error": f"Unknown action: {action}"}
+    print(json.dumps(result))
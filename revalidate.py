@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Stale-While-Revalidate Support
+Shared by atlas_api.py and broker_client.py. An expired cache entry that is
+still within its grace window is served at once, marked stale with its age,
+and one detached background process per cache key refetches it. Every
+response carries a ``cache`` field saying whether its data was fresh, stale
+or just fetched.
+
+The background process is this script. It receives its request (including
+credentials) through the environment rather than the command line, runs the
+fetch with the cache bypassed and releases the key's refresh claim.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import fcntl
+import subprocess
+
+from resilience import STATE_DIR
+
+REFRESH_DIR = os.path.join(STATE_DIR, "refresh")
+REFRESH_CLAIM_TIMEOUT = 1800  # Seconds before a refresh that never finished may be retried
+REFRESH_ARGS_VARIABLE = "REVALIDATE_REQUEST"
+REFRESH_LOCK_FILE = ".lock"
+
+def cache_info(status, age_seconds=0, refreshing=False):
+    """The ``cache`` field of a response: fresh, stale or fetched, with the data's age"""
+    info = {"status": status, "age_seconds": int(age_seconds)}
+    if status == "stale":
+        info["refreshing"] = bool(refreshing)
+    return info
+
+def claim_file(key):
+    return os.path.join(REFRESH_DIR, f"{key}.claim")
+
+def read_claim(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read()
+    except OSError:
+        return None
+
+def claim_refresh(key):
+    """Take the refresh claim for a cache key.
+
+    Returns the claim's token, or None if another refresh holds it. Claims
+    are checked and written under one flock, so when an abandoned claim
+    (older than REFRESH_CLAIM_TIMEOUT) is taken over, exactly one caller
+    wins; the new claim replaces the old file atomically.
+    """
+    os.makedirs(REFRESH_DIR, exist_ok=True)
+    path = claim_file(key)
+    token = f"{os.getpid()}-{uuid.uuid4().hex}"
+    try:
+        with open(os.path.join(REFRESH_DIR, REFRESH_LOCK_FILE), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if time.time() - os.path.getmtime(path) < REFRESH_CLAIM_TIMEOUT:
+                    return None
+            except FileNotFoundError:
+                pass
+            tmp_path = f"{path}.{token}.tmp"
+            with open(tmp_path, 'x') as f:
+                f.write(token)
+            os.replace(tmp_path, path)
+            return token
+    except OSError as e:
+        print(f"Revalidate: Could not claim refresh of {key}: {str(e)}", file=sys.stderr)
+        return None
+
+def release_refresh(key, token=None):
+    """Drop the refresh claim for a cache key, unless it has since been taken over by another token"""
+    path = claim_file(key)
+    try:
+        with open(os.path.join(REFRESH_DIR, REFRESH_LOCK_FILE), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if token is None or read_claim(path) == token:
+                os.remove(path)
+    except OSError:
+        pass
+
+def spawn_refresh(kind, key, args):
+    """Start a detached refresh of one cache key unless one is already running.
+
+    Returns True when this call started the refresh or one is in flight.
+    """
+    token = claim_refresh(key)
+    if token is None:
+        return True
+    try:
+        env = dict(os.environ)
+        env[REFRESH_ARGS_VARIABLE] = json.dumps({"kind": kind, "key": key, "claim": token, "args": args})
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__)],
+            env=env, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            start_new_session=True
+        )
+        print(f"Revalidate: Background refresh started for {key}", file=sys.stderr)
+        return True
+    except Exception as e:
+        release_refresh(key, token)
+        print(f"Revalidate: Could not start refresh for {key}: {str(e)}", file=sys.stderr)
+        return False
+
+def run_refresh(request):
+    """Refetch one cache entry (runs in the background process)"""
+    args = request["args"]
+    try:
+        if request["kind"] == "atlas":
+            from atlas_api import get_atlas_photometry
+            result = get_atlas_photometry(args["username"], args["password"], args["ra"], args["dec"],
+                                          args.get("discovery_date"), use_cache=False)
+        else:
+            from broker_client import handle_request
+            result = handle_request(dict(args, use_cache=False))
+        return result
+    finally:
+        release_refresh(request["key"], request.get("claim"))
+
+if __name__ == "__main__":
+    request = json.loads(os.environ.get(REFRESH_ARGS_VARIABLE, "null") or "null")
+    if not request:
+        print(f"Usage: {REFRESH_ARGS_VARIABLE}='<json_request>' python revalidate.py")
+        sys.exit(1)
+    result = run_refresh(request)
+    print(f"Revalidate: Refresh of {request['key']} {'succeeded' if result.get('success') else 'failed'}",
+          file=sys.stderr)
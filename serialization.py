@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Output Encoding for the CLI protocol
+One encoder for everything the Python scripts hand back to Node. numpy
+arrays and scalars are handled natively and NaN becomes null, so result
+builders no longer coerce values by hand.
+
+JSON (the default) goes through orjson when it is installed and the
+standard library otherwise. With ``"output_format": "msgpack"`` the result
+is written as a single MessagePack document instead, with numeric columns
+as typed arrays:
+
+    ext 1  typed array: one struct type code ('d' float64, 'q' int64)
+           followed by the little-endian values; NaN stands for null
+    ext 2  record table: a MessagePack map of column name -> values
+           (typed array or plain list), expanded back into a list of rows
+
+A JSON document always starts with '{', a MessagePack map never does, so a
+reader can tell which one it got (the JSON fallback when msgpack is missing).
+"""
+import sys
+import json
+import math
+import array
+
+try:
+    import orjson
+except ImportError:  # Optional: the standard library encoder is used instead
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # Optional: msgpack output falls back to JSON
+    msgpack = None
+
+OUTPUT_FORMATS = ("json", "msgpack")
+TYPED_ARRAY_EXT = 1
+TABLE_EXT = 2
+TABLE_MIN_ROWS = 16  # Shorter record lists are packed row by row
+INT64_RANGE = (-2 ** 63, 2 ** 63 - 1)
+
+def to_builtin(value, fallback=str):
+    """Recursively convert numpy values to Python ones and NaN to None.
+
+    Anything that is still not a JSON type is passed through ``fallback``
+    (str by default). numpy is only consulted if something already imported it.
+    """
+    if value is None or isinstance(value, (str, bool, int)):
+        return value
+    if isinstance(value, float):
+        return None if math.isnan(value) else value
+    if isinstance(value, dict):
+        return {str(key): to_builtin(item, fallback) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_builtin(item, fallback) for item in value]
+    np = sys.modules.get("numpy")
+    if np is not None and isinstance(value, (np.ndarray, np.generic)):
+        return to_builtin(value.tolist(), fallback)
+    pd = sys.modules.get("pandas")
+    if pd is not None and value is pd.NaT:
+        return None
+    return fallback(value)
+
+def records_from_columns(columns):
+    """List of row dicts from equal-length columns (numpy arrays or lists)"""
+    names = list(columns)
+    values = [to_builtin(columns[name]) for name in names]
+    return [dict(zip(names, row)) for row in zip(*values)]
+
+def _orjson_default(value):
+    converted = to_builtin(value)
+    if converted is value:
+        raise TypeError(f"Cannot serialize {type(value).__name__}")
+    return converted
+
+def dumps_json(obj):
+    """Serialize a result to a JSON string (NaN as null, numpy supported)"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_orjson_default,
+                            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(to_builtin(obj))
+
+def _typed_array(values, type_code):
+    packed = array.array(type_code, values)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return msgpack.ExtType(TYPED_ARRAY_EXT, type_code.encode("ascii") + packed.tobytes())
+
+def _pack_column(values):
+    """Typed array for an all-numeric column, otherwise a plain list"""
+    if values and all(type(v) is int for v in values) and INT64_RANGE[0] <= min(values) and max(values) <= INT64_RANGE[1]:
+        return _typed_array(values, "q")
+    if any(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values) and \
+            all(v is None or (isinstance(v, (int, float)) and not isinstance(v, bool)) for v in values):
+        return _typed_array([math.nan if v is None else v for v in values], "d")
+    return [_pack_value(v) for v in values]
+
+def _pack_value(value):
+    """Prepare a value for msgpack: numpy to typed arrays, record lists to tables"""
+    np = sys.modules.get("numpy")
+    if np is not None and isinstance(value, np.ndarray) and value.ndim == 1 and value.dtype.kind in "iuf":
+        if value.dtype.kind == "f":
+            return msgpack.ExtType(TYPED_ARRAY_EXT, b"d" + value.astype("<f8").tobytes())
+        if value.dtype.kind == "i" or value.max(initial=0) <= INT64_RANGE[1]:
+            return msgpack.ExtType(TYPED_ARRAY_EXT, b"q" + value.astype("<i8").tobytes())
+    if isinstance(value, dict):
+        return {str(key): _pack_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if len(value) >= TABLE_MIN_ROWS and all(isinstance(row, dict) for row in value):
+            keys = list(value[0])
+            if all(list(row) == keys for row in value):
+                table = {str(key): _pack_column([to_builtin(row[key]) for row in value]) for key in keys}
+                return msgpack.ExtType(TABLE_EXT, msgpack.packb(table, use_bin_type=True))
+        return [_pack_value(item) for item in value]
+    return to_builtin(value)
+
+def _unpack_ext(code, data):
+    if code == TYPED_ARRAY_EXT:
+        values = array.array(data[:1].decode("ascii"))
+        values.frombytes(data[1:])
+        if sys.byteorder == "big":
+            values.byteswap()
+        return [None if v != v else v for v in values]
+    if code == TABLE_EXT:
+        return records_from_columns(loads_msgpack(data))
+    return msgpack.ExtType(code, data)
+
+def dumps_msgpack(obj):
+    """Serialize a result to MessagePack bytes with typed numeric columns"""
+    return msgpack.packb(_pack_value(obj), use_bin_type=True)
+
+def loads_msgpack(data):
+    """Decode dumps_msgpack() output back into plain Python objects"""
+    return msgpack.unpackb(data, ext_hook=_unpack_ext, raw=False, strict_map_key=False)
+
+def write_output(result, output_format="json", stream=None):
+    """Write a result to stdout in the requested format (JSON unless msgpack is asked for and available)"""
+    stream = stream or sys.stdout
+    if output_format == "msgpack":
+        if msgpack is not None:
+            stream.flush()
+            stream.buffer.write(dumps_msgpack(result))
+            stream.buffer.flush()
+            return
+        print("Output: msgpack is not installed, writing JSON", file=sys.stderr)
+    elif output_format not in (None, "json"):
+        print(f"Output: Unknown output format {output_format}, writing JSON", file=sys.stderr)
+    stream.write(dumps_json(result) + "\n")
@@ -116,6 +116,27 @@ async function parseCSVFromString(csvContent) {
 let inMemoryCache = null;
 let cacheTimestamp = null;
 
+// Drop the in-memory copy once tns_cache.json has been rewritten on disk
+// (e.g. by tns_ingest.py applying delta files)
+function dropStaleMemoryCache() {
+    if (inMemoryCache && cacheTimestamp && fs.existsSync(CACHE_FILE) &&
+        fs.statSync(CACHE_FILE).mtimeMs > cacheTimestamp) {
+        console.log('TNS cache file changed on disk, dropping memory cache');
+        inMemoryCache = null;
+        cacheTimestamp = null;
+    }
+}
+
+// Rebuild the Python side's indexes derived from tns_cache.json in the background,
+// so broker requests never rebuild them themselves
+function rebuildTnsIndexes() {
+    const { spawn } = require('child_process');
+    const reindex = spawn('./venv/bin/python3', ['tns_ingest.py', JSON.stringify({ action: 'reindex' })],
+        { detached: true, stdio: 'ignore' });
+    reindex.on('error', (error) => console.error('Could not rebuild TNS indexes:', error.message));
+    reindex.unref();
+}
+
 async function downloadTNSData(tnsId = null, tnsUsername = null) {
     try {
         console.log('Attempting to download TNS data in serverless environment...');
@@ -176,7 +197,9 @@ async function downloadTNSData(tnsId = null, tnsUsername = null) {
         // File cache for persistence across restarts
         try {
             fs.writeFileSync(CACHE_FILE, JSON.stringify(cacheData));
+            cacheTimestamp = Date.now(); // Our own write must not invalidate the memory cache
             console.log('Data cached to file for persistence');
+            rebuildTnsIndexes();
         } catch (writeError) {
             console.warn('Could not write cache file (non-critical):', writeError.message);
         }
@@ -245,6 +268,8 @@ app.get('/api/tns-data', async (req, res) => {
     });
     
     try {
+        dropStaleMemoryCache();
+
         // First check in-memory cache
         if (inMemoryCache && inMemoryCache.data) {
             console.log(`Serving data from memory cache. Objects: ${inMemoryCache.total_objects}`);
@@ -295,6 +320,8 @@ app.get('/api/tns-cache-info', async (req, res) => {
     });
     
     try {
+        dropStaleMemoryCache();
+
         // First check in-memory cache
         if (inMemoryCache && inMemoryCache.data) {
             const today = new Date().toISOString().split('T')[0];
@@ -709,4 +736,14 @@ app.listen(port, () => {
         console.log(`\n✅ Ready to serve themetabroker.org`);
         console.log(`\n🔭 ATLAS endpoint available at: /api/atlas/photometry`);
     }
+
+    // Collect ATLAS jobs that were still running when the previous process stopped.
+    // Jobs queued with other users' credentials are picked up by their next request.
+    if (process.env.ATLAS_USERNAME && process.env.ATLAS_PASSWORD) {
+        const { spawn } = require('child_process');
+        const resume = spawn('./venv/bin/python3', ['atlas_jobs.py', JSON.stringify({ action: 'resume' })],
+            { detached: true, stdio: 'ignore' });
+        resume.on('error', (error) => console.error('Could not resume ATLAS jobs:', error.message));
+        resume.unref();
+    }
 }); 
\ No newline at end of file
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# Behaviour tests for the TNS alias index
+import os
+import json
+import threading
+
+import pytest
+
+import alias_index
+
+RECORDS = [
+    {"name_prefix": "SN", "name": "2024abc", "ra": "150.0", "declination": "2.0",
+     "internal_names": "ZTF24aaaaaaa, ATLAS24xyz"},
+    {"name_prefix": "AT", "name": "2024def", "ra": "10:00:00.0", "declination": "-05:30:00",
+     "internal_names": "PS24qq"},
+]
+
+@pytest.fixture
+def tns_file(tmp_path):
+    path = tmp_path / "tns_cache.json"
+    path.write_text(json.dumps({"data": RECORDS}))
+    return str(path)
+
+@pytest.fixture
+def index_file(tmp_path):
+    return str(tmp_path / "alias.db")
+
+def test_names_resolve_through_any_alias(tns_file, index_file):
+    assert alias_index.build_alias_index(tns_file, index_file) == 2
+    connection = alias_index.open_alias_index(tns_file, index_file)
+    try:
+        for name in ("SN 2024abc", "AT2024abc", "2024abc", "ztf24aaaaaaa", "ATLAS24xyz"):
+            assert alias_index.lookup_name(connection, name)["tns_name"] == "SN 2024abc"
+        assert alias_index.lookup_name(connection, "PS24qq")["ztf_id"] is None
+        assert alias_index.lookup_name(connection, "2099zzz") is None
+    finally:
+        connection.close()
+
+def test_position_lookup_parses_sexagesimal(tns_file, index_file):
+    alias_index.build_alias_index(tns_file, index_file)
+    connection = alias_index.open_alias_index(tns_file, index_file)
+    try:
+        match = alias_index.lookup_position(connection, 150.0, 2.0 + 0.5 / 3600)
+        assert match["tns_name"] == "SN 2024abc"
+        assert match["separation_arcsec"] == pytest.approx(0.5, abs=1e-3)
+        assert alias_index.lookup_position(connection, 150.0, 2.01) is None
+        assert alias_index.lookup_position(connection, 150.0, -5.5)["tns_name"] == "AT 2024def"
+    finally:
+        connection.close()
+
+def test_current_index_is_not_rebuilt(tns_file, index_file):
+    assert alias_index.build_alias_index(tns_file, index_file) == 2
+    assert alias_index.build_alias_index(tns_file, index_file) is None
+    assert alias_index.build_alias_index(tns_file, index_file, force=True) == 2
+
+def test_concurrent_builders_build_once(tns_file, index_file):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(alias_index.build_alias_index(tns_file, index_file)))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(results, key=str) == [2, None, None, None]
+    assert not [name for name in os.listdir(os.path.dirname(index_file)) if name.endswith(".tmp")]
+
+def test_lookup_does_not_rebuild_a_stale_index(tns_file, index_file):
+    alias_index.build_alias_index(tns_file, index_file)
+    os.utime(tns_file, (os.path.getmtime(index_file) + 10,) * 2)
+    assert not alias_index.index_is_current(tns_file, index_file)
+    connection = alias_index.open_alias_index(tns_file, index_file)
+    connection.close()
+    assert not alias_index.index_is_current(tns_file, index_file)
+
+def test_no_index_without_tns_data(tmp_path, index_file):
+    assert alias_index.open_alias_index(str(tmp_path / "missing.json"), index_file) is None
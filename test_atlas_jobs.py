@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# Behaviour tests for the ATLAS job journal
+import time
+
+import pytest
+
+import atlas_jobs
+
+TARGET = ("atlas_150.000000_2.000000_60000_60100", "user", 150.0, 2.0, 60000, 60100)
+
+@pytest.fixture
+def db_file(tmp_path):
+    return str(tmp_path / "atlas_jobs.db")
+
+def test_first_caller_queues_and_later_callers_attach(db_file):
+    assert atlas_jobs.claim_job(*TARGET, db_file=db_file, wait=0) is None
+    atlas_jobs.record_queued(TARGET[0], TARGET[1], "https://atlas/task/1", db_file)
+    job = atlas_jobs.claim_job(*TARGET, db_file=db_file, wait=0)
+    assert (job["state"], job["task_url"]) == ("queued", "https://atlas/task/1")
+
+def test_wait_expiry_returns_the_job_still_being_queued(db_file):
+    assert atlas_jobs.claim_job(*TARGET, db_file=db_file, wait=0) is None
+    job = atlas_jobs.claim_job(*TARGET, db_file=db_file, wait=0.1)
+    assert job["state"] == "queuing" and job["task_url"] is None
+    # Still in flight: nobody else gets to queue it
+    assert atlas_jobs.claim_job(*TARGET, db_file=db_file, wait=0) is not None
+
+def test_abandoned_submission_is_claimed_again(db_file, monkeypatch):
+    assert atlas_jobs.claim_job(*TARGET, db_file=db_file, wait=0) is None
+    later = time.time() + atlas_jobs.QUEUING_TIMEOUT + 1
+    monkeypatch.setattr(atlas_jobs.time, "time", lambda: later)
+    assert atlas_jobs.claim_job(*TARGET, db_file=db_file, wait=0) is None
+
+def test_failed_jobs_are_not_reused(db_file):
+    atlas_jobs.claim_job(*TARGET, db_file=db_file, wait=0)
+    atlas_jobs.record_failed(TARGET[0], TARGET[1], "rejected", db_file)
+    assert atlas_jobs.claim_job(*TARGET, db_file=db_file, wait=0) is None
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# Behaviour tests for packing ATLAS targets into shared jobs and splitting the combined result
+import numpy as np
+
+from atlas_api import PACK_MATCH_RADIUS, pack_targets, split_packed_photometry
+
+def target(ra, dec, mjd_min, mjd_max):
+    return {"ra": ra, "dec": dec, "mjd_min": mjd_min, "mjd_max": mjd_max}
+
+def table(ra, dec, mjd):
+    mjd = np.asarray(mjd, dtype=float)
+    return {"mjd": mjd, "mag": np.arange(mjd.size, dtype=float)}, np.asarray(ra, dtype=float), \
+        np.asarray(dec, dtype=float)
+
+def test_pack_targets_closes_groups_on_padding_and_size():
+    targets = [target(0, 0, 100, 200), target(0, 0, 110, 210), target(0, 0, 400, 500), target(0, 0, 120, 220)]
+    groups = pack_targets(targets, max_targets=10, max_padding=30)
+    assert [[t["mjd_min"] for t in group] for group in groups] == [[100, 110, 120], [400]]
+    assert [len(group) for group in pack_targets(targets, max_targets=2, max_padding=1000)] == [2, 2]
+
+def test_rows_go_to_the_nearest_target_inside_its_window():
+    targets = [target(10.0, 5.0, 0, 100), target(20.0, -5.0, 50, 150)]
+    columns, ra, dec = table([10.0, 20.0, 20.0, 10.0, 30.0], [5.0, -5.0, -5.0, 5.0, 0.0], [10, 60, 10, 120, 60])
+    first, second = split_packed_photometry(columns, ra, dec, targets)
+    assert first["mjd"].tolist() == [10.0]
+    assert second["mjd"].tolist() == [60.0]
+
+def test_same_position_targets_each_get_their_own_window():
+    targets = [target(10.0, 5.0, 0, 100), target(10.0, 5.0, 50, 150)]
+    columns, ra, dec = table([10.0] * 4, [5.0] * 4, [10, 60, 90, 140])
+    first, second = split_packed_photometry(columns, ra, dec, targets)
+    assert first["mjd"].tolist() == [10.0, 60.0, 90.0]
+    assert second["mjd"].tolist() == [60.0, 90.0, 140.0]
+    assert second["mag"].tolist() == [1.0, 2.0, 3.0]
+
+def test_close_but_distinct_targets_do_not_share_rows():
+    offset = 0.6 * PACK_MATCH_RADIUS / 3600.0
+    targets = [target(10.0, 5.0, 0, 100), target(10.0, 5.0 + offset, 0, 100)]
+    columns, ra, dec = table([10.0, 10.0], [5.0, 5.0 + offset], [10, 20])
+    first, second = split_packed_photometry(columns, ra, dec, targets)
+    assert (first["mjd"].tolist(), second["mjd"].tolist()) == ([10.0], [20.0])
+
+def test_rows_wrap_across_ra_zero_and_chunks(monkeypatch):
+    import atlas_api
+
+    monkeypatch.setattr(atlas_api, "SPLIT_CHUNK_ROWS", 2)
+    targets = [target(359.99999, 0.0, 0, 100)]
+    columns, ra, dec = table([0.0000001, 359.99999, 359.99999, np.nan, 359.99999], [0.0] * 5, [1, 2, 3, 4, 5])
+    (only,) = split_packed_photometry(columns, ra, dec, targets)
+    assert only["mjd"].tolist() == [1.0, 2.0, 3.0, 5.0]
+
+def test_groups_follow_the_callers_priority_not_the_window_order():
+    # Newest first, as prefetch lists them: the newest window must survive a quota of one job
+    targets = [target(0, 0, 400, 500), target(0, 0, 100, 200), target(0, 0, 405, 505)]
+    groups = pack_targets(targets, max_targets=10, max_padding=30)
+    assert [[t["mjd_min"] for t in group] for group in groups] == [[400, 405], [100]]
+
+def test_job_quota_drops_the_targets_listed_last(monkeypatch):
+    import atlas_api
+
+    queued = []
+    monkeypatch.setattr(atlas_api, "get_atlas_token", lambda username, password, deadline: {"success": True, "token": "t"})
+    monkeypatch.setattr(atlas_api, "claim_jobs", lambda pending, username: (pending, []))
+    monkeypatch.setattr(atlas_api, "record_failed", lambda cache_key, username, error: None)
+
+    def queue_atlas_job(token, ra, dec, mjd_min, mjd_max, deadline, coordinates=None):
+        queued.append(coordinates)
+        return {"success": False, "error": "not queued in this test"}
+
+    monkeypatch.setattr(atlas_api, "queue_atlas_job", queue_atlas_job)
+    targets = [{"ra": 1.0, "dec": 0.0, "discovery_date": "2024-06-01"},
+               {"ra": 2.0, "dec": 0.0, "discovery_date": "2020-06-01"},
+               {"ra": 3.0, "dec": 0.0, "discovery_date": "2022-06-01"}]
+    result = atlas_api.get_atlas_photometry_batch("user", "secret", targets, use_cache=False, max_jobs=2)
+    assert queued == [[(1.0, 0.0)], [(2.0, 0.0)]]
+    assert result["data"][2] == {"success": False, "error": "ATLAS job quota reached"}
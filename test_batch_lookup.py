@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+# Behaviour tests for batch_lookup's position deduplication
+import numpy as np
+
+from batch_lookup import angular_separation_arcsec, cluster_positions, sky_order
+
+def test_separation_of_one_arcsec_in_dec():
+    assert np.isclose(angular_separation_arcsec(10.0, 20.0, 10.0, 20.0 + 1 / 3600.0), 1.0)
+
+def test_separation_wraps_across_ra_zero():
+    assert angular_separation_arcsec(359.9999, 0.0, 0.0001, 0.0) < 1.0
+
+def test_near_identical_positions_share_a_label():
+    ras = [10.0, 10.0 + 0.5 / 3600, 50.0, 10.0 + 0.2 / 3600]
+    decs = [20.0, 20.0, -30.0, 20.0 + 0.1 / 3600]
+    assert cluster_positions(ras, decs).tolist() == [0, 0, 2, 0]
+
+def test_clusters_merge_transitively():
+    # Each neighbour is 0.8 arcsec from the next, the ends 1.6 arcsec apart
+    decs = [0.0, 0.8 / 3600, 1.6 / 3600]
+    assert cluster_positions([0.0, 0.0, 0.0], decs).tolist() == [0, 0, 0]
+
+def test_distinct_positions_keep_their_own_labels():
+    assert cluster_positions([1.0, 2.0, 3.0], [0.0, 0.0, 0.0]).tolist() == [0, 1, 2]
+    assert cluster_positions([], []).tolist() == []
+
+def test_sky_order_groups_by_zone_then_ra():
+    ras = [30.0, 10.0, 20.0]
+    decs = [0.5, 5.5, 0.1]
+    assert sky_order(ras, decs).tolist() == [2, 0, 1]
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# Behaviour tests for broker_client that need no network access
+from resilience import Deadline
+
+import broker_client
+
+def test_fink_deadline_is_reported_as_partial():
+    result = broker_client.query_fink(ztf_id="ZTF21abcdefg", deadline=Deadline(0))
+    assert result == {"success": False, "error": "Request deadline exceeded", "partial": True}
+
+def test_lasair_cone_search_deadline_is_reported_as_partial():
+    result = broker_client.query_lasair_by_coordinates(150.0, 2.0, {}, deadline=Deadline(0))
+    assert result["success"] is False
+    assert result["partial"] is True
+
+def test_lasair_cache_key_depends_on_the_token(monkeypatch):
+    monkeypatch.setattr(broker_client, "resolve_ztf_id", lambda ztf_id, ra, dec: ztf_id)
+    args = {"broker": "lasair", "ztf_id": "ZTF21abcdefg"}
+    tokenless = broker_client.get_result_cache_file(args)
+    with_token = broker_client.get_result_cache_file(dict(args, api_token="secret"))
+    assert tokenless != with_token
+    assert with_token != broker_client.get_result_cache_file(dict(args, api_token="other"))
+    assert "secret" not in with_token
+
+def test_token_is_ignored_for_open_brokers(monkeypatch):
+    monkeypatch.setattr(broker_client, "resolve_ztf_id", lambda ztf_id, ra, dec: ztf_id)
+    args = {"broker": "alerce", "ztf_id": "ZTF21abcdefg"}
+    assert broker_client.get_result_cache_file(args) == broker_client.get_result_cache_file(dict(args, api_token="x"))
+
+def test_cancelled_alerce_query_takes_no_token(monkeypatch):
+    import threading
+
+    calls = []
+    monkeypatch.setattr(broker_client, "guard", lambda *args, **kwargs: calls.append(args))
+    monkeypatch.setattr(broker_client, "get_alerce_client", lambda: None)
+    cancel_event = threading.Event()
+    cancel_event.set()
+    assert broker_client.query_alerce_by_id("ZTF21abcdefg", cancel_event) is None
+    assert broker_client.query_alerce_by_coordinates(150.0, 2.0, cancel_event) is None
+    assert calls == []
+
+def hit(value, delay=0.0):
+    """Query that answers ``value`` after ``delay`` seconds and remembers its cancel event"""
+    import time
+
+    def query(cancel_event):
+        query.started = time.monotonic()
+        query.cancel_event = cancel_event
+        time.sleep(delay)
+        return {"success": True, "data": [value]} if value else None
+    query.started = None
+    return query
+
+def test_hedged_lookup_fast_id_answer_never_starts_the_coordinate_query():
+    id_query, coordinate_query = hit("id"), hit("coordinates")
+    result = broker_client.hedged_lookup(id_query, coordinate_query, hedge_delay=0.5)
+    assert result == {"success": True, "data": ["id"]}
+    assert coordinate_query.started is None
+    assert id_query.cancel_event.is_set()
+
+def test_hedge_fires_after_the_delay_and_the_winner_cancels_the_loser():
+    import time
+
+    id_query, coordinate_query = hit("id", delay=1.0), hit("coordinates")
+    started = time.monotonic()
+    result = broker_client.hedged_lookup(id_query, coordinate_query, hedge_delay=0.2)
+    assert result["data"] == ["coordinates"]
+    assert coordinate_query.started - started >= 0.2
+    assert id_query.cancel_event.is_set()
+
+def test_hedged_lookup_falls_back_when_the_id_finds_nothing():
+    result = broker_client.hedged_lookup(hit(None), hit("coordinates"), hedge_delay=1.0)
+    assert result["data"] == ["coordinates"]
+
+def test_hedged_lookup_returns_a_partial_result_at_the_deadline():
+    id_query = hit(None)
+    result = broker_client.hedged_lookup(id_query, hit("coordinates", delay=2.0), hedge_delay=0.5,
+                                         deadline=Deadline(0.3))
+    assert result["partial"] is True and result["success"] is False
+    assert id_query.cancel_event.is_set()
+
+def fake_cone_search(monkeypatch, tmp_path, loci_per_search=5):
+    """Replace Antares' lazy cone search; returns the list of loci actually pulled from it"""
+    from types import SimpleNamespace
+
+    import resilience
+    import antares_client.search
+
+    monkeypatch.setattr(resilience, "STATE_DIR", str(tmp_path))
+    pulled = []
+
+    def cone_search(center, radius):
+        for i in range(loci_per_search):
+            locus = SimpleNamespace(locus_id=f"ANT{center.ra.deg:.0f}_{i}", ra=center.ra.deg, dec=center.dec.deg,
+                                    properties={"ztf_object_id": f"ZTF{i}", "num_alerts": i, "huge": "x" * 100},
+                                    tags=["nuclear"])
+            pulled.append(locus.locus_id)
+            yield locus
+
+    monkeypatch.setattr(antares_client.search, "cone_search", cone_search)
+    return pulled
+
+def test_antares_cone_stream_stops_at_the_limit_and_whitelists_properties(monkeypatch, tmp_path):
+    from astropy.coordinates import SkyCoord
+    import astropy.units as u
+
+    pulled = fake_cone_search(monkeypatch, tmp_path)
+    loci = list(broker_client.stream_antares_cone_search(SkyCoord(ra=10 * u.deg, dec=0 * u.deg), limit=2,
+                                                          properties=["num_alerts", "missing"], include_tags=False))
+    assert pulled == ["ANT10_0", "ANT10_1"]
+    assert loci[1] == {"locus_id": "ANT10_1", "ra": 10.0, "dec": 0.0, "properties": {"num_alerts": 1}}
+
+def test_antares_batch_returns_one_result_per_position_in_order(monkeypatch, tmp_path):
+    fake_cone_search(monkeypatch, tmp_path, loci_per_search=3)
+    result = broker_client.query_antares_batch([30.0, 10.0, 20.0], [0.0, 0.0, 0.0], limit=1, properties=[],
+                                               max_workers=3)
+    assert result["success"] and "partial" not in result
+    assert [r["data"][0]["locus_id"] for r in result["data"]] == ["ANT30_0", "ANT10_0", "ANT20_0"]
+    assert result["data"][0]["data"][0]["properties"] == {}
+    assert broker_client.query_antares_batch([1.0], [])["success"] is False
+
+def fake_sherlock(monkeypatch, tmp_path, max_chunk=None):
+    """Replace the Lasair query with one that answers from memory; returns the chunks it was asked for"""
+    monkeypatch.setattr(broker_client, "LASAIR_CACHE_DIR", str(tmp_path / "lasair"))
+    asked = []
+
+    def fetch(object_ids, headers, timeout=15):
+        asked.append(list(object_ids))
+        if max_chunk is not None and len(object_ids) > max_chunk:
+            raise RuntimeError("HTTP 500")
+        return [{"objectId": object_id, "classification": "SN"} for object_id in object_ids if object_id != "ZTF21aaaaaab"]
+
+    monkeypatch.setattr(broker_client, "fetch_sherlock_chunk", fetch)
+    return asked
+
+IDS = ["ZTF21aaaaaaa", "ZTF21aaaaaab", "ZTF21aaaaaac", "ZTF21aaaaaad", "ZTF21aaaaaae"]
+
+def test_sherlock_batch_queries_in_chunks_and_keeps_input_order(monkeypatch, tmp_path):
+    asked = fake_sherlock(monkeypatch, tmp_path)
+    result = broker_client.query_lasair_sherlock_batch(IDS, chunk_size=2)
+    assert sorted(len(chunk) for chunk in asked) == [1, 2, 2]
+    assert list(result["data"]) == IDS
+    assert result["data"]["ZTF21aaaaaab"] == []
+    assert result["data"]["ZTF21aaaaaaa"] == [{"objectId": "ZTF21aaaaaaa", "classification": "SN"}]
+
+def test_failing_sherlock_chunks_are_split_until_they_succeed(monkeypatch, tmp_path):
+    asked = fake_sherlock(monkeypatch, tmp_path, max_chunk=1)
+    result = broker_client.query_lasair_sherlock_batch(IDS[:4], chunk_size=4)
+    assert [len(chunk) for chunk in asked][0] == 4
+    assert sorted(len(chunk) for chunk in asked) == [1, 1, 1, 1, 2, 2, 4]
+    assert result["failed"] == [] and list(result["data"]) == IDS[:4]
+
+def test_sherlock_cache_hits_are_not_queried_again(monkeypatch, tmp_path):
+    asked = fake_sherlock(monkeypatch, tmp_path)
+    broker_client.query_lasair_sherlock_batch(IDS[:2])
+    asked.clear()
+    result = broker_client.query_lasair_sherlock_batch(IDS[:3])
+    assert asked == [["ZTF21aaaaaac"]]
+    assert result["data"]["ZTF21aaaaaab"] == []
+
+def test_sherlock_batch_rejects_ids_that_are_not_ztf_ids(monkeypatch, tmp_path):
+    asked = fake_sherlock(monkeypatch, tmp_path)
+    result = broker_client.query_lasair_sherlock_batch(["ZTF21aaaaaaa", "x' OR 1=1 --", "ZTF21AAA", None])
+    assert asked == [["ZTF21aaaaaaa"]]
+    assert result["invalid"] == ["x' OR 1=1 --", "ZTF21AAA", None]
+    assert broker_client.query_lasair_sherlock_batch(["1; DROP TABLE objects"])["success"] is False
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# Behaviour tests for the hive-partitioned bulk photometry export
+import os
+
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import pytest
+
+import bulk_export
+
+OBJECTS = [
+    {"name": "2024abc", "ztf_id": "ZTF24aaabcde", "ra": 10.0, "dec": -5.0, "discoverydate": "2024-01-01",
+     "tns": {"name": "2024abc", "type": "SN Ia", "redshift": 0.05}},
+    {"name": None, "ztf_id": "ZTF24aaaxxxx", "ra": None, "dec": None, "discoverydate": None, "tns": {}},
+]
+
+@pytest.fixture
+def fetches(monkeypatch):
+    calls = []
+
+    def fetch_ztf(obj, deadline, include_non_detections=True):
+        calls.append(("ztf", bulk_export.object_id(obj)))
+        if obj["ztf_id"] == "ZTF24aaaxxxx":
+            return {"success": False, "error": "Object not found"}
+        return {"success": True, "data": {
+            "detections": [{"mjd": 60001.0, "fid": 2, "mag": 18.5, "e_mag": 0.1},
+                           {"mjd": 60000.0, "fid": 1, "mag": 18.0, "e_mag": 0.1}],
+            "non_detections": [{"mjd": 59999.0, "fid": 1, "diffmaglim": 20.1}]}}
+
+    def fetch_atlas(obj, username, password, deadline):
+        calls.append(("atlas", bulk_export.object_id(obj)))
+        if obj["ra"] is None:
+            return {"success": False, "error": "No coordinates"}
+        return {"success": True, "data": [{"mjd": 60002.0, "filter": "o", "flux_ujy": 50.0, "flux_err_ujy": 5.0,
+                                           "mag": 19.65, "e_mag": 0.1}]}
+
+    monkeypatch.setattr(bulk_export, "fetch_ztf", fetch_ztf)
+    monkeypatch.setattr(bulk_export, "fetch_atlas", fetch_atlas)
+    monkeypatch.setattr(bulk_export, "prefetch_atlas_batch", lambda *args: [])
+    return calls
+
+def test_hive_partitions_per_object_and_band(tmp_path, fetches):
+    counts = bulk_export.export_objects(OBJECTS, output_dir=str(tmp_path))
+    assert counts == {"exported": 1, "skipped": 0, "failed": 1, "points": 4}
+    object_dir = tmp_path / "photometry" / "object=2024abc"
+    assert sorted(os.listdir(object_dir)) == ["band=atlas_o", "band=ztf_g", "band=ztf_r"]
+    assert not (tmp_path / "photometry" / "object=ZTF24aaaxxxx").exists()
+    assert not list((tmp_path / "photometry").glob("*.tmp"))
+
+    ztf_g = pq.read_table(object_dir / "band=ztf_g" / "part-0.parquet").to_pydict()
+    assert ztf_g["mjd"] == [59999.0, 60000.0]
+    assert ztf_g["detected"] == [False, True]
+    assert ztf_g["limit_mag"][0] == 20.1 and ztf_g["survey"] == ["ztf", "ztf"]
+
+    dataset = ds.dataset(str(tmp_path / "photometry"), format="parquet", partitioning="hive")
+    table = dataset.to_table()
+    assert table.num_rows == 4 and set(table.column("object").to_pylist()) == {"2024abc"}
+
+def test_catalog_lists_every_object_with_counts_and_status(tmp_path, fetches):
+    bulk_export.export_objects(OBJECTS, output_dir=str(tmp_path))
+    rows = pq.read_table(tmp_path / "catalog.parquet").to_pylist()
+    assert [row["object_id"] for row in rows] == ["2024abc", "ZTF24aaaxxxx"]
+    assert rows[0]["tns_type"] == "SN Ia" and rows[0]["tns_redshift"] == "0.05"
+    assert (rows[0]["n_ztf_g"], rows[0]["n_ztf_r"], rows[0]["n_atlas_o"], rows[0]["n_atlas_c"]) == (2, 1, 1, 0)
+    assert rows[0]["ztf_status"] == "ok" and rows[0]["atlas_status"] == "ok"
+    assert rows[1]["ztf_status"] == "Object not found" and rows[1]["atlas_status"] == "No coordinates"
+
+def test_existing_partitions_are_skipped_unless_overwritten(tmp_path, fetches):
+    bulk_export.export_objects(OBJECTS[:1], output_dir=str(tmp_path))
+    fetches.clear()
+    counts = bulk_export.export_objects(OBJECTS[:1], output_dir=str(tmp_path))
+    assert counts == {"exported": 0, "skipped": 1, "failed": 0, "points": 0}
+    assert fetches == []
+    row = pq.read_table(tmp_path / "catalog.parquet").to_pylist()[0]
+    assert (row["n_ztf_g"], row["n_atlas_o"], row["ztf_status"]) == (2, 1, None)
+
+    counts = bulk_export.export_objects(OBJECTS[:1], output_dir=str(tmp_path), overwrite=True)
+    assert counts["exported"] == 1 and fetches == [("ztf", "2024abc"), ("atlas", "2024abc")]
+
+def test_interrupted_partition_is_not_treated_as_done(tmp_path, fetches):
+    (tmp_path / "photometry" / "object=2024abc.tmp" / "band=ztf_g").mkdir(parents=True)
+    counts = bulk_export.export_objects(OBJECTS[:1], output_dir=str(tmp_path))
+    assert counts["exported"] == 1
+    assert not (tmp_path / "photometry" / "object=2024abc.tmp").exists()
+
+def test_arrow_format_round_trips(tmp_path, fetches):
+    bulk_export.export_objects(OBJECTS[:1], output_dir=str(tmp_path), export_format="arrow")
+    assert (tmp_path / "photometry" / "object=2024abc" / "band=ztf_r" / "part-0.arrow").exists()
+    assert bulk_export.existing_counts(str(tmp_path / "photometry" / "object=2024abc"), "arrow") == \
+        {"ztf_g": 2, "ztf_r": 1, "atlas_o": 1}
+    with pytest.raises(ValueError):
+        bulk_export.export_objects(OBJECTS, output_dir=str(tmp_path), export_format="csv")
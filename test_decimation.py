@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# Behaviour tests for light-curve decimation
+import numpy as np
+
+from decimation import decimate_points, lttb_indices
+
+def test_lttb_keeps_endpoints_and_target_count():
+    x = np.arange(1000, dtype=float)
+    y = np.sin(x / 50.0)
+    indices = lttb_indices(x, y, 50)
+    assert len(indices) == 50
+    assert indices[0] == 0 and indices[-1] == 999
+    assert np.all(np.diff(indices) > 0)
+
+def test_lttb_keeps_a_spike():
+    x = np.arange(500, dtype=float)
+    y = np.zeros(500)
+    y[237] = 10.0
+    assert 237 in lttb_indices(x, y, 20).tolist()
+
+def test_lttb_returns_everything_when_under_target():
+    assert lttb_indices([0, 1, 2], [1, 2, 3], 10).tolist() == [0, 1, 2]
+
+def test_decimate_points_limits_each_band_and_keeps_peak():
+    points = [{"mjd": float(i), "mag": 20.0 - 0.001 * i, "fid": 1 + i % 2} for i in range(2000)]
+    points[1500]["mag"] = 15.0
+    decimated = decimate_points(points, 100, "fid")
+    for band in (1, 2):
+        assert len([p for p in decimated if p["fid"] == band]) <= 101
+    assert points[1500] in decimated
+    assert [p["mjd"] for p in decimated] == sorted(p["mjd"] for p in decimated)
+
+def test_decimate_points_leaves_short_curves_alone():
+    points = [{"mjd": 1.0, "mag": 18.0, "fid": 1}]
+    assert decimate_points(points, 100, "fid") is points
+    assert decimate_points(points, None, "fid") is points
+
+def test_decimate_points_drops_points_without_values():
+    points = [{"mjd": float(i), "mag": None if i == 5 else 18.0, "fid": 1} for i in range(50)]
+    assert all(p["mag"] is not None for p in decimate_points(points, 10, "fid"))
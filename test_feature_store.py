@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# Behaviour tests for batch feature extraction and the feature table
+import pytest
+
+import feature_store
+
+def rising_and_falling(peak_mjd=60010.0, fid=1):
+    # 0.2 mag/day rise to 17.0 at the peak, 0.1 mag/day decline after it
+    return ([{"mjd": peak_mjd - d, "mag": 17.0 + 0.2 * d, "e_mag": 0.05, "fid": fid} for d in (10, 5)]
+            + [{"mjd": peak_mjd, "mag": 17.0, "e_mag": 0.05, "fid": fid}]
+            + [{"mjd": peak_mjd + d, "mag": 17.0 + 0.1 * d, "e_mag": 0.05, "fid": fid} for d in (10, 20)])
+
+def test_extract_features_finds_peak_and_rates():
+    features = feature_store.extract_features({"A": rising_and_falling(), "B": []})
+    a = features["A"]
+    assert (a["peak_mag"], a["peak_mjd"], a["peak_band"]) == (17.0, 60010.0, "ztf_g")
+    assert a["rise_rate"] == pytest.approx(0.2, abs=1e-6)
+    assert a["decline_rate"] == pytest.approx(0.1, abs=1e-6)
+    assert (a["first_mjd"], a["last_mjd"], a["n_detections"], a["n_ztf_g"]) == (60000.0, 60030.0, 5, 5)
+    assert features["B"]["n_detections"] == 0
+
+def test_colour_at_peak_pairs_g_and_r():
+    points = rising_and_falling(fid=1) + [{"mjd": 60010.5, "mag": 17.3, "e_mag": 0.05, "fid": 2}]
+    assert feature_store.extract_features({"A": points})["A"]["color_gr_at_peak"] == pytest.approx(-0.3, abs=1e-6)
+
+def test_update_recomputes_only_changed_photometry(tmp_path):
+    db_file = str(tmp_path / "features.db")
+    curve = rising_and_falling()
+    assert feature_store.update_features({"A": curve, "B": curve}, db_file) == ["A", "B"]
+    assert feature_store.update_features({"A": curve, "B": curve}, db_file) == []
+    newer = curve + [{"mjd": 60040.0, "mag": 20.0, "e_mag": 0.1, "fid": 1}]
+    assert feature_store.update_features({"A": newer, "B": curve}, db_file) == ["A"]
+    assert feature_store.get_features(["A"], db_file)["A"]["last_mjd"] == 60040.0
+
+def test_invalidated_features_are_recomputed(tmp_path):
+    db_file = str(tmp_path / "features.db")
+    feature_store.update_features({"A": rising_and_falling()}, db_file)
+    feature_store.invalidate_features(["A"], db_file)
+    assert feature_store.get_features(["A"], db_file) == {}
+    assert feature_store.update_features({"A": rising_and_falling()}, db_file) == ["A"]
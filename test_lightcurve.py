@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# Behaviour tests for the merged light-curve table and nightly stacking
+import numpy as np
+import pytest
+
+from lightcurve import (BANDS, atlas_columns, flux_to_mag, mag_to_flux, merge_columns, merge_lightcurves, stack_nightly,
+                        ztf_columns)
+
+def test_mag_flux_round_trip():
+    flux, flux_err = mag_to_flux(np.array([18.0, 23.9]), np.array([0.1, 0.2]))
+    assert flux[1] == pytest.approx(1.0)
+    mag, mag_err = flux_to_mag(flux, flux_err)
+    assert mag == pytest.approx([18.0, 23.9])
+    assert mag_err == pytest.approx([0.1, 0.2])
+
+def test_flux_to_mag_is_nan_for_non_positive_flux():
+    mag, mag_err = flux_to_mag(np.array([-5.0, 0.0]), np.array([1.0, 1.0]))
+    assert np.isnan(mag).all() and np.isnan(mag_err).all()
+
+def test_merge_columns_drops_unusable_rows_and_sorts():
+    ztf = ztf_columns([{"mjd": 3.0, "mag": 18.0, "e_mag": 0.1, "fid": 1},
+                       {"mjd": 1.0, "mag": 18.0, "e_mag": 0.1, "fid": 9},
+                       {"mjd": None, "mag": 18.0, "e_mag": 0.1, "fid": 2}])
+    atlas = atlas_columns([{"mjd": 2.0, "flux_ujy": 100.0, "flux_err_ujy": 10.0, "mag": None, "e_mag": None,
+                            "filter": "o"},
+                           {"mjd": 4.0, "flux_ujy": 100.0, "flux_err_ujy": 0.0, "mag": None, "e_mag": None,
+                            "filter": "c"}])
+    merged = merge_columns(ztf, atlas)
+    assert merged["mjd"].tolist() == [2.0, 3.0]
+    assert [BANDS[b] for b in merged["band"]] == ["atlas_o", "ztf_g"]
+    assert merged["n_points"].tolist() == [1, 1]
+
+def test_atlas_columns_fall_back_to_magnitudes():
+    columns = atlas_columns([{"mjd": 1.0, "flux_ujy": None, "flux_err_ujy": None, "mag": 23.9, "e_mag": 0.1,
+                              "filter": "c"}])
+    assert columns["flux_ujy"][0] == pytest.approx(1.0)
+
+def test_stack_nightly_weights_by_inverse_variance():
+    table = {"mjd": np.array([10.1, 10.3, 10.2, 11.5]),
+             "band": np.array([0, 0, 1, 0]),
+             "flux_ujy": np.array([100.0, 200.0, 50.0, 80.0]),
+             "flux_err_ujy": np.array([10.0, 20.0, 5.0, 8.0]),
+             "n_points": np.ones(4, dtype=int)}
+    stacked = stack_nightly(table)
+    assert stacked["n_points"].tolist() == [2, 1, 1]
+    # Night 10 of band 0 combines weights 1/100 and 1/400
+    assert stacked["flux_ujy"][0] == pytest.approx((100 / 100 + 200 / 400) / (1 / 100 + 1 / 400))
+    assert stacked["flux_err_ujy"][0] == pytest.approx(1 / np.sqrt(1 / 100 + 1 / 400))
+    assert stacked["mjd"][0] == pytest.approx((10.1 / 100 + 10.3 / 400) / (1 / 100 + 1 / 400))
+    assert stacked["band"].tolist() == [0, 1, 0]
+
+def test_stack_nightly_respects_bin_offset():
+    table = {"mjd": np.array([10.4, 10.6]), "band": np.array([0, 0]),
+             "flux_ujy": np.array([1.0, 1.0]), "flux_err_ujy": np.array([1.0, 1.0]), "n_points": np.ones(2, dtype=int)}
+    assert stack_nightly(table)["n_points"].tolist() == [2]
+    assert stack_nightly(table, offset=0.5)["n_points"].tolist() == [1, 1]
+
+def test_default_nights_are_not_split_at_ut_midnight():
+    def atlas_o(*mjd):
+        return {"mjd": np.array(mjd), "band": np.full(len(mjd), BANDS.index("atlas_o")), "flux_ujy": np.ones(len(mjd)),
+                "flux_err_ujy": np.ones(len(mjd)), "n_points": np.ones(len(mjd), dtype=int)}
+
+    # Sutherland before and after 0h UT, then Hawaii later the same UT day
+    assert stack_nightly(atlas_o(10.85, 11.05, 11.30, 11.60))["n_points"].tolist() == [4]
+    assert stack_nightly(atlas_o(10.85, 11.05, 11.30, 11.60), offset=0.0)["n_points"].tolist() == [1, 3]
+    # Hawaii's dawn and the next Sutherland dusk are different nights
+    assert stack_nightly(atlas_o(11.60, 11.72))["n_points"].tolist() == [1, 1]
+
+def test_merge_lightcurves_reports_raw_and_stacked_counts():
+    detections = [{"mjd": 100.0 + i * 0.01, "mag": 18.0, "e_mag": 0.1, "fid": 2} for i in range(10)]
+    merged = merge_lightcurves(detections, [])
+    assert (merged["raw_points"], merged["points"], merged["stacked"]) == (10, 1, True)
+    assert merged["table"]["band"] == ["ztf_r"]
+    assert merged["table"]["mag"][0] == pytest.approx(18.0, abs=1e-3)
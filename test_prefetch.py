@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# Behaviour tests for prefetch object selection, request budget and ordering
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+import prefetch
+
+def tns_record(name, age_days, ztf_id=None):
+    when = (datetime.now() - timedelta(days=age_days)).strftime('%Y-%m-%d %H:%M:%S')
+    return {"name": name, "ra": "10.0", "declination": "-5.0", "discoverydate": when, "lastmodified": when,
+            "internal_names": ztf_id}
+
+RECORDS = [tns_record("2024old", 2.5, "ZTF24aaaaaaa"), tns_record("2024new", 0.1, "ZTF24aaaaaab"),
+           tns_record("2024mid", 1.0), tns_record("2023gone", 30, "ZTF23aaaaaaa")]
+
+@pytest.fixture
+def tns_file(tmp_path):
+    path = tmp_path / "tns_cache.json"
+    path.write_text(json.dumps({"data": RECORDS}))
+    return str(path)
+
+@pytest.fixture
+def requests_run(monkeypatch):
+    calls = []
+
+    def handle_request(args):
+        calls.append(args)
+        return {"success": True, "data": {"detections": []}}
+
+    monkeypatch.setattr(prefetch, "handle_request", handle_request)
+    monkeypatch.setattr(prefetch, "is_result_cached", lambda args: args.get("broker") == "alerce")
+    monkeypatch.setattr(prefetch, "update_features", lambda lightcurves: list(lightcurves))
+    return calls
+
+def test_recent_objects_newest_first_within_the_window():
+    objects = prefetch.select_recent_objects(RECORDS, days=3, max_objects=10)
+    assert [obj["name"] for obj in objects] == ["2024new", "2024mid", "2024old"]
+    assert [obj["name"] for obj in prefetch.select_recent_objects(RECORDS, days=3, max_objects=2)] == \
+        ["2024new", "2024mid"]
+
+def test_requests_follow_the_web_app():
+    obj = prefetch.select_recent_objects(RECORDS, days=3)[0]
+    requests_ = prefetch.build_requests(obj, ["alerce", "fink"], api_token="t")
+    assert [r.get("broker") or r["mode"] for r in requests_] == ["alerce", "fink", "crossmatch", "lightcurve"]
+    no_ztf = prefetch.select_recent_objects(RECORDS, days=3)[1]
+    assert "fink" not in [r.get("broker") for r in prefetch.build_requests(no_ztf, ["fink", "lasair"], "t")]
+
+def test_budget_goes_to_the_newest_objects_and_skips_cached_requests(tns_file, requests_run):
+    result = prefetch.run_prefetch(days=3, max_requests=4, max_workers=1, brokers=["alerce", "antares"],
+                                   tns_file=tns_file)
+    summary = result["data"]
+    assert summary["objects"] == 3
+    assert summary["requests"] == {"ok": 4, "failed": 0, "deadline": 0}
+    assert all(call.get("broker") != "alerce" for call in requests_run)
+    # 2024new's three uncached requests use the budget before any of 2024mid's
+    assert [call.get("broker") or call["mode"] for call in requests_run] == \
+        ["antares", "crossmatch", "lightcurve", "antares"]
+    assert [call.get("ztf_id") for call in requests_run] == ["ZTF24aaaaaab", None, "ZTF24aaaaaab", "2024mid"]
+    assert all(call["allow_stale"] is False and "deadline" in call for call in requests_run)
+    assert summary["already_cached"] == 3
+    assert summary["over_quota"] == 4
+
+def test_packed_atlas_gets_objects_newest_first_and_the_job_quota(tns_file, requests_run, monkeypatch):
+    seen = {}
+
+    def prefetch_atlas_batch(objects, username, password, deadline, max_jobs):
+        seen.update(names=[obj["name"] for obj in objects], max_jobs=max_jobs)
+        return [{"success": True}] * len(objects)
+
+    monkeypatch.setattr(prefetch, "prefetch_atlas_batch", prefetch_atlas_batch)
+    result = prefetch.run_prefetch(days=3, max_requests=0, max_atlas_jobs=2, atlas_username="u",
+                                   atlas_password="p", tns_file=tns_file)
+    assert seen == {"names": ["2024new", "2024mid", "2024old"], "max_jobs": 2}
+    assert result["data"]["atlas"]["ok"] == 3
+
+def test_atlas_is_skipped_without_credentials(tns_file, requests_run):
+    assert prefetch.run_prefetch(days=3, max_requests=0, tns_file=tns_file)["data"]["atlas"] == \
+        {"ok": 0, "failed": 0, "deadline": 0}
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# Behaviour tests for on-demand profiling of CLI requests
+import json
+import sys
+
+import profiling
+
+def test_profiled_is_a_no_op_when_off(tmp_path, monkeypatch):
+    monkeypatch.delenv("METABROKER_PROFILE", raising=False)
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path / "profiles"))
+    with profiling.profiled("broker_alerce", {"broker": "alerce"}) as report:
+        assert sys.getprofile() is None
+    assert report == {}
+    assert not (tmp_path / "profiles").exists()
+
+def test_profiling_requested_by_arg_or_environment(monkeypatch):
+    monkeypatch.delenv("METABROKER_PROFILE", raising=False)
+    assert profiling.profiling_requested({"profile": True})
+    assert not profiling.profiling_requested({"profile": False})
+    monkeypatch.setenv("METABROKER_PROFILE", "1")
+    assert profiling.profiling_requested({})
+
+def test_profiled_writes_a_redacted_report(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+    args = {"profile": True, "broker": "lasair", "api_token": "secret", "password": ""}
+    with profiling.profiled("broker_lasair", args) as report:
+        report["success"] = True
+        sum(range(1000))
+    reports = list(tmp_path.glob("*_broker_lasair.json"))
+    assert len(reports) == 1 and reports[0].with_suffix(".prof").exists()
+    written = json.loads(reports[0].read_text())
+    assert written["success"] is True
+    assert written["args"] == {"profile": True, "broker": "lasair", "api_token": "***", "password": ""}
+    assert "secret" not in reports[0].read_text()
+    assert written["top_functions"] and written["memory"]["peak_kb"] >= 0
+
+def test_redact_args_masks_only_set_credentials():
+    args = {"username": "me", "atlas_password": "pw", "token": None, "ra": 10.0}
+    assert profiling.redact_args(args) == {"username": "***", "atlas_password": "***", "token": None, "ra": 10.0}
+    assert profiling.redact_args(None) == {}
+    assert args["username"] == "me"
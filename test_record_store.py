@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# Behaviour tests for the transient record store's TNS sync and lookups
+import os
+import json
+
+import pytest
+
+import record_store
+
+RECORDS = [{"name_prefix": "SN", "name": "2024abc", "ra": "150.0", "declination": "2.0",
+            "internal_names": "ZTF24aaaaaaa", "discoverydate": "2024-01-15 12:00:00", "type": "SN Ia"}]
+
+@pytest.fixture
+def store(tmp_path):
+    tns_file = tmp_path / "tns_cache.json"
+    tns_file.write_text(json.dumps({"data": RECORDS}))
+    return str(tns_file), str(tmp_path / "transients.db")
+
+def get(db_file, **kwargs):
+    return record_store.get_transient_record(refresh="none", db_file=db_file, **kwargs)
+
+def test_synced_rows_are_found_by_name_ztf_id_and_position(store):
+    tns_file, db_file = store
+    assert record_store.sync_record_store(tns_file, db_file=db_file) == 1
+    for kwargs in ({"name": "2024abc"}, {"name": "SN2024abc"}, {"ztf_id": "ZTF24aaaaaaa"},
+                   {"ra": 150.0, "dec": 2.0 + 1 / 3600}):
+        result = get(db_file, **kwargs)
+        assert result["success"]
+        assert result["data"]["object_key"] == "SN 2024abc"
+        assert result["data"]["tns"]["type"] == "SN Ia"
+
+def test_sync_is_skipped_until_the_tns_cache_changes(store):
+    tns_file, db_file = store
+    assert record_store.sync_record_store(tns_file, db_file=db_file) == 1
+    assert record_store.sync_record_store(tns_file, db_file=db_file) == 0
+    assert record_store.sync_record_store(tns_file, db_file=db_file, force=True) == 1
+
+def test_reads_do_not_sync(store):
+    tns_file, db_file = store
+    record_store.sync_record_store(tns_file, db_file=db_file)
+    updated = [dict(RECORDS[0], type="SN II")]
+    with open(tns_file, 'w') as f:
+        json.dump({"data": updated}, f)
+    os.utime(tns_file, (os.path.getmtime(tns_file) + 10,) * 2)
+    assert get(db_file, name="2024abc")["data"]["tns"]["type"] == "SN Ia"
+    record_store.sync_record_store(tns_file, db_file=db_file)
+    assert get(db_file, name="2024abc")["data"]["tns"]["type"] == "SN II"
+
+def test_alias_resolved_object_gets_a_row_before_the_sync(store, monkeypatch):
+    tns_file, db_file = store
+    monkeypatch.setattr(record_store, "resolve_object", lambda name: {"tns_name": "SN 2024abc"})
+    result = get(db_file, name="ATLAS24xyz")
+    assert result["data"]["object_key"] == "SN 2024abc"
+    assert result["data"]["tns"] is None
+    record_store.sync_record_store(tns_file, db_file=db_file)
+    assert get(db_file, name="ATLAS24xyz")["data"]["tns"]["type"] == "SN Ia"
+
+def test_unknown_objects_get_a_bare_record(store):
+    _, db_file = store
+    result = get(db_file, ztf_id="ZTF24zzzzzzz")
+    assert result["data"]["object_key"] == "ZTF24zzzzzzz"
+    assert result["data"]["ztf_id"] == "ZTF24zzzzzzz"
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# Behaviour tests for the shared circuit breakers, rate limiter and deadlines
+import os
+import time
+
+import pytest
+
+import resilience
+from resilience import (BREAKER_FAILURE_THRESHOLD, BREAKER_RECOVERY_TIME, CircuitOpenError, Deadline,
+                        DeadlineExceeded, RateLimitExceeded, breaker_allow, breaker_record, guard, locked_state)
+
+@pytest.fixture(autouse=True)
+def state_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(resilience, "STATE_DIR", str(tmp_path))
+    return tmp_path
+
+def breaker_state(broker):
+    with locked_state(f"breaker_{broker}") as state:
+        return dict(state)
+
+def open_breaker(broker, opened_ago=BREAKER_RECOVERY_TIME + 1):
+    for _ in range(BREAKER_FAILURE_THRESHOLD):
+        breaker_record(broker, False)
+    with locked_state(f"breaker_{broker}") as state:
+        state["opened_at"] = time.time() - opened_ago
+
+def test_breaker_opens_after_threshold_failures():
+    for _ in range(BREAKER_FAILURE_THRESHOLD - 1):
+        breaker_record("fink", False)
+    assert breaker_allow("fink")
+    breaker_record("fink", False)
+    assert breaker_state("fink")["state"] == "open"
+    assert not breaker_allow("fink")
+
+def test_half_open_allows_a_single_probe():
+    open_breaker("fink")
+    assert breaker_allow("fink")
+    assert breaker_state("fink")["state"] == "half_open"
+    assert not breaker_allow("fink")
+    breaker_record("fink", True)
+    assert breaker_state("fink") == {"state": "closed", "failures": 0}
+
+def test_failed_probe_reopens_breaker():
+    open_breaker("fink")
+    assert breaker_allow("fink")
+    breaker_record("fink", False)
+    assert breaker_state("fink")["state"] == "open"
+    assert not breaker_allow("fink")
+
+def test_guard_refuses_when_open():
+    open_breaker("fink", opened_ago=0)
+    with pytest.raises(CircuitOpenError):
+        with guard("fink"):
+            pass
+
+def test_guard_releases_probe_when_rate_limited(monkeypatch):
+    open_breaker("fink")
+
+    def no_token(host, max_wait):
+        raise RateLimitExceeded(f"Rate limit for {host} exceeded")
+
+    monkeypatch.setattr(resilience, "acquire_token", no_token)
+    with pytest.raises(RateLimitExceeded):
+        with guard("fink", "api.fink-portal.org"):
+            pytest.fail("guarded block must not run without a token")
+    # The probe was given back: the next caller may probe straight away
+    assert breaker_state("fink")["state"] == "open"
+    assert breaker_allow("fink")
+
+def test_closed_breaker_check_does_not_rewrite_state(state_dir):
+    breaker_record("fink", True)
+    path = os.path.join(str(state_dir), "breaker_fink.json")
+    os.utime(path, (0, 0))
+    assert breaker_allow("fink")
+    assert os.path.getmtime(path) == 0
+
+def test_rate_limiter_fails_fast_when_bucket_is_empty():
+    host = "lasair-ztf.lsst.ac.uk"
+    rate, burst = resilience.RATE_LIMITS[host]
+    for _ in range(burst):
+        resilience.acquire_token(host, max_wait=0)
+    with pytest.raises(RateLimitExceeded):
+        resilience.acquire_token(host, max_wait=0)
+
+def test_deadline_timeout_caps_and_expires():
+    assert Deadline(None).timeout(30) == 30
+    assert Deadline(10).timeout(30) <= 10
+    assert Deadline(60).timeout(30) == 30
+    with pytest.raises(DeadlineExceeded):
+        Deadline(0).timeout(30)
+
+def test_run_with_deadline_gives_up_on_hanging_call():
+    with pytest.raises(DeadlineExceeded):
+        resilience.run_with_deadline(lambda: time.sleep(2), Deadline(0.1))
+    assert resilience.run_with_deadline(lambda: 42, Deadline(5)) == 42
+
+def test_deadline_on_half_open_probe_hands_the_probe_back():
+    open_breaker("fink")
+    with pytest.raises(DeadlineExceeded):
+        with guard("fink"):
+            resilience.run_with_deadline(lambda: time.sleep(2), Deadline(0.1))
+    state = breaker_state("fink")
+    # Not a success (the breaker stays open) and not a failure either
+    assert state["state"] == "open"
+    assert state["failures"] == BREAKER_FAILURE_THRESHOLD
+    assert breaker_allow("fink")
+
+def test_deadline_on_closed_breaker_records_nothing():
+    breaker_record("fink", False)
+    with pytest.raises(DeadlineExceeded):
+        with guard("fink"):
+            raise DeadlineExceeded("Request deadline exceeded")
+    assert breaker_state("fink")["failures"] == 1
+
+def test_transport_error_counts_as_failure():
+    with pytest.raises(resilience.requests.exceptions.ConnectionError):
+        with guard("fink"):
+            raise resilience.requests.exceptions.ConnectionError("refused")
+    assert breaker_state("fink")["failures"] == 1
+
+class APIError(Exception):
+    """Shaped like the ALeRCE client's error: the HTTP status in ``code``"""
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+def test_server_error_from_a_client_library_counts_as_failure():
+    breaker_record("alerce", False)
+    with pytest.raises(APIError):
+        with guard("alerce"):
+            raise APIError(500)
+    assert breaker_state("alerce")["failures"] == 2
+
+def test_not_found_from_a_client_library_counts_as_success():
+    breaker_record("alerce", False)
+    with pytest.raises(APIError):
+        with guard("alerce"):
+            raise APIError(404)
+    assert breaker_state("alerce")["failures"] == 0
+
+def test_error_without_a_status_is_neutral_and_releases_the_probe():
+    breaker_record("alerce", False)
+    with pytest.raises(ValueError):
+        with guard("alerce"):
+            raise ValueError("bad payload")
+    assert breaker_state("alerce")["failures"] == 1
+    open_breaker("fink")
+    with pytest.raises(ValueError):
+        with guard("fink"):
+            raise ValueError("bad payload")
+    assert breaker_allow("fink")
+
+def test_adapter_token_wait_stays_within_the_request_timeout(monkeypatch):
+    waits = []
+    monkeypatch.setattr(resilience, "acquire_token", lambda host, max_wait: waits.append(max_wait))
+
+    def respond(self, request, **kwargs):
+        response = resilience.requests.models.Response()
+        response.status_code, response.request, response.url = 200, request, request.url
+        return response
+
+    monkeypatch.setattr(resilience.HTTPAdapter, "send", respond)
+    session = resilience.create_session()
+    session.get("https://api.fink-portal.org/api/v1/objects", timeout=1.5)
+    session.get("https://api.fink-portal.org/api/v1/objects", timeout=(0.5, 30))
+    session.get("https://api.fink-portal.org/api/v1/objects")
+    assert waits == [1.5, 0.5, resilience.RATE_LIMIT_MAX_WAIT]
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# Behaviour tests for stale-while-revalidate refresh claims
+import os
+import time
+import threading
+
+import pytest
+
+import revalidate
+
+@pytest.fixture(autouse=True)
+def refresh_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(revalidate, "REFRESH_DIR", str(tmp_path))
+    return tmp_path
+
+def test_one_claim_per_key_until_released():
+    token = revalidate.claim_refresh("alerce_x")
+    assert token
+    assert revalidate.claim_refresh("alerce_x") is None
+    assert revalidate.claim_refresh("alerce_y")
+    revalidate.release_refresh("alerce_x", token)
+    assert revalidate.claim_refresh("alerce_x")
+
+def test_abandoned_claim_is_taken_over_by_exactly_one_caller():
+    revalidate.claim_refresh("alerce_x")
+    old = time.time() - revalidate.REFRESH_CLAIM_TIMEOUT - 1
+    os.utime(revalidate.claim_file("alerce_x"), (old, old))
+    tokens = []
+    threads = [threading.Thread(target=lambda: tokens.append(revalidate.claim_refresh("alerce_x"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    winners = [token for token in tokens if token]
+    assert len(winners) == 1
+    assert revalidate.read_claim(revalidate.claim_file("alerce_x")) == winners[0]
+
+def test_late_release_of_a_taken_over_claim_keeps_the_new_owner(refresh_dir):
+    first = revalidate.claim_refresh("alerce_x")
+    old = time.time() - revalidate.REFRESH_CLAIM_TIMEOUT - 1
+    os.utime(revalidate.claim_file("alerce_x"), (old, old))
+    second = revalidate.claim_refresh("alerce_x")
+    revalidate.release_refresh("alerce_x", first)
+    assert revalidate.claim_refresh("alerce_x") is None
+    revalidate.release_refresh("alerce_x", second)
+    assert sorted(os.listdir(refresh_dir)) == [revalidate.REFRESH_LOCK_FILE]
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# Behaviour tests for the JSON and MessagePack result encoders
+import io
+import json
+import math
+
+import numpy as np
+import pytest
+
+import serialization
+
+def test_to_builtin_converts_numpy_and_nan():
+    value = {"a": np.float64(1.5), "b": np.array([1, 2]), "c": [math.nan, np.nan], 3: (np.int32(7),)}
+    assert serialization.to_builtin(value) == {"a": 1.5, "b": [1, 2], "c": [None, None], "3": [7]}
+
+def test_json_matches_with_and_without_orjson(monkeypatch):
+    result = {"success": True, "data": {"mjd": np.array([1.0, np.nan]), "n": np.int64(3), "tag": None}}
+    expected = {"success": True, "data": {"mjd": [1.0, None], "n": 3, "tag": None}}
+    assert json.loads(serialization.dumps_json(result)) == expected
+    monkeypatch.setattr(serialization, "orjson", None)
+    assert json.loads(serialization.dumps_json(result)) == expected
+
+def test_msgpack_round_trips_record_tables():
+    pytest.importorskip("msgpack")
+    rows = [{"mjd": 60000.0 + i, "fid": i % 2 + 1, "mag": None if i == 3 else 18.0 + i / 10, "band": "g"}
+            for i in range(serialization.TABLE_MIN_ROWS + 4)]
+    result = {"success": True, "data": {"detections": rows, "short": rows[:2]}}
+    decoded = serialization.loads_msgpack(serialization.dumps_msgpack(result))
+    assert decoded == result
+    assert [type(row["fid"]) for row in decoded["data"]["detections"]] == [int] * len(rows)
+
+def test_msgpack_round_trips_numpy_columns():
+    pytest.importorskip("msgpack")
+    columns = {"flux": np.array([1.5, np.nan, -2.0]), "count": np.array([1, 2, 3], dtype=np.int32)}
+    assert serialization.loads_msgpack(serialization.dumps_msgpack(columns)) == \
+        {"flux": [1.5, None, -2.0], "count": [1, 2, 3]}
+
+def test_mixed_columns_are_packed_as_plain_lists():
+    pytest.importorskip("msgpack")
+    rows = [{"value": i if i % 2 else str(i), "flag": i % 3 == 0} for i in range(serialization.TABLE_MIN_ROWS)]
+    assert serialization.loads_msgpack(serialization.dumps_msgpack(rows)) == rows
+
+def test_write_output_falls_back_to_json(monkeypatch):
+    monkeypatch.setattr(serialization, "msgpack", None)
+    stream = io.StringIO()
+    serialization.write_output({"success": True}, "msgpack", stream)
+    assert json.loads(stream.getvalue()) == {"success": True}
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# Behaviour tests for the memory-mapped TNS catalog and the readers that use it
+import os
+import json
+
+import pytest
+
+import tns_catalog
+
+HEADER = {"download_date": "2024-06-01", "total_objects": 2}
+RECORDS = [
+    {"name_prefix": "SN", "name": "2024abc", "ra": "150.0", "declination": "2.0", "internal_names": "ZTF24aaaaaaa"},
+    {"name_prefix": "AT", "name": "2024def", "ra": "10.0", "declination": "-5.0", "internal_names": None},
+]
+
+@pytest.fixture
+def tns_file(tmp_path):
+    path = tmp_path / "tns_cache.json"
+    path.write_text(json.dumps(dict(HEADER, data=RECORDS)))
+    return str(path)
+
+@pytest.fixture
+def catalog_dir(tmp_path):
+    return str(tmp_path / "catalog")
+
+def test_snapshot_iterates_the_published_records(tns_file, catalog_dir):
+    tns_catalog.write_catalog_snapshot(tns_file, catalog_dir)
+    catalog = tns_catalog.get_catalog(catalog_dir, tns_file, rebuild=False)
+    assert list(catalog) == RECORDS
+    assert len(catalog) == 2
+    assert catalog.header == HEADER
+    assert catalog.row(catalog.find_name("ZTF24aaaaaaa")[0])["name"] == "2024abc"
+
+def test_writers_recheck_staleness_under_the_lock(tns_file, catalog_dir):
+    first = tns_catalog.write_catalog_snapshot(tns_file, catalog_dir)
+    assert tns_catalog.write_catalog_snapshot(tns_file, catalog_dir) == first
+    assert tns_catalog.write_catalog_snapshot(tns_file, catalog_dir, force=True)["generation"] == first["generation"] + 1
+
+def test_records_come_from_a_current_snapshot_only(tns_file, catalog_dir):
+    assert tns_catalog.load_catalog_records(tns_file, catalog_dir) == RECORDS
+    tns_catalog.write_catalog_snapshot(tns_file, catalog_dir)
+    assert isinstance(tns_catalog.load_catalog_records(tns_file, catalog_dir), tns_catalog.CatalogSnapshot)
+    with open(tns_file, "w") as f:
+        json.dump(dict(HEADER, data=RECORDS[:1]), f)
+    os.utime(tns_file, (os.path.getmtime(tns_file) + 10,) * 2)
+    assert tns_catalog.load_catalog_records(tns_file, catalog_dir) == RECORDS[:1]
+
+def test_snapshot_of_another_cache_file_is_stale(tns_file, catalog_dir, tmp_path):
+    tns_catalog.write_catalog_snapshot(tns_file, catalog_dir)
+    other = tmp_path / "other.json"
+    other.write_text(json.dumps({"data": []}))
+    os.utime(other, (os.path.getmtime(tns_file) - 10,) * 2)
+    assert tns_catalog.snapshot_is_stale(catalog_dir, str(other))
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# Behaviour tests for the precompressed TNS snapshot served by api/tns-data.py
+import os
+import gzip
+import json
+import importlib.util
+
+import pytest
+
+spec = importlib.util.spec_from_file_location("tns_data", os.path.join(os.path.dirname(__file__), "api", "tns-data.py"))
+tns_data = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(tns_data)
+
+@pytest.fixture
+def cache_file(tmp_path, monkeypatch):
+    snapshot_dir = tmp_path / "snapshot"
+    monkeypatch.setattr(tns_data, "SNAPSHOT_DIR", str(snapshot_dir))
+    monkeypatch.setattr(tns_data, "SNAPSHOT_META_FILE", str(snapshot_dir / "meta.json"))
+    monkeypatch.setattr(tns_data, "SNAPSHOT_LOCK_FILE", str(snapshot_dir / ".lock"))
+    path = tmp_path / "tns_cache.json"
+    path.write_text(json.dumps({"data": [{"name": "2024abc"}]}))
+    return str(path)
+
+def read_generation(meta, suffix=""):
+    with open(os.path.join(tns_data.SNAPSHOT_DIR, meta["file"] + suffix), "rb") as f:
+        return f.read()
+
+def test_snapshot_variants_match_the_body(cache_file):
+    meta = tns_data.get_snapshot(cache_file)
+    body = read_generation(meta)
+    assert json.loads(body) == {"data": [{"name": "2024abc"}]}
+    assert gzip.decompress(read_generation(meta, ".gz")) == body
+    assert meta["size"] == len(body)
+
+def test_current_snapshot_is_not_rebuilt(cache_file):
+    meta = tns_data.get_snapshot(cache_file)
+    assert tns_data.build_snapshot(cache_file) == meta
+    assert tns_data.build_snapshot(cache_file, force=True)["generation"] == meta["generation"] + 1
+
+def test_rebuild_writes_a_new_generation_and_prunes_old_ones(cache_file):
+    first = tns_data.get_snapshot(cache_file)
+    for generation in range(3):
+        with open(cache_file, "w") as f:
+            json.dump({"data": [{"name": f"2024ab{generation}"}]}, f)
+        os.utime(cache_file, (first["source_mtime"] + 10 * (generation + 1),) * 2)
+        meta = tns_data.get_snapshot(cache_file)
+    assert meta["generation"] == first["generation"] + 3
+    assert json.loads(read_generation(meta)) == {"data": [{"name": "2024ab2"}]}
+    bodies = [name for name in os.listdir(tns_data.SNAPSHOT_DIR) if name.endswith(".json") and name.startswith("gen-")]
+    assert len(bodies) == tns_data.KEEP_GENERATIONS
+
+def test_catalog_body_matches_the_cache_document(cache_file, tmp_path):
+    import tns_catalog
+
+    catalog_dir = str(tmp_path / "catalog")
+    document = {"download_date": "2024-06-01", "total_objects": 1, "data": [{"name": "2024abc", "type": None}]}
+    with open(cache_file, "w") as f:
+        json.dump(document, f)
+    tns_catalog.write_catalog_snapshot(cache_file, catalog_dir)
+    assert json.loads(tns_data.catalog_body(tns_catalog.get_catalog(catalog_dir, cache_file))) == document
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# Behaviour tests for parsing TNS CSV exports and applying them as upserts
+import os
+import json
+from datetime import date
+
+import tns_ingest
+
+CSV = '''"2024-06-01 00:00:00"
+"objid","name","ra","declination","internal_names"
+"1","2024abc","150.0","2.0","ZTF24aaaaaaa"
+
+"2","2024def","10.0","-5.0",""
+"3","2024ghi"
+'''
+
+def test_parse_tns_csv_skips_timestamp_and_blank_lines():
+    records = tns_ingest.parse_tns_csv(CSV)
+    assert [record["name"] for record in records] == ["2024abc", "2024def", "2024ghi"]
+    assert records[0] == {"objid": "1", "name": "2024abc", "ra": "150.0", "declination": "2.0",
+                          "internal_names": "ZTF24aaaaaaa"}
+
+def test_parse_tns_csv_maps_empty_and_missing_fields_to_none():
+    records = tns_ingest.parse_tns_csv(CSV)
+    assert records[1]["internal_names"] is None
+    assert records[2]["ra"] is None and records[2]["internal_names"] is None
+
+def test_parse_tns_csv_without_rows():
+    assert tns_ingest.parse_tns_csv('"2024-06-01 00:00:00"\n') == []
+
+def test_upsert_replaces_by_name_and_appends_new_objects():
+    catalog = {"data": [{"name": "2024abc", "type": "AT"}, {"name": "2024def", "type": "AT"}]}
+    counts = tns_ingest.upsert_records(catalog, [{"name": "2024def", "type": "SN Ia"}, {"name": "2024xyz"},
+                                                 {"name": None}, {"name": "2024xyz", "type": "SN II"}])
+    assert counts == (1, 2)
+    assert catalog["data"] == [{"name": "2024abc", "type": "AT"}, {"name": "2024def", "type": "SN Ia"},
+                               {"name": "2024xyz", "type": "SN II"}]
+
+def test_legacy_list_catalog_is_dated_by_its_file(tmp_path):
+    cache_file = tmp_path / "tns_cache.json"
+    cache_file.write_text('[{"name": "2024abc"}]')
+    os.utime(cache_file, (1717200000, 1717200000))  # 2024-06-01 UTC
+    catalog = tns_ingest.load_catalog(str(cache_file))
+    assert catalog["total_objects"] == 1
+    assert abs(tns_ingest.get_watermark(catalog) - date(2024, 6, 1)).days <= 1
+
+def test_refresh_rebuilds_the_served_snapshot(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # The derived files default to paths relative to the project root
+    cache_file = tmp_path / "tns_cache.json"
+    cache_file.write_text('{"data": [{"name": "2024abc"}]}')
+    tns_ingest.refresh_derived(str(cache_file))
+    meta = json.loads((tmp_path / "tns_snapshot" / "meta.json").read_text())
+    assert json.loads((tmp_path / "tns_snapshot" / meta["file"]).read_text())["data"] == [{"name": "2024abc"}]
+    tns_ingest.refresh_derived(str(cache_file))
+    assert json.loads((tmp_path / "tns_snapshot" / "meta.json").read_text())["generation"] == meta["generation"] + 1
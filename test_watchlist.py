@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# Behaviour tests for the watchlist's change detection and watermark trimming
+import pytest
+
+import resilience
+import watchlist
+
+@pytest.fixture(autouse=True)
+def state_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(resilience, "STATE_DIR", str(tmp_path))
+
+class FakeAlerce:
+    def __init__(self, objects=(), detections=(), non_detections=()):
+        self.objects, self.detections, self.non_detections = list(objects), list(detections), list(non_detections)
+
+    def query_objects(self, oid, page_size, format):
+        return [obj for obj in self.objects if obj["oid"] in oid]
+
+    def query_detections(self, oid, format):
+        return self.detections
+
+    def query_non_detections(self, oid, format):
+        return self.non_detections
+
+def test_merge_points_drops_duplicates_and_sorts():
+    existing = [{"mjd": 2.0, "fid": 1}, {"mjd": 1.0, "fid": 1}]
+    merged = watchlist.merge_points(existing, [{"mjd": 2.0, "fid": 1}, {"mjd": 1.5, "fid": 2}], ["mjd", "fid"])
+    assert [(p["mjd"], p["fid"]) for p in merged] == [(1.0, 1), (1.5, 2), (2.0, 1)]
+
+def test_find_changed_objects_compares_lastmjd_with_watermark():
+    entries = [dict(watchlist.new_entry("ZTF21aaaaaaa"), last_mjd=100.0),
+               dict(watchlist.new_entry("ZTF21bbbbbbb"), last_mjd=100.0),
+               watchlist.new_entry("ZTF21ccccccc")]
+    client = FakeAlerce(objects=[{"oid": "ZTF21aaaaaaa", "lastmjd": 100.0},
+                                 {"oid": "ZTF21bbbbbbb", "lastmjd": 101.0},
+                                 {"oid": "ZTF21ccccccc", "lastmjd": 50.0}])
+    changed = watchlist.find_changed_objects(client, entries)
+    assert [entry["ztf_id"] for entry in changed] == ["ZTF21bbbbbbb", "ZTF21ccccccc"]
+
+def test_fetch_alerce_updates_keeps_points_past_watermark():
+    client = FakeAlerce(detections=[{"mjd": 99.0, "magpsf": 18, "sigmapsf": 0.1, "fid": 1},
+                                    {"mjd": 101.0, "magpsf": 18, "sigmapsf": 0.1, "fid": 1}],
+                        non_detections=[{"mjd": 100.0, "diffmaglim": 20, "fid": 2},
+                                        {"mjd": 100.5, "diffmaglim": 20, "fid": 2}])
+    entry = dict(watchlist.new_entry("ZTF21aaaaaaa"), last_mjd=100.0)
+    detections, non_detections = watchlist.fetch_alerce_updates(client, entry)
+    assert [d["mjd"] for d in detections] == [101.0]
+    assert [nd["mjd"] for nd in non_detections] == [100.5]
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Memory-Mapped TNS Catalog
+A read-only columnar snapshot of tns_cache.json that worker processes map
+instead of each json.load-ing the whole catalog into its own heap.
+
+Each refresh writes a new generation, an uncompressed Arrow IPC file
+(gen-<n>.arrow) holding every TNS field as text plus parsed ra_deg/dec_deg,
+a normalized name key and the ZTF ID. It then atomically replaces the
+CURRENT pointer. Readers memory-map the file (zero-copy, so every process
+shares the same pages in the OS page cache) and check the pointer with one
+stat per access, so a new generation is picked up without a restart.
+Older generations are pruned; a worker still mapping one keeps its pages
+until it moves on. Full passes over the catalog (the alias index and
+record store builds, prefetch, bulk export, the /api/tns-data body) read
+their records from here through load_catalog_records.
+
+Usage:
+    python tns_catalog.py '{"action": "build"}'
+    python tns_catalog.py '{"action": "lookup", "name": "2024abc"}'
+    python tns_catalog.py '{"action": "cone", "ra": 150.1, "dec": 2.2, "radius": 5}'
+"""
+import os
+import sys
+import json
+import math
+import fcntl
+import threading
+
+from alias_index import (TNS_CACHE_FILE, ZTF_NAME_PATTERN, load_tns_cache, load_tns_records, normalize_name,
+                         parse_coordinate, split_internal_names)
+
+CATALOG_DIR = os.environ.get("TNS_CATALOG_DIR", "tns_catalog")
+CURRENT_FILE = "CURRENT"
+LOCK_FILE = ".lock"
+KEEP_GENERATIONS = 2  # The current generation and the one before it
+DERIVED_COLUMNS = ["name_key", "ztf_id", "ra_deg", "dec_deg"]
+RECORD_BATCH_ROWS = 10000  # Rows decoded into dicts at a time when iterating the records
+
+_lock = threading.Lock()
+_catalog = None  # Snapshot mapped by this process
+_pointer_key = None  # (inode, mtime) of the CURRENT file _catalog was opened from
+
+def pointer_path(catalog_dir=CATALOG_DIR):
+    return os.path.join(catalog_dir, CURRENT_FILE)
+
+def read_pointer(catalog_dir=CATALOG_DIR):
+    """The CURRENT pointer (generation, file, source mtime, rows), or None"""
+    try:
+        with open(pointer_path(catalog_dir), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def snapshot_is_stale(catalog_dir=CATALOG_DIR, tns_file=TNS_CACHE_FILE):
+    """True if there is no snapshot, it was taken from another file, or tns_cache.json changed after it was taken"""
+    pointer = read_pointer(catalog_dir)
+    if pointer is None or not os.path.exists(os.path.join(catalog_dir, pointer["file"])):
+        return True
+    if pointer.get("source", os.path.abspath(tns_file)) != os.path.abspath(tns_file):
+        return True
+    return os.path.exists(tns_file) and os.path.getmtime(tns_file) > pointer["source_mtime"]
+
+def build_table(records):
+    """Arrow table for TNS records: text columns as published plus derived lookup columns"""
+    import pyarrow as pa
+
+    fields = []
+    for record in records:
+        for field in record:
+            if field not in fields and field not in DERIVED_COLUMNS:
+                fields.append(field)
+    columns = {field: pa.array([None if record.get(field) is None else str(record.get(field)) for record in records],
+                               pa.string())
+               for field in fields}
+    ztf_ids = [next((alias for alias in split_internal_names(record.get("internal_names"))
+                     if ZTF_NAME_PATTERN.match(alias)), None) for record in records]
+    coordinates = [(parse_coordinate(record.get("ra"), True), parse_coordinate(record.get("declination", record.get("dec")), False))
+                   for record in records]
+    columns["name_key"] = pa.array([normalize_name(record.get("name") or "") for record in records], pa.string())
+    columns["ztf_id"] = pa.array(ztf_ids, pa.string())
+    # NaN rather than null for missing positions, so the columns map straight into numpy
+    columns["ra_deg"] = pa.array([math.nan if ra is None else ra for ra, _ in coordinates], pa.float64())
+    columns["dec_deg"] = pa.array([math.nan if dec is None else dec for _, dec in coordinates], pa.float64())
+    return pa.table(columns)
+
+def write_catalog_snapshot(tns_file=TNS_CACHE_FILE, catalog_dir=CATALOG_DIR, records=None, header=None,
+                           force=False):
+    """Write a new catalog generation and make it current.
+
+    ``records`` (and the cache ``header``, see alias_index.load_tns_cache)
+    may be passed by a caller that already holds the catalog (e.g. right
+    after an ingest); otherwise tns_cache.json is read. Writers are
+    serialized by an flock and staleness is re-checked once it is held, so
+    concurrent callers write one generation; ``force`` writes one anyway.
+    The generation file is complete and fsynced before the pointer moves to it.
+    """
+    import pyarrow as pa
+
+    os.makedirs(catalog_dir, exist_ok=True)
+    with open(os.path.join(catalog_dir, LOCK_FILE), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if not force and not snapshot_is_stale(catalog_dir, tns_file):
+            return read_pointer(catalog_dir)
+        source_mtime = os.path.getmtime(tns_file) if os.path.exists(tns_file) else 0
+        if records is None:
+            header, records = load_tns_cache(tns_file)
+        table = build_table(records).combine_chunks()
+        previous = read_pointer(catalog_dir)
+        generation = (previous["generation"] + 1) if previous else 1
+        file_name = f"gen-{generation:06d}.arrow"
+        path = os.path.join(catalog_dir, file_name)
+        tmp_path = f"{path}.tmp"
+        with pa.OSFile(tmp_path, 'wb') as sink:
+            # One uncompressed record batch: every column is a single contiguous buffer
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table, max_chunksize=max(table.num_rows, 1))
+        with open(tmp_path, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+        pointer = {"generation": generation, "file": file_name, "source": os.path.abspath(tns_file),
+                   "source_mtime": source_mtime, "rows": table.num_rows, "header": header}
+        tmp_pointer = f"{pointer_path(catalog_dir)}.tmp"
+        with open(tmp_pointer, 'w') as f:
+            json.dump(pointer, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_pointer, pointer_path(catalog_dir))
+
+        for name in sorted(os.listdir(catalog_dir)):
+            if name.startswith("gen-") and name.endswith(".arrow") and \
+                    int(name[4:10]) <= generation - KEEP_GENERATIONS:
+                os.remove(os.path.join(catalog_dir, name))
+        print(f"TNS catalog: Wrote generation {generation} ({table.num_rows} objects)", file=sys.stderr)
+        return pointer
+
+class CatalogSnapshot:
+    """One mapped catalog generation. Column data stays in the mapped file."""
+
+    def __init__(self, path, generation, header=None):
+        import pyarrow as pa
+
+        self.generation = generation
+        self.header = header  # tns_cache.json fields besides the records (None for a legacy cache)
+        self.source = pa.memory_map(path, 'r')
+        self.table = pa.ipc.open_file(self.source).read_all()
+        self._numpy = {}
+
+    def __len__(self):
+        return self.table.num_rows
+
+    def __iter__(self):
+        """TNS records in catalog order, decoded a batch of rows at a time"""
+        fields = [name for name in self.table.column_names if name not in DERIVED_COLUMNS]
+        for batch in self.table.select(fields).to_batches(max_chunksize=RECORD_BATCH_ROWS):
+            yield from batch.to_pylist()
+
+    def column(self, name):
+        """A float column as a zero-copy numpy view, any other column as an Arrow array"""
+        if name not in self._numpy:
+            array = self.table.column(name).chunk(0) if self.table.num_rows else self.table.column(name).combine_chunks()
+            if name in ("ra_deg", "dec_deg"):
+                array = array.to_numpy(zero_copy_only=True)
+            self._numpy[name] = array
+        return self._numpy[name]
+
+    def row(self, index):
+        """TNS record (the published text fields) for one row"""
+        return {name: self.table.column(name)[index].as_py()
+                for name in self.table.column_names if name not in DERIVED_COLUMNS}
+
+    def find_name(self, name):
+        """Row indices matching a TNS name (any prefix form) or a ZTF ID"""
+        import pyarrow.compute as pc
+
+        name = str(name).strip()
+        if ZTF_NAME_PATTERN.match(name):
+            mask = pc.equal(self.column("ztf_id"), name)
+        else:
+            mask = pc.equal(self.column("name_key"), normalize_name(name))
+        return pc.indices_nonzero(pc.fill_null(mask, False)).to_pylist()
+
+    def cone(self, ra, dec, radius_arcsec):
+        """(row index, separation in arcsec) pairs within a radius, closest first"""
+        import numpy as np
+
+        ra_deg, dec_deg = self.column("ra_deg"), self.column("dec_deg")
+        radius_deg = radius_arcsec / 3600.0
+        candidates = np.flatnonzero(np.abs(dec_deg - dec) <= radius_deg)
+        if candidates.size == 0:
+            return []
+        ra1, dec1 = np.radians(ra_deg[candidates]), np.radians(dec_deg[candidates])
+        ra0, dec0 = math.radians(ra), math.radians(dec)
+        # Haversine separation
+        a = np.sin((dec1 - dec0) / 2) ** 2 + math.cos(dec0) * np.cos(dec1) * np.sin((ra1 - ra0) / 2) ** 2
+        separation = np.degrees(2 * np.arcsin(np.sqrt(np.clip(a, 0, 1)))) * 3600
+        inside = separation <= radius_arcsec
+        order = np.argsort(separation[inside])
+        return [(int(i), round(float(s), 3)) for i, s in zip(candidates[inside][order], separation[inside][order])]
+
+def get_catalog(catalog_dir=CATALOG_DIR, tns_file=TNS_CACHE_FILE, rebuild=True):
+    """The current catalog generation, mapped once per process and per generation.
+
+    Rebuilds the snapshot first when tns_cache.json is newer than it (unless
+    ``rebuild`` is False). Returns None when there is no catalog at all.
+    """
+    global _catalog, _pointer_key
+    if rebuild and snapshot_is_stale(catalog_dir, tns_file) and os.path.exists(tns_file):
+        write_catalog_snapshot(tns_file, catalog_dir)
+    try:
+        stat = os.stat(pointer_path(catalog_dir))
+    except OSError:
+        return None
+    key = (stat.st_ino, stat.st_mtime_ns)
+    with _lock:
+        if _catalog is None or key != _pointer_key:
+            pointer = read_pointer(catalog_dir)
+            if pointer is None:
+                return _catalog
+            _catalog = CatalogSnapshot(os.path.join(catalog_dir, pointer["file"]), pointer["generation"],
+                                       pointer.get("header"))
+            _pointer_key = key
+        return _catalog
+
+def load_catalog_records(tns_file=TNS_CACHE_FILE, catalog_dir=CATALOG_DIR):
+    """TNS records for a full pass over the catalog, read from the mapped snapshot.
+
+    Returns the current CatalogSnapshot (iterable, with a length) so the
+    records are decoded batch by batch instead of parsed from JSON into the
+    caller's heap. Falls back to reading tns_cache.json while there is no
+    current snapshot, e.g. between a rewrite by server.js and its reindex.
+    """
+    if not snapshot_is_stale(catalog_dir, tns_file):
+        catalog = get_catalog(catalog_dir, tns_file, rebuild=False)
+        if catalog is not None:
+            return catalog
+    return load_tns_records(tns_file)
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python tns_catalog.py '<json_args>'")
+        sys.exit(1)
+
+    try:
+        args = json.loads(sys.argv[1])
+        action = args.get('action', 'build')
+        if action == 'build':
+            result = {"success": True, "data": write_catalog_snapshot(force=True)}
+        elif action in ('lookup', 'cone'):
+            catalog = get_catalog()
+            if catalog is None:
+                result = {"success": False, "error": "No TNS catalog available"}
+            elif action == 'lookup':
+                result = {"success": True, "data": [catalog.row(i) for i in catalog.find_name(args.get('name', ''))]}
+            else:
+                matches = catalog.cone(float(args['ra']), float(args['dec']), float(args.get('radius', 2.0)))
+                result = {"success": True, "data": [dict(catalog.row(i), separation_arcsec=s) for i, s in matches]}
+        else:
+            result = {"success": False, "error": f"Unknown action: {action}"}
+        print(json.dumps(result))
+
+    except Exception as e:
+        error_result = {"success": False, "error": f"Script error: {str(e)}"}
+        print(json.dumps(error_result))
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Incremental TNS Catalog Ingestion
+Keeps tns_cache.json current by applying TNS's daily delta CSVs (objects
+added or modified on a given day) as upserts keyed by object name, instead
+of re-downloading the full catalog every time.
+
+A full reload is done only when there is no local catalog, when it is older
+than MAX_DELTA_DAYS, or when a past delta file is missing. The date of the
+last delta applied is stored as a watermark in the catalog itself.
+
+Usage:
+    TNS_ID=... TNS_USERNAME=... python tns_ingest.py
+    python tns_ingest.py '{"full": true}'
+    python tns_ingest.py '{"action": "reindex"}'   # after tns_cache.json was rewritten elsewhere
+"""
+import io
+import os
+import sys
+import csv
+import json
+import zipfile
+from datetime import datetime, timedelta
+
+from resilience import create_session
+
+TNS_CACHE_FILE = "tns_cache.json"
+TNS_FULL_URL = "https://www.wis-tns.org/system/files/tns_public_objects/tns_public_objects.csv.zip"
+# Daily delta: objects added or modified on that (UTC) date
+TNS_DELTA_URL = "https://www.wis-tns.org/system/files/tns_public_objects/tns_public_objects_{date}.csv.zip"
+MAX_DELTA_DAYS = 10  # Older local catalogs are reloaded in full
+FULL_TIMEOUT = 300
+DELTA_TIMEOUT = 60
+
+def get_user_agent(tns_id=None, tns_username=None):
+    """TNS bot/user marker, as sent by server.js"""
+    if tns_id and tns_username:
+        return f'tns_marker{{"tns_id":{tns_id},"type": "user", "name":"{tns_username}"}}'
+    return 'tns_marker{"type": "user", "name":"metabroker"}'
+
+def parse_tns_csv(content):
+    """Records from a TNS CSV export (first line is a timestamp, second the header).
+
+    Values are kept as strings and empty fields become None, matching the
+    records server.js writes.
+    """
+    lines = [line for line in content.splitlines() if line.strip()]
+    if len(lines) < 2:
+        return []
+    reader = csv.reader(lines[1:])
+    header = [column.strip() for column in next(reader)]
+    records = []
+    for values in reader:
+        records.append({column: (values[i].strip() or None) if i < len(values) else None
+                        for i, column in enumerate(header)})
+    return records
+
+def download_csv(session, url, user_agent, timeout):
+    """Download a zipped TNS CSV and return its records, or None if the file does not exist"""
+    response = session.post(url, headers={"User-Agent": user_agent, "Accept": "*/*"}, timeout=timeout)
+    if response.status_code == 404:
+        return None
+    if response.status_code != 200:
+        raise RuntimeError(f"TNS HTTP {response.status_code} for {url}")
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        csv_name = next((name for name in archive.namelist() if name.endswith('.csv')), None)
+        if csv_name is None:
+            raise RuntimeError(f"No CSV file found in {url}")
+        return parse_tns_csv(archive.read(csv_name).decode('utf-8'))
+
+def load_catalog(cache_file=TNS_CACHE_FILE):
+    """The local catalog in the current format, or None if there is none"""
+    if not os.path.exists(cache_file):
+        return None
+    with open(cache_file, 'r') as f:
+        cache_data = json.load(f)
+    if isinstance(cache_data, list):
+        # Legacy format: a bare list, dated by the file itself
+        mtime = datetime.fromtimestamp(os.path.getmtime(cache_file))
+        cache_data = {"last_updated": mtime.isoformat(), "download_date": mtime.strftime('%Y-%m-%d'),
+                      "total_objects": len(cache_data), "data": cache_data}
+    return cache_data
+
+def save_catalog(catalog, cache_file=TNS_CACHE_FILE):
+    """Atomically write the catalog in the format server.js reads, then its mapped snapshot"""
+    catalog["last_updated"] = datetime.utcnow().isoformat() + "Z"
+    catalog["total_objects"] = len(catalog["data"])
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump(catalog, f)
+    os.replace(tmp_file, cache_file)
+    refresh_derived(cache_file, catalog["data"], {key: value for key, value in catalog.items() if key != "data"})
+
+def refresh_derived(cache_file=TNS_CACHE_FILE, records=None, header=None):
+    """Rebuild what is derived from tns_cache.json after it was rewritten.
+
+    Runs on the refresh path (after an ingest here, and spawned by server.js
+    after its own download) so request handlers only ever read the results;
+    this includes the precompressed snapshot api/tns-data.py serves.
+    The mapped catalog is written first; without ``records`` the other
+    builders then read their rows from it instead of parsing the JSON again.
+    """
+    try:
+        # New generation of the memory-mapped catalog the Python workers read
+        from tns_catalog import write_catalog_snapshot
+        write_catalog_snapshot(cache_file, records=records, header=header)
+    except Exception as e:
+        print(f"TNS ingest: Could not write the catalog snapshot: {str(e)}", file=sys.stderr)
+    try:
+        from alias_index import build_alias_index
+        build_alias_index(cache_file, records=records)
+    except Exception as e:
+        print(f"TNS ingest: Could not rebuild the alias index: {str(e)}", file=sys.stderr)
+    try:
+        from record_store import sync_record_store
+        sync_record_store(cache_file, records)
+    except Exception as e:
+        print(f"TNS ingest: Could not sync the record store: {str(e)}", file=sys.stderr)
+    try:
+        # Precompressed /api/tns-data body, so no request pays for serializing the catalog
+        load_tns_data_api().build_snapshot(cache_file, force=True)
+    except Exception as e:
+        print(f"TNS ingest: Could not rebuild the TNS data snapshot: {str(e)}", file=sys.stderr)
+
+def load_tns_data_api():
+    """The api/tns-data.py module (its file name is not importable)"""
+    import importlib.util
+
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "api", "tns-data.py")
+    spec = importlib.util.spec_from_file_location("tns_data", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def get_watermark(catalog):
+    """Last date the catalog is known to be complete for: the last delta applied or the full download date"""
+    value = catalog.get("delta_watermark") or catalog.get("download_date")
+    try:
+        return datetime.strptime(value[:10], '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None
+
+def upsert_records(catalog, records):
+    """Insert or replace records by object name; returns (inserted, updated)"""
+    index = {record.get("name"): i for i, record in enumerate(catalog["data"])}
+    inserted = updated = 0
+    for record in records:
+        name = record.get("name")
+        if not name:
+            continue
+        if name in index:
+            catalog["data"][index[name]] = record
+            updated += 1
+        else:
+            index[name] = len(catalog["data"])
+            catalog["data"].append(record)
+            inserted += 1
+    return inserted, updated
+
+def full_reload(session, user_agent, cache_file=TNS_CACHE_FILE):
+    """Download the full catalog and replace the local copy"""
+    print("TNS ingest: Downloading full catalog", file=sys.stderr)
+    records = download_csv(session, TNS_FULL_URL, user_agent, FULL_TIMEOUT)
+    if not records:
+        raise RuntimeError("No valid results parsed from the full TNS CSV")
+    today = datetime.utcnow().date()
+    catalog = {"download_date": today.isoformat(), "delta_watermark": today.isoformat(), "data": records}
+    save_catalog(catalog, cache_file)
+    return {"mode": "full", "total_objects": len(records), "watermark": today.isoformat()}
+
+def ingest_tns(tns_id=None, tns_username=None, full=False, cache_file=TNS_CACHE_FILE, max_delta_days=MAX_DELTA_DAYS):
+    """Bring the local TNS catalog up to date.
+
+    Applies every daily delta from the watermark date (inclusive, since that
+    day may have changed after it was ingested) up to today. Deltas that are
+    not published yet (today, possibly yesterday) end the run without moving
+    the watermark past them; a missing older delta forces a full reload.
+    """
+    try:
+        session = create_session()
+        user_agent = get_user_agent(tns_id, tns_username)
+        catalog = None if full else load_catalog(cache_file)
+        watermark = get_watermark(catalog) if catalog else None
+        today = datetime.utcnow().date()
+
+        if catalog is None or watermark is None or (today - watermark).days > max_delta_days:
+            reason = "requested" if full else "no usable local catalog" if watermark is None else f"catalog older than {max_delta_days} days"
+            print(f"TNS ingest: Full reload ({reason})", file=sys.stderr)
+            return {"success": True, "data": full_reload(session, user_agent, cache_file)}
+
+        applied = []
+        inserted = updated = 0
+        day = watermark
+        while day <= today:
+            records = download_csv(session, TNS_DELTA_URL.format(date=day.strftime('%Y%m%d')), user_agent, DELTA_TIMEOUT)
+            if records is None:
+                if (today - day).days <= 1:
+                    print(f"TNS ingest: Delta for {day} not published yet", file=sys.stderr)
+                    break
+                print(f"TNS ingest: Delta for {day} is missing, falling back to a full reload", file=sys.stderr)
+                return {"success": True, "data": full_reload(session, user_agent, cache_file)}
+            day_inserted, day_updated = upsert_records(catalog, records)
+            inserted += day_inserted
+            updated += day_updated
+            applied.append(day.isoformat())
+            catalog["delta_watermark"] = day.isoformat()
+            day += timedelta(days=1)
+
+        if applied:
+            catalog["download_date"] = catalog["delta_watermark"]
+            save_catalog(catalog, cache_file)
+        print(f"TNS ingest: Applied {len(applied)} deltas ({inserted} new, {updated} updated objects)", file=sys.stderr)
+        return {"success": True, "data": {
+            "mode": "delta", "applied": applied, "inserted": inserted, "updated": updated,
+            "total_objects": len(catalog["data"]), "watermark": catalog.get("delta_watermark")
+        }}
+    except Exception as e:
+        print(f"TNS ingest: Error: {str(e)}", file=sys.stderr)
+        return {"success": False, "error": str(e)}
+
+if __name__ == "__main__":
+    args = json.loads(sys.argv[1]) if len(sys.argv) > 1 else {}
+    if args.get('action') == 'reindex':
+        # tns_cache.json was rewritten elsewhere (server.js): rebuild the derived indexes only
+        refresh_derived()
+        print(json.dumps({"success": True}))
+        sys.exit(0)
+    result = ingest_tns(
+        tns_id=args.get('tns_id') or os.environ.get('TNS_ID'),
+        tns_username=args.get('tns_username') or os.environ.get('TNS_USERNAME'),
+        full=args.get('full', False),
+        max_delta_days=args.get('max_delta_days', MAX_DELTA_DAYS)
+    )
+    print(json.dumps(result))
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Watchlist Monitor
+Keeps stored light curves for monitored ZTF objects up to date. One batched
+ALeRCE call per batch finds the objects with alerts newer than their stored
+watermark; objects without new alerts cost nothing more.
+
+Neither the ALeRCE detection/non-detection endpoints nor Fink's /objects
+endpoint take a since filter, so an object that did change still has its
+full history downloaded, and only the points past its watermark are merged.
+The saving is in not refetching unchanged objects, not in the size of each
+changed object's download.
+"""
+import os
+import sys
+import json
+from datetime import datetime
+
+from alerce.core import Alerce
+
+from broker_client import (
+    ALERCE_HOST, FINK_BASE_URL, FINK_COLUMNS, format_alerce_detections,
+    format_alerce_non_detections, get_session, is_ztf_id
+)
+from feature_store import update_features
+from resilience import guard
+
+WATCHLIST_DIR = "watchlist_cache"
+WATCHLIST_BATCH_SIZE = 50  # Objects per batched ALeRCE/Fink request
+FINK_WATCHLIST_COLUMNS = ["i:objectId"] + FINK_COLUMNS
+
+def ensure_watchlist_dir():
+    """Ensure the watchlist directory exists"""
+    if not os.path.exists(WATCHLIST_DIR):
+        os.makedirs(WATCHLIST_DIR)
+
+def get_entry_file(ztf_id):
+    """Path of the stored entry for one object"""
+    return os.path.join(WATCHLIST_DIR, f"{ztf_id}.json")
+
+def new_entry(ztf_id):
+    """Empty watchlist entry; None watermarks mean the full history is fetched once"""
+    return {
+        "ztf_id": ztf_id,
+        "last_mjd": None,
+        "last_jd": None,
+        "detections": [],
+        "non_detections": [],
+        "fink_alerts": [],
+        "added_at": datetime.now().isoformat(),
+        "updated_at": None
+    }
+
+def load_entry(ztf_id):
+    """Load a stored watchlist entry, or None if the object is not watched"""
+    entry_file = get_entry_file(ztf_id)
+    if not os.path.exists(entry_file):
+        return None
+    try:
+        with open(entry_file, 'r') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Watchlist: Error loading entry for {ztf_id}: {e}", file=sys.stderr)
+        return None
+
+def save_entry(entry):
+    """Atomically write a watchlist entry"""
+    ensure_watchlist_dir()
+    entry_file = get_entry_file(entry["ztf_id"])
+    tmp_file = f"{entry_file}.tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump(entry, f)
+    os.replace(tmp_file, entry_file)
+
+def list_watchlist():
+    """ZTF IDs of all watched objects"""
+    if not os.path.exists(WATCHLIST_DIR):
+        return []
+    return sorted(name[:-5] for name in os.listdir(WATCHLIST_DIR) if name.endswith('.json'))
+
+def add_to_watchlist(ztf_ids):
+    """Start watching objects; existing entries are left untouched"""
+    added = []
+    for ztf_id in ztf_ids:
+        if not is_ztf_id(ztf_id):
+            print(f"Watchlist: Skipping non-ZTF name {ztf_id}", file=sys.stderr)
+            continue
+        if load_entry(ztf_id) is None:
+            save_entry(new_entry(ztf_id))
+            added.append(ztf_id)
+    return {"success": True, "data": {"added": added, "total": len(list_watchlist())}}
+
+def remove_from_watchlist(ztf_ids):
+    """Stop watching objects and drop their stored light curves"""
+    removed = []
+    for ztf_id in ztf_ids:
+        entry_file = get_entry_file(ztf_id)
+        if os.path.exists(entry_file):
+            os.remove(entry_file)
+            removed.append(ztf_id)
+    return {"success": True, "data": {"removed": removed}}
+
+def merge_points(existing, new_points, key_fields):
+    """Merge new points into a stored list, dropping duplicates, sorted by time"""
+    seen = {tuple(point.get(field) for field in key_fields) for point in existing}
+    merged = list(existing)
+    for point in new_points:
+        key = tuple(point.get(field) for field in key_fields)
+        if key not in seen:
+            seen.add(key)
+            merged.append(point)
+    time_field = key_fields[0]
+    merged.sort(key=lambda point: point.get(time_field) or 0)
+    return merged
+
+def find_changed_objects(alerce_client, entries):
+    """Return the entries whose ALeRCE lastmjd is newer than the stored watermark.
+
+    One batched query_objects call returns lastmjd for the whole batch, so
+    objects without new alerts cost nothing beyond that call.
+    """
+    oids = [entry["ztf_id"] for entry in entries]
+    with guard("alerce", ALERCE_HOST):
+        objects = alerce_client.query_objects(oid=oids, page_size=len(oids), format="json") or []
+    last_mjds = {obj.get("oid"): obj.get("lastmjd") for obj in objects}
+    changed = []
+    for entry in entries:
+        last_mjd = last_mjds.get(entry["ztf_id"])
+        if last_mjd is None:
+            continue
+        if entry["last_mjd"] is None or last_mjd > entry["last_mjd"]:
+            changed.append(entry)
+    return changed
+
+def fetch_alerce_updates(alerce_client, entry):
+    """ALeRCE detections and non-detections newer than the entry's last_mjd.
+
+    The API has no since filter: the full history is downloaded and trimmed here.
+    """
+    last_mjd = entry["last_mjd"]
+    with guard("alerce", ALERCE_HOST):
+        detections = format_alerce_detections(alerce_client.query_detections(oid=entry["ztf_id"], format="json"))
+        non_detections = format_alerce_non_detections(alerce_client.query_non_detections(oid=entry["ztf_id"], format="json"))
+    if last_mjd is not None:
+        detections = [d for d in detections if d["mjd"] is not None and d["mjd"] > last_mjd]
+        non_detections = [nd for nd in non_detections if nd["mjd"] is not None and nd["mjd"] > last_mjd]
+    return detections, non_detections
+
+def fetch_fink_updates(entries):
+    """Fetch Fink alerts for a batch of objects in one request, keeping only unseen ones.
+
+    Fink's /objects endpoint has no since filter, so every alert of the batch
+    is downloaded and those at or before each object's last_jd are dropped.
+    Returns a dict of objectId -> new alerts.
+    """
+    response = get_session().post(
+        f"{FINK_BASE_URL}/objects",
+        json={
+            "objectId": ",".join(entry["ztf_id"] for entry in entries),
+            "output-format": "json",
+            "columns": ",".join(FINK_WATCHLIST_COLUMNS)
+        },
+        timeout=30
+    )
+    if response.status_code != 200:
+        raise RuntimeError(f"Fink HTTP {response.status_code}")
+    last_jds = {entry["ztf_id"]: entry["last_jd"] for entry in entries}
+    new_alerts = {ztf_id: [] for ztf_id in last_jds}
+    for alert in response.json() or []:
+        ztf_id = alert.get("i:objectId")
+        if ztf_id not in new_alerts:
+            continue
+        jd = alert.get("i:jd")
+        if jd is None:
+            continue
+        if last_jds[ztf_id] is None or jd > last_jds[ztf_id]:
+            new_alerts[ztf_id].append(alert)
+    return new_alerts
+
+def refresh_watchlist(ztf_ids=None, batch_size=WATCHLIST_BATCH_SIZE, include_fink=True):
+    """Run one refresh cycle over the watchlist.
+
+    Objects are processed in batches: a single ALeRCE call per batch finds the
+    objects with new alerts, and only those get their histories fetched (per
+    object from ALeRCE, per batch from Fink) and the new points merged into
+    storage.
+
+    Returns a dict mapping each refreshed ZTF ID to its new point counts.
+    """
+    try:
+        ztf_ids = ztf_ids or list_watchlist()
+        entries = []
+        for ztf_id in ztf_ids:
+            entry = load_entry(ztf_id)
+            if entry is None:
+                print(f"Watchlist: {ztf_id} is not on the watchlist", file=sys.stderr)
+                continue
+            entries.append(entry)
+        if not entries:
+            return {"success": True, "data": {}}
+
+        alerce_client = Alerce()
+        summary = {}
+        errors = {}
+        batch_size = max(1, int(batch_size))
+        for start in range(0, len(entries), batch_size):
+            batch = entries[start:start + batch_size]
+            try:
+                changed = find_changed_objects(alerce_client, batch)
+            except Exception as e:
+                print(f"Watchlist: ALeRCE change check failed for batch at {start}: {str(e)}", file=sys.stderr)
+                changed = batch
+            print(f"Watchlist: {len(changed)} of {len(batch)} objects have new alerts", file=sys.stderr)
+            if not changed:
+                continue
+
+            fink_updates = {}
+            if include_fink:
+                try:
+                    fink_updates = fetch_fink_updates(changed)
+                except Exception as e:
+                    print(f"Watchlist: Fink batch fetch failed: {str(e)}", file=sys.stderr)
+
+            for entry in changed:
+                ztf_id = entry["ztf_id"]
+                try:
+                    detections, non_detections = fetch_alerce_updates(alerce_client, entry)
+                except Exception as e:
+                    print(f"Watchlist: ALeRCE update failed for {ztf_id}: {str(e)}", file=sys.stderr)
+                    errors[ztf_id] = str(e)
+                    continue
+                fink_alerts = fink_updates.get(ztf_id, [])
+
+                entry["detections"] = merge_points(entry["detections"], detections, ["mjd", "fid"])
+                entry["non_detections"] = merge_points(entry["non_detections"], non_detections, ["mjd", "fid"])
+                entry["fink_alerts"] = merge_points(entry["fink_alerts"], fink_alerts, ["i:jd", "i:fid"])
+                mjds = [d["mjd"] for d in detections if d["mjd"] is not None]
+                if mjds:
+                    entry["last_mjd"] = max(mjds + ([entry["last_mjd"]] if entry["last_mjd"] is not None else []))
+                jds = [a["i:jd"] for a in fink_alerts]
+                if jds:
+                    entry["last_jd"] = max(jds + ([entry["last_jd"]] if entry["last_jd"] is not None else []))
+                entry["updated_at"] = datetime.now().isoformat()
+                save_entry(entry)
+
+                summary[ztf_id] = {
+                    "new_detections": len(detections),
+                    "new_non_detections": len(non_detections),
+                    "new_fink_alerts": len(fink_alerts),
+                    "last_mjd": entry["last_mjd"],
+                    "last_jd": entry["last_jd"]
+                }
+
+        if summary:
+            try:
+                update_features({entry["ztf_id"]: entry["detections"] for entry in entries if entry["ztf_id"] in summary})
+            except Exception as e:
+                print(f"Watchlist: Feature update failed: {str(e)}", file=sys.stderr)
+
+        print(f"Watchlist: Refreshed {len(summary)} of {len(entries)} objects", file=sys.stderr)
+        return {"success": True, "data": summary, "errors": errors}
+    except Exception as e:
+        print(f"Watchlist: Refresh error: {str(e)}", file=sys.stderr)
+        return {"success": False, "error": str(e)}
+
+def get_watchlist_lightcurve(ztf_id):
+    """Return the stored light curve for a watched object in get_alerce_lightcurve's format"""
+    entry = load_entry(ztf_id)
+    if entry is None:
+        return {"success": False, "error": f"{ztf_id} is not on the watchlist"}
+    return {"success": True, "data": {
+        "detections": entry["detections"],
+        "non_detections": entry["non_detections"],
+        "fink_alerts": entry["fink_alerts"],
+        "last_mjd": entry["last_mjd"],
+        "updated_at": entry["updated_at"]
+    }}
+
+if __name__ == "__main__":
+    # Command line interface, e.g. for a cron job: '{"action": "refresh"}'
+    if len(sys.argv) != 2:
+        print("Usage: python watchlist.py '<json_args>'")
+        sys.exit(1)
+
+    try:
+        args = json.loads(sys.argv[1])
+        action = args.get('action', 'refresh')
+        ztf_ids = args.get('ztf_ids') or []
+
+        if action == 'add':
+            result = add_to_watchlist(ztf_ids)
+        elif action == 'remove':
+            result = remove_from_watchlist(ztf_ids)
+        elif action == 'list':
+            result = {"success": True, "data": list_watchlist()}
+        elif action == 'lightcurve' and ztf_ids:
+            result = get_watchlist_lightcurve(ztf_ids[0])
+        elif action == 'refresh':
+            result = refresh_watchlist(
+                ztf_ids or None,
+                batch_size=args.get('batch_size', WATCHLIST_BATCH_SIZE),
+                include_fink=args.get('include_fink', True)
+            )
+        else:
+            result = {"success": False, "error": f"Unknown action: {action}"}
+        print(json.dumps(result))
+
+    except Exception as e:
+        error_result = {"success": False, "error": f"Script error: {str(e)}"}
+        print(json.dumps(error_result))